@@ -0,0 +1,284 @@
+"""
+Prueba de carga de punta a punta: cuántas conversaciones de añadir un gasto por segundo aguanta el bot.
+
+Se arranca la Application de verdad, con las mismas piezas que bot.main (requests de build_requests,
+PerUserUpdateProcessor, SqlitePersistence, post_init/post_shutdown y los handlers de
+register_all_handlers), contra la Bot API de mentira. Todos los ficheros (usuarios, categorías, gastos,
+persistencia, trazas y logs) van a un directorio temporal.
+
+--users usuarios sintéticos, todos a la vez, repiten --conversations veces la conversación entera:
+
+    /nuevo_gasto → Gasto → importe → categoría → descripción → quién → Sí
+
+En cada paso el usuario deja el update en getUpdates y espera la respuesta del bot (el mensaje nuevo o
+editado en su chat) antes del siguiente, con una pausa aleatoria de hasta --think segundos.
+
+Se mide:
+    - conversaciones/s y updates/s,
+    - la latencia de cada paso (desde que el update está en getUpdates hasta la respuesta) y de la
+      conversación entera,
+    - la memoria del proceso (RSS) tras una ronda de calentamiento y al final, y cuánto crece por
+      conversación: si no se queda cerca de cero, algo se acumula en user_data o en alguna caché.
+
+Sin --rate-limit no se usa el PriorityRateLimiter: se mide lo que da el bot, no el límite de Telegram.
+
+Uso:
+    python -m benchmarks.bench_conversations --users 50 --conversations 5 --rtt 0.05
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+sys.path.append(str(ROOT / "src")) # el router importa los handlers como handlers.* (como al lanzar src/bot.py)
+from telegram.ext import Application, ApplicationBuilder
+
+from src.testing.fake_bot_api import FakeBotAPI, make_callback_update, make_message_update
+from src.models.expense_repository import SqliteExpenseRepository, expense_repository
+from src.settings import LOG_QUEUE
+from src.utils.category_utils import category_store
+from src.utils.csv_utils import iter_rows_reversed
+from src.utils.log_queue import setup_queue_logging, stop_queue_logging
+from src.utils.metrics import ERRORS_BY_TYPE, Histogram, format_quantiles
+from src.utils.persistence import SqlitePersistence
+from src.utils.rate_limiter import PriorityRateLimiter
+from src.utils.telegram_request import build_requests
+from src.utils.tracing import tracer
+from src.utils.update_processor import PerUserUpdateProcessor
+from src.utils.user_utils import user_registry
+
+FIRST_USER_ID = 10_000
+CATEGORIES = {"gasto": ["Supermercado", "Restaurantes", "Ocio"], "ingreso": ["Nómina"], "quien": ["Jesús", "Ana"]}
+# Histogramas con cubos hasta 1 min: con muchos usuarios una conversación entera tarda segundos
+CONVERSATION_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+def rss_mb() -> float:
+    """Memoria residente del proceso en MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # el pico, no la actual
+
+
+def prepare_sandbox(directory: Path, user_ids: list[int]) -> None:
+    """Apunta los ficheros del bot a directory, con los usuarios ya registrados"""
+    (directory / "logs").mkdir()
+    with open(directory / "categories.json", "w", encoding="utf-8") as f:
+        json.dump(CATEGORIES, f, ensure_ascii=False)
+    with open(directory / "users.json", "w") as f:
+        json.dump(user_ids, f)
+
+    category_store.path = directory / "categories.json"
+    category_store.invalidate()
+    user_registry.path = directory / "users.json"
+    user_registry.load()
+    if isinstance(expense_repository, SqliteExpenseRepository):
+        expense_repository.path = directory / "gastos.db"
+        expense_repository.legacy_csv_path = None
+    else:
+        expense_repository.path = directory / "gastos.csv"
+    tracer.path = directory / "traces.jsonl"
+    os.chdir(directory) # logging.conf escribe en logs/ relativo al directorio actual
+
+
+def build_application(api: FakeBotAPI, directory: Path, rate_limit: bool) -> Application:
+    from src.bot import configure_logging, post_init, post_shutdown
+    from src.handlers.router import register_all_handlers
+
+    # El logging de bot.main: los logs van al fichero, por consola solo sería ruido
+    configure_logging()
+    bot_logger = logging.getLogger("expense_bot")
+    for handler in list(bot_logger.handlers):
+        if type(handler) is logging.StreamHandler:
+            bot_logger.removeHandler(handler)
+
+    request, get_updates_request = build_requests()
+    builder = (
+        ApplicationBuilder()
+        .token("1:load")
+        .base_url(api.base_url)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .persistence(SqlitePersistence(directory / "bot_state.db"))
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if rate_limit:
+        builder = builder.rate_limiter(PriorityRateLimiter())
+    application = builder.build()
+    register_all_handlers(application)
+    return application
+
+
+def conversation_script() -> list[tuple[str, str]]:
+    """Pasos de la conversación de añadir un gasto: (message o callback, texto o callback_data)"""
+    from handlers.conversations.new_enter_expense import ConvState
+    return [
+        ("message", "/nuevo_gasto"),
+        ("callback", str(ConvState.SPENDING_ENTRY)),
+        ("message", "12.5"),
+        ("callback", "Supermercado"),
+        ("message", "Compra de la semana"),
+        ("callback", "Jesús"),
+        ("callback", str(ConvState.YES)),
+    ]
+
+
+class LoadStats:
+    def __init__(self):
+        self.steps = Histogram()
+        self.conversations = Histogram(CONVERSATION_BUCKETS_MS)
+        self.completed = 0
+        self.failed = 0
+        self.updates = 0
+
+
+class SyntheticUser:
+    """Un usuario que hace la conversación paso a paso, esperando la respuesta del bot a cada update"""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, script: list[tuple[str, str]], update_ids: itertools.count,
+                 think: float, timeout: float):
+        self.api = api
+        self.user_id = user_id
+        self.script = script
+        self.update_ids = update_ids
+        self.think = think
+        self.timeout = timeout
+
+    async def _step(self, kind: str, data: str) -> float:
+        update_id = next(self.update_ids)
+        if kind == "message":
+            update = make_message_update(update_id, self.user_id, data)
+        else:
+            update = make_callback_update(update_id, self.user_id, data)
+        expected = self.api.messages_to(self.user_id) + 1
+        started = time.perf_counter()
+        self.api.push_update(update)
+        await self.api.wait_for_messages(self.user_id, expected, self.timeout)
+        return (time.perf_counter() - started) * 1000
+
+    async def converse(self, stats: LoadStats) -> None:
+        started = time.perf_counter()
+        for kind, data in self.script:
+            try:
+                latency = await self._step(kind, data)
+            except asyncio.TimeoutError:
+                stats.failed += 1
+                # Se deja la conversación: /cancel la cierra para poder empezar otra
+                try:
+                    await self._step("message", "/cancel")
+                except asyncio.TimeoutError:
+                    pass
+                return
+            stats.updates += 1
+            stats.steps.observe(latency)
+            if self.think:
+                await asyncio.sleep(random.uniform(0, self.think))
+        stats.completed += 1
+        stats.conversations.observe((time.perf_counter() - started) * 1000)
+
+    async def run(self, conversations: int, stats: LoadStats) -> None:
+        for _ in range(conversations):
+            await self.converse(stats)
+
+
+def saved_expenses() -> str:
+    if not isinstance(expense_repository, SqliteExpenseRepository):
+        if not expense_repository.path.exists():
+            return "0"
+        return str(sum(1 for _ in iter_rows_reversed(expense_repository.path)))
+    with sqlite3.connect(expense_repository.path) as conn:
+        return str(conn.execute("SELECT COUNT(*) FROM gastos").fetchone()[0])
+
+
+async def run_load(args: argparse.Namespace, directory: Path) -> None:
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    prepare_sandbox(directory, user_ids)
+    api = FakeBotAPI(rtt=args.rtt, record_calls=False)
+    await api.start()
+    application = build_application(api, directory, args.rate_limit)
+    script = conversation_script()
+    update_ids = itertools.count(1)
+    users = [SyntheticUser(api, user_id, script, update_ids, args.think, args.timeout) for user_id in user_ids]
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    try:
+        # Calentamiento: una conversación por usuario (cachés, user_data, conexiones) que no se mide
+        await asyncio.gather(*(user.run(1, LoadStats()) for user in users))
+        gc.collect()
+        rss_before, errors_before = rss_mb(), ERRORS_BY_TYPE.total()
+
+        stats = LoadStats()
+        started = time.perf_counter()
+        await asyncio.gather(*(user.run(args.conversations, stats) for user in users))
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        rss_after = rss_mb()
+        errors = ERRORS_BY_TYPE.total() - errors_before
+        user_data_entries = len(application.user_data)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+        await api.stop()
+
+    total = args.users * args.conversations
+    print(f"{args.users} usuarios × {args.conversations} conversaciones ({len(script)} pasos), "
+          f"rtt {args.rtt * 1000:.0f} ms, pausa hasta {args.think * 1000:.0f} ms, "
+          f"rate limiter {'sí' if args.rate_limit else 'no'}")
+    print(f"  conversaciones:  {stats.completed}/{total} en {elapsed:.2f} s, "
+          f"{stats.completed / elapsed:.1f}/s ({stats.failed} sin respuesta a tiempo)")
+    print(f"  updates:         {stats.updates / elapsed:.1f}/s, errores en el error_handler: {errors:.0f}")
+    print(f"  latencia paso         p50/p95/p99 (ms): {format_quantiles(stats.steps)}, máx {stats.steps.max:.1f}")
+    print(f"  latencia conversación p50/p95/p99 (ms): {format_quantiles(stats.conversations)}, "
+          f"máx {stats.conversations.max:.1f}")
+    growth_kb = (rss_after - rss_before) * 1024 / max(stats.completed, 1)
+    print(f"  memoria (RSS):   {rss_before:.1f} MB → {rss_after:.1f} MB, {growth_kb:+.2f} KB por conversación; "
+          f"user_data de {user_data_entries} usuarios")
+    print(f"  gastos guardados: {saved_expenses()} (calentamiento incluido)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="usuarios a la vez")
+    parser.add_argument("--conversations", type=int, default=5, help="conversaciones de cada usuario")
+    parser.add_argument("--rtt", type=float, default=0.05, help="ida y vuelta simulada con Telegram (s)")
+    parser.add_argument("--think", type=float, default=0.0, help="pausa máxima del usuario entre pasos (s)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="espera máxima a la respuesta de un paso (s)")
+    parser.add_argument("--rate-limit", action="store_true", help="con el PriorityRateLimiter del bot")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    if LOG_QUEUE:
+        setup_queue_logging()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-conversations-") as directory:
+            try:
+                asyncio.run(run_load(args, Path(directory)))
+            finally:
+                os.chdir(cwd)
+    finally:
+        stop_queue_logging()
+
+
+if __name__ == "__main__":
+    main()
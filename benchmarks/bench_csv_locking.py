@@ -0,0 +1,148 @@
+"""
+Benchmark de estrés de las escrituras concurrentes al csv de gastos.
+
+Lanza varios procesos que escriben a la vez en el mismo csv con csv_utils.save_expenses (y, si se pide,
+procesos que lo leen hacia atrás mientras tanto) y luego comprueba que:
+    - solo hay una cabecera y está en la primera línea,
+    - están todas las filas, sin repetir,
+    - ninguna fila está cortada ni mezclada con otra (cada descripción se puede reconstruir a partir
+      del escritor y del número de fila, y son largas a propósito para superar PIPE_BUF).
+
+Uso:
+    python -m benchmarks.bench_csv_locking --processes 8 --rows 500 --batch 5 --readers 2
+"""
+import argparse
+import csv
+import multiprocessing
+import sys
+import tempfile
+import time
+
+from itertools import islice
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.expense import Expense
+from src.utils import csv_utils
+
+
+def expected_description(writer_id: int, seq: int) -> str:
+    # Longitud variable (hasta ~9 KB) y con ; y comillas para forzar el entrecomillado del csv
+    return f'w{writer_id}-s{seq};"' + "x" * ((writer_id * 7919 + seq * 104729) % 9000)
+
+
+def make_expense(writer_id: int, seq: int) -> Expense:
+    expense = Expense(writer_id)
+    expense.importe = str(seq)
+    expense.tipo = 'gasto'
+    expense.categoria = 'Bench'
+    expense.descripcion = expected_description(writer_id, seq)
+    expense.quien = 'bench'
+    return expense
+
+
+def _writer(path: str, writer_id: int, rows: int, batch: int, start) -> None:
+    start.wait()
+    for seq in range(0, rows, batch):
+        expenses = [make_expense(writer_id, s) for s in range(seq, min(seq + batch, rows))]
+        csv_utils.save_expenses(expenses, Path(path))
+
+
+def _reader(path: str, start, done, malformed) -> None:
+    # Como el bot: lee la cola del fichero (las últimas filas) cada poco tiempo
+    start.wait()
+    while not done.is_set():
+        if Path(path).exists():
+            for row in islice(csv_utils.iter_rows_reversed(Path(path)), 50):
+                writer_id, seq = int(row[0]), int(float(row[2]))
+                if row[5] != expected_description(writer_id, seq):
+                    with malformed.get_lock():
+                        malformed.value += 1
+        time.sleep(0.005)
+
+
+def verify(path: Path, processes: int, rows: int) -> dict:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        all_rows = list(csv.reader(f, delimiter=";"))
+
+    headers = sum(1 for row in all_rows if row == csv_utils.CSV_HEADER)
+    seen, torn, duplicated = set(), 0, 0
+    for row in all_rows[1:]:
+        if len(row) != len(csv_utils.CSV_HEADER):
+            torn += 1
+            continue
+        try:
+            key = (int(row[0]), int(float(row[2])))
+        except ValueError:
+            torn += 1
+            continue
+        if row[5] != expected_description(*key):
+            torn += 1
+        elif key in seen:
+            duplicated += 1
+        else:
+            seen.add(key)
+
+    return {
+        "rows_expected": processes * rows,
+        "rows_found": len(seen),
+        "torn": torn,
+        "duplicated": duplicated,
+        "header_ok": headers == 1 and all_rows[0] == csv_utils.CSV_HEADER,
+    }
+
+
+def run_stress(path: Path, processes: int = 4, rows: int = 200, batch: int = 1, readers: int = 0) -> dict:
+    """Lanza el estrés sobre path (que no debería existir) y devuelve el resultado de la verificación"""
+    ctx = multiprocessing.get_context("spawn")
+    start, done = ctx.Barrier(processes + readers + 1), ctx.Event()
+    malformed = ctx.Value("i", 0)
+
+    writers = [ctx.Process(target=_writer, args=(str(path), i, rows, batch, start)) for i in range(processes)]
+    reader_procs = [ctx.Process(target=_reader, args=(str(path), start, done, malformed)) for _ in range(readers)]
+    for p in writers + reader_procs:
+        p.start()
+
+    start.wait() # todos los procesos arrancados (imports hechos) antes de medir
+    t0 = time.perf_counter()
+    for p in writers:
+        p.join()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    for p in reader_procs:
+        p.join()
+
+    result = verify(path, processes, rows)
+    result.update({
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(processes * rows / elapsed, 1),
+        "malformed_reads": malformed.value,
+        "writers_ok": all(p.exitcode == 0 for p in writers),
+    })
+    return result
+
+
+def is_ok(result: dict) -> bool:
+    return (result["rows_found"] == result["rows_expected"] and result["torn"] == 0
+            and result["duplicated"] == 0 and result["header_ok"] and result["malformed_reads"] == 0
+            and result["writers_ok"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=500, help="filas por proceso")
+    parser.add_argument("--batch", type=int, default=1, help="filas por llamada a save_expenses")
+    parser.add_argument("--readers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run_stress(Path(tmp) / "gastos.csv", args.processes, args.rows, args.batch, args.readers)
+
+    for key, value in result.items():
+        print(f"{key:>16}: {value}")
+    sys.exit(0 if is_ok(result) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+Microbenchmarks de los caminos calientes de almacenamiento y parseo, sin red y con un solo comando.
+
+Cubre:
+    - csv_utils: save_expense, get_last_trip (con el índice de viajes y recorriendo el csv hacia atrás) y la
+      construcción del índice (lo que cuesta el arranque),
+    - SqliteExpenseRepository: save y get_last_trip,
+    - categorías: load_categories y load_category_markup (con la caché y leyendo el json) y el
+      CategoryMatcher de los botones (una categoría del final y un callback que no lo es),
+    - check_user,
+    - validate_date y format_date,
+    - Expense: construcción, to_csv_row, serialize y deserialize,
+    - StateManager: push y pop,
+    - instrument_handler: lo que añade a cada llamada de un handler, sin trazas y con la traza escribiéndose.
+
+Los de almacenamiento se miden con gastos.csv sintéticos de --sizes filas (por defecto 1k, 100k y 1M),
+ordenados por fecha a lo largo de dos años como el de verdad. Se generan una vez en --data-dir (si se pasa
+se reutilizan entre ejecuciones, el de 1M tarda unos segundos en crearse).
+
+Cada medida es la de timeit: se ajusta el número de vueltas para que una tanda dure al menos 0.2 s y se
+repite --repeat veces; se guardan la mejor y la mediana (por llamada). Los resultados van en JSON a
+--output. Con --compare se comparan las medianas con las de un JSON anterior (la línea base): las que
+empeoran más de --threshold se marcan como regresión y el comando sale con código 1.
+
+Uso:
+    python -m benchmarks.bench_hot_paths --output baseline.json
+    python -m benchmarks.bench_hot_paths --compare baseline.json --output actual.json
+    python -m benchmarks.bench_hot_paths --sizes 1000 --filter csv.
+    python -m benchmarks.bench_hot_paths --input actual.json --compare baseline.json  # sin volver a medir
+"""
+import argparse
+import asyncio
+import csv
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from telegram import Chat, Message, Update, User
+
+from src.models.expense import Expense
+from src.models.expense_repository import SqliteExpenseRepository
+from src.models.state_manager import StateManager
+from src.utils import csv_utils
+from src.utils.category_utils import category_store, load_categories, load_category_markup
+from src.utils.helper_functions import format_date, validate_date
+from src.utils.instrumentation import instrument_handler
+from src.utils.tracing import TRACE_KEY, tracer
+from src.utils.user_utils import check_user, user_registry
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+USERS = 50
+TRIPS = ("Roma", "Lisboa", "Berlín", "Oporto", "Tokio")
+CATEGORIES = {
+    "gasto": ["Supermercado", "Restaurantes", "Ocio", "Transporte", "Casa", "Viajes", "Salud", "Ropa"],
+    "ingreso": ["Nómina", "Bizum", "Otros"],
+    "quien": ["Jesús", "Ana", "Los dos"],
+}
+
+# Un benchmark: nombre -> función que prepara lo que haga falta y devuelve la llamada a medir (sin argumentos)
+Benchmark = tuple[str, Callable[[], Callable[[], object]]]
+
+
+def size_label(rows: int) -> str:
+    if rows >= 1_000_000 and rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}M"
+    if rows >= 1_000 and rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+def make_dataset(path: Path, rows: int, seed: int = 42) -> None:
+    """gastos.csv sintético: fechas en orden a lo largo de los últimos dos años, un 5% de gastos de viaje"""
+    rng = random.Random(seed)
+    start = datetime.today() - timedelta(days=730)
+    step = 730 * 86400 / rows
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";", lineterminator="\n")
+        writer.writerow(csv_utils.CSV_HEADER)
+        for i in range(rows):
+            fecha = (start + timedelta(seconds=i * step)).strftime("%d/%m/%Y")
+            tipo = "gasto" if rng.random() < 0.9 else "ingreso"
+            viaje = rng.choice(TRIPS) if tipo == "gasto" and rng.random() < 0.05 else ""
+            writer.writerow([
+                1000 + rng.randrange(USERS), fecha, f"{rng.uniform(1, 300):.2f}", tipo,
+                rng.choice(CATEGORIES[tipo]), f"descripción {i}", rng.choice(CATEGORIES["quien"]), viaje, "False",
+            ])
+    tmp_path.replace(path)
+
+
+def dataset(data_dir: Path, rows: int) -> Path:
+    path = data_dir / f"gastos-{size_label(rows)}.csv"
+    if not path.exists():
+        print(f"Generando {path.name}...", file=sys.stderr)
+        make_dataset(path, rows)
+    return path
+
+
+def sample_expense(user: int = 1000) -> Expense:
+    expense = Expense(user)
+    expense.importe = "12,50"
+    expense.tipo = "gasto"
+    expense.categoria = "Supermercado"
+    expense.descripcion = "Compra de la semana"
+    expense.quien = "Jesús"
+    return expense
+
+
+# Almacenamiento (por tamaño del csv)
+
+def storage_benchmarks(rows: int, data_dir: Path, work_dir: Path) -> Iterator[Benchmark]:
+    label = size_label(rows)
+    read_path = work_dir / f"read-{label}.csv"
+    write_path = work_dir / f"write-{label}.csv"
+    repositories: dict[str, SqliteExpenseRepository] = {}
+
+    def copy_to(path: Path) -> Path:
+        # El csv se genera (o se copia) la primera vez que lo pide un benchmark que se va a medir
+        if not path.exists():
+            shutil.copyfile(dataset(data_dir, rows), path)
+        return path
+
+    def sqlite_repository() -> SqliteExpenseRepository:
+        # La base de datos se crea importando el csv (la migración del repositorio), una vez por tamaño
+        if "db" not in repositories:
+            repository = SqliteExpenseRepository(work_dir / f"gastos-{label}.db", legacy_csv_path=dataset(data_dir, rows))
+            repository.warm_up()
+            repositories["db"] = repository
+        return repositories["db"]
+
+    def prepare_scan():
+        # read_path es una copia para la que el índice no se ha construido todavía: get_last_trip lee el
+        # csv hacia atrás (por eso va antes que los benchmarks del índice). El peor caso: un usuario sin
+        # viajes, se recorre el último mes entero
+        copy_to(read_path)
+        return lambda: csv_utils.get_last_trip(read_path, 1, 1)
+
+    def prepare_build():
+        copy_to(read_path)
+        return lambda: csv_utils.trip_index.build(read_path)
+
+    def prepare_indexed():
+        csv_utils.trip_index.build(copy_to(read_path))
+        return lambda: csv_utils.get_last_trip(read_path, 1, 1000)
+
+    def prepare_save():
+        # Como en el bot: el índice está construido (post_init) y cada gasto nuevo lo actualiza
+        csv_utils.trip_index.build(copy_to(write_path))
+        expense = sample_expense()
+        return lambda: csv_utils.save_expense(expense, write_path)
+
+    def prepare_sqlite_last_trip():
+        repository = sqlite_repository()
+        return lambda: repository.get_last_trip(1000)
+
+    def prepare_sqlite_save():
+        repository = sqlite_repository()
+        expense = sample_expense()
+        return lambda: repository.save(expense)
+
+    yield f"csv.get_last_trip.scan[{label}]", prepare_scan
+    yield f"csv.trip_index.build[{label}]", prepare_build
+    yield f"csv.get_last_trip.indexed[{label}]", prepare_indexed
+    yield f"csv.save_expense[{label}]", prepare_save
+    yield f"sqlite.get_last_trip[{label}]", prepare_sqlite_last_trip
+    yield f"sqlite.save[{label}]", prepare_sqlite_save
+
+
+# Categorías, usuarios, fechas y modelo
+
+def lookup_benchmarks(work_dir: Path) -> Iterator[Benchmark]:
+    categories_path = work_dir / "categories.json"
+    with open(categories_path, "w", encoding="utf-8") as f:
+        json.dump(CATEGORIES, f, ensure_ascii=False)
+    category_store.path = categories_path
+    category_store.invalidate()
+
+    users_path = work_dir / "users.json"
+    with open(users_path, "w") as f:
+        json.dump(list(range(1000, 1000 + USERS)), f)
+    user_registry.path = users_path
+    user_registry.load()
+
+    def cold_categories():
+        category_store.invalidate()
+        return load_categories("gasto")
+
+    def cold_markup():
+        category_store.invalidate()
+        return load_category_markup("gasto")
+
+    yield "categories.load_categories", lambda: (lambda: load_categories("gasto"))
+    yield "categories.load_categories.cold", lambda: cold_categories
+    yield "categories.load_category_markup", lambda: (lambda: load_category_markup("gasto"))
+    yield "categories.load_category_markup.cold", lambda: cold_markup
+    matcher = category_store.matcher("gasto", "ingreso")
+    last = CATEGORIES["gasto"][-1]
+    yield "categories.matcher", lambda: (lambda: (matcher(last), matcher("1")))
+    yield "users.check_user", lambda: (lambda: (check_user(1010), check_user(5)))
+
+
+def parsing_benchmarks() -> Iterator[Benchmark]:
+    dates = ["01/02/2024", "1-2-24", "31 12 2023", "30/02/2024", "no es una fecha"]
+
+    def all_dates(func):
+        return lambda: [func(d) for d in dates]
+
+    expense = sample_expense()
+    serialized = expense.serialize()
+
+    yield "dates.validate_date", lambda: all_dates(validate_date)
+    yield "dates.format_date", lambda: all_dates(format_date)
+    yield "expense.construct", lambda: sample_expense
+    yield "expense.to_csv_row", lambda: expense.to_csv_row
+    yield "expense.serialize", lambda: expense.serialize
+    yield "expense.deserialize", lambda: (lambda: Expense.deserialize(serialized))
+
+
+class _Context:
+    def __init__(self):
+        self.user_data = {}
+
+
+def state_benchmarks() -> Iterator[Benchmark]:
+    """push y pop con el historial de una conversación de gasto ya a medias (6 pasos)"""
+    manager = StateManager()
+    user = User(id=1000, first_name="Bench", is_bot=False)
+    chat = Chat(id=1000, type="private")
+    update = Update(update_id=1, message=Message(message_id=1, date=datetime.now(), chat=chat, from_user=user,
+                                                 text="Compra de la semana"))
+    context = _Context()
+    context.user_data["expense_obj"] = Expense(1000)
+    for step, (field, value) in enumerate([("tipo", "gasto"), ("importe", "12,50"), ("categoria", "Supermercado"),
+                                           ("descripcion", "Compra"), ("quien", "Jesús"), ("viaje", "")]):
+        setattr(context.user_data["expense_obj"], field, value)
+        manager.push(update, context, step, state_benchmarks)
+    template = dict(context.user_data)
+    history = template[StateManager.HISTORY_KEY]
+
+    def reset() -> None:
+        # Cada llamada parte del mismo historial (copia superficial de la lista, de 6 entradas)
+        context.user_data = {**template, StateManager.HISTORY_KEY: list(history),
+                             "expense_obj": Expense.deserialize(template["expense_obj"].serialize())}
+
+    def push():
+        reset()
+        context.user_data["expense_obj"].descripcion = "Compra de la semana"
+        manager.push(update, context, 7, state_benchmarks)
+
+    def pop():
+        reset()
+        manager.pop(context)
+
+    yield "state_manager.reset (referencia de push/pop)", lambda: reset
+    yield "state_manager.push", lambda: push
+    yield "state_manager.pop", lambda: pop
+
+
+def instrumentation_benchmarks() -> Iterator[Benchmark]:
+    """
+    Una llamada a un handler que vuelve enseguida, sin envolver y con instrument_handler. Las corrutinas se
+    llevan a mano (send) porque no llegan a suspenderse, así no se mide el bucle de eventos.
+    """
+    async def handler(update, context):
+        return None
+
+    wrapped = instrument_handler(handler, "bench")
+    context = _Context()
+    context.user_data[TRACE_KEY] = "bench"
+
+    def call(func):
+        def run_once():
+            try:
+                func(None, context).send(None)
+            except StopIteration:
+                pass
+        return run_once
+
+    def prepare_traced():
+        # Con la tarea de escritura del tracer en marcha (como en el bot) cada llamada abre y emite su span.
+        # El bucle no llega a correr: la tarea no escribe y el buffer se vacía en cada llamada
+        loop = asyncio.new_event_loop()
+        tracer.enabled = True
+        loop.run_until_complete(tracer.start())
+        traced = call(wrapped)
+
+        def run_once():
+            traced()
+            tracer._buffer.clear()
+        return run_once
+
+    yield "instrumentation.handler.raw (referencia)", lambda: call(handler)
+    yield "instrumentation.handler", lambda: call(wrapped)
+    yield "instrumentation.handler.traced", prepare_traced
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict:
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    per_call = [total / loops for total in timer.repeat(repeat, loops)]
+    return {
+        "best_us": round(min(per_call) * 1e6, 3),
+        "median_us": round(statistics.median(per_call) * 1e6, 3),
+        "loops": loops,
+        "repeat": repeat,
+    }
+
+
+def run(sizes: list[int], repeat: int, name_filter: Optional[str], data_dir: Path) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-hot-paths-") as tmp:
+        work_dir = Path(tmp)
+        groups = [lookup_benchmarks(work_dir), parsing_benchmarks(), state_benchmarks(), instrumentation_benchmarks()]
+        groups += [storage_benchmarks(rows, data_dir, work_dir) for rows in sizes]
+        for group in groups:
+            for name, prepare in group:
+                if name_filter and name_filter not in name:
+                    continue
+                result = measure(prepare(), repeat)
+                results[name] = result
+                print(f"  {name:<48} {format_us(result['median_us']):>12}  (mejor {format_us(result['best_us'])})",
+                      file=sys.stderr)
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def format_us(us: float) -> str:
+    if us >= 1e6:
+        return f"{us / 1e6:.2f} s"
+    if us >= 1e3:
+        return f"{us / 1e3:.2f} ms"
+    return f"{us:.2f} µs"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compara las medianas con la línea base, imprime la tabla y devuelve las que empeoran más de threshold"""
+    regressions = []
+    print(f"{'benchmark':<48} {'base':>12} {'actual':>12} {'cambio':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<48} {'-':>12} {format_us(result['median_us']):>12}    nuevo")
+            continue
+        ratio = result["median_us"] / base["median_us"] if base["median_us"] else float("inf")
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  REGRESIÓN"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            mark = "  mejora"
+        print(f"{name:<48} {format_us(base['median_us']):>12} {format_us(result['median_us']):>12} "
+              f"{(ratio - 1) * 100:+7.1f}%{mark}")
+    missing = baseline["results"].keys() - current["results"].keys()
+    if missing:
+        print(f"({len(missing)} de la línea base no se han medido esta vez)")
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="filas de los csv sintéticos, separadas por comas")
+    parser.add_argument("--repeat", type=int, default=5, help="tandas por benchmark")
+    parser.add_argument("--filter", help="solo los benchmarks cuyo nombre contiene este texto")
+    parser.add_argument("--data-dir", type=Path, help="dónde se guardan (y reutilizan) los csv sintéticos")
+    parser.add_argument("--output", type=Path, help="fichero JSON con los resultados")
+    parser.add_argument("--input", type=Path, help="no medir: usar los resultados de este JSON")
+    parser.add_argument("--compare", type=Path, help="JSON de la línea base con el que comparar")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="empeoramiento de la mediana a partir del que es regresión (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            current = json.load(f)
+    else:
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+        if args.data_dir:
+            args.data_dir.mkdir(parents=True, exist_ok=True)
+            current = run(sizes, args.repeat, args.filter, args.data_dir)
+        else:
+            with tempfile.TemporaryDirectory(prefix="bench-datasets-") as data_dir:
+                current = run(sizes, args.repeat, args.filter, Path(data_dir))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+    elif not args.compare:
+        print(json.dumps(current, indent=2, ensure_ascii=False))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regresiones de más del {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Benchmark de la latencia de un handler según cómo se escriben los logs.
+
+Cada llamada imita un paso de la conversación: varios INFO con formato % (como los handlers de
+new_enter_expense) y un await. Se comparan tres modos:
+    - off: el logger en WARNING, los INFO no se escriben,
+    - sync: un FileHandler en el propio hilo del bucle de eventos (lo que hacía logging.conf),
+    - queue: el mismo FileHandler detrás de un QueueHandler/QueueListener (setup_queue_logging).
+
+Con --stall-ms el fichero se "atasca" cada --stall-every registros (rotación, fsync, un disco lento): en
+modo sync ese parón lo paga el handler que estaba logueando, en modo queue lo paga el hilo de escritura.
+
+Uso:
+    python -m benchmarks.bench_logging --calls 2000 --stall-ms 20 --stall-every 500
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.log_queue import StepLogSampler, setup_queue_logging, stop_queue_logging
+from src.utils.metrics import Histogram, format_quantiles
+
+LOGGER_NAME = "expense_bot.bench"
+
+
+class StallingFileHandler(logging.FileHandler):
+    """FileHandler que se para stall segundos cada every registros"""
+
+    def __init__(self, filename: str, stall: float, every: int):
+        super().__init__(filename, encoding="utf-8")
+        self.stall = stall
+        self.every = every
+        self._count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self._count += 1
+        if self.stall and self.every and self._count % self.every == 0:
+            time.sleep(self.stall)
+        super().emit(record)
+
+
+async def fake_step(logger: logging.Logger, user_id: int) -> None:
+    logger.info("El usuario %s quiere añadir un %s", user_id, "gasto")
+    logger.info("El usuario %s quiere añadir un %s: %s", user_id, "gasto", "12.5")
+    await asyncio.sleep(0)
+    logger.info("El usuario %s añade el gasto a la categoría %s", user_id, "Supermercado")
+
+
+async def measure(logger: logging.Logger, calls: int) -> Histogram:
+    histogram = Histogram()
+    for i in range(calls):
+        started = time.perf_counter()
+        await fake_step(logger, i % 100)
+        histogram.observe((time.perf_counter() - started) * 1000)
+    return histogram
+
+
+def run_mode(mode: str, calls: int, stall: float, every: int, directory: str) -> Histogram:
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.propagate = False
+    logger.handlers.clear()
+    handler = StallingFileHandler(f"{directory}/{mode}.log", stall, every)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s:%(lineno)d – %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING if mode == "off" else logging.INFO)
+
+    if mode == "queue":
+        setup_queue_logging(logger, sampler=StepLogSampler(threshold=0))
+    try:
+        return asyncio.run(measure(logger, calls))
+    finally:
+        stop_queue_logging()
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--stall-ms", type=float, default=0, help="parón del fichero (ms)")
+    parser.add_argument("--stall-every", type=int, default=500, help="registros entre parones")
+    args = parser.parse_args()
+
+    print(f"{args.calls} pasos de handler con 3 INFO cada uno, parón de {args.stall_ms:g} ms "
+          f"cada {args.stall_every} registros")
+    print("latencia por paso p50/p95/p99 (ms)")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("off", "sync", "queue"):
+            histogram = run_mode(mode, args.calls, args.stall_ms / 1000, args.stall_every, directory)
+            print(f"  {mode:<6} {format_quantiles(histogram)}  media {histogram.mean * 1000:.0f} µs, "
+                  f"máx {histogram.max:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
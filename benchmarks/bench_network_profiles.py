@@ -0,0 +1,97 @@
+"""
+Benchmark de los perfiles de red (NETWORK_PROFILES en settings) contra la Bot API de mentira.
+
+Para cada perfil se crea un Bot con sus dos requests (envíos y getUpdates, build_requests) y, mientras un
+getUpdates hace long polling como en producción, se mandan --messages mensajes con --concurrency envíos
+a la vez. Se mide el ritmo (mensajes/s), la latencia de cada envío y los que fallan (p. ej. sin
+conexión libre en el pool a tiempo).
+
+"shared" es lo de antes: un HTTPXRequest por defecto (pool de 1 conexión) para todo, getUpdates incluido.
+
+HTTP/2 solo se negocia sobre TLS y la API de mentira es HTTP/1.1 en local: el perfil http2 sirve aquí
+por su tamaño de pool, no por la multiplexación.
+
+Uso:
+    python -m benchmarks.bench_network_profiles --messages 500 --concurrency 50 --rtt 0.05
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from src.testing.fake_bot_api import FakeBotAPI
+from src.settings import NETWORK_PROFILES
+from src.utils.metrics import Histogram, format_quantiles
+from src.utils.telegram_request import build_requests, get_network_profile
+
+
+async def long_poll(bot: Bot, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        try:
+            await bot.get_updates(timeout=5)
+        except Exception:
+            await asyncio.sleep(0.1)
+
+
+async def run_profile(name: str, api: FakeBotAPI, messages: int, concurrency: int) -> tuple[float, Histogram, int]:
+    if name == "shared":
+        request = updates_request = HTTPXRequest()
+    else:
+        request, updates_request = build_requests(get_network_profile(name))
+    bot = Bot("1:bench", base_url=api.base_url, request=request, get_updates_request=updates_request)
+
+    latencies = Histogram()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.send_message(chat_id=1 + i % 50, text=f"mensaje {i}")
+            latencies.observe((time.perf_counter() - started) * 1000)
+
+    async with bot:
+        stop = asyncio.Event()
+        poller = asyncio.create_task(long_poll(bot, stop))
+        await asyncio.sleep(0.1) # el getUpdates ya está esperando
+        started = time.perf_counter()
+        results = await asyncio.gather(*(send(i) for i in range(messages)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await api.stop_polling()
+        await poller
+    errors = sum(isinstance(result, Exception) for result in results)
+    return (messages - errors) / elapsed, latencies, errors
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    print(f"{args.messages} mensajes, {args.concurrency} a la vez, rtt {args.rtt * 1000:.0f} ms, "
+          f"con un getUpdates en long polling")
+    print(f"{'perfil':<12} {'msg/s':>8}  latencia p50/p95/p99 (ms)  errores")
+    for name in ["shared", *NETWORK_PROFILES]:
+        api = FakeBotAPI(rtt=args.rtt)
+        await api.start()
+        try:
+            rate, latencies, errors = await run_profile(name, api, args.messages, args.concurrency)
+        finally:
+            await api.stop()
+        print(f"{name:<12} {rate:8.1f}  {format_quantiles(latencies):<26} {errors}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rtt", type=float, default=0.05, help="ida y vuelta simulada con Telegram (s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
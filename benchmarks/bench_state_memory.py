@@ -0,0 +1,108 @@
+"""
+Benchmark de memoria del historial de estados (StateManager) por conversación.
+
+Simula muchas conversaciones de 10 pasos (como la de añadir un gasto, con Update reales de
+python-telegram-bot) y mide con tracemalloc los bytes que se quedan en user_data por conversación:
+    - antes: el push de siempre, que hacía deepcopy de todo user_data y guardaba el Update en cada paso,
+    - después: el StateManager actual (diffs copy-on-write, Expense serializado y sin Update).
+
+Uso:
+    python -m benchmarks.bench_state_memory --conversations 200 --steps 10
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+from src.models.expense import Expense
+from src.models.state_manager import StateManager
+
+
+class LegacyStateManager(StateManager):
+    """El push de antes de los snapshots copy-on-write, solo para comparar"""
+
+    def push(self, update, context, state, handler_func):
+        input_data = self._extract_input_data(update)
+        input_update = update.callback_query or update.message
+        snapshot = {k: deepcopy(v) for k, v in context.user_data.items() if k != self.HISTORY_KEY}
+        history = context.user_data.setdefault(self.HISTORY_KEY, [])
+        history.append((state, handler_func, snapshot, input_data, input_update))
+
+
+class FakeContext:
+    def __init__(self):
+        self.user_data = {}
+
+
+def make_update(update_id: int, user_id: int, text: str, callback: bool) -> Update:
+    user = User(id=user_id, first_name="Bench", is_bot=False)
+    chat = Chat(id=user_id, type="private")
+    message = Message(message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=text)
+    if callback:
+        query = CallbackQuery(id=str(update_id), from_user=user, chat_instance="bench", data=text, message=message)
+        return Update(update_id=update_id, callback_query=query)
+    return Update(update_id=update_id, message=message)
+
+
+# Los 10 pasos: (texto, es callback, qué se cambia del gasto)
+STEPS = [
+    ("/start", False, None),
+    ("4", True, ("tipo", "gasto")),
+    ("12,50", False, ("importe", "12,50")),
+    ("Viajes", True, ("categoria", "Viajes")),
+    ("13", True, ("viaje", "Roma")),
+    ("Cena en el Trastévere con los amigos", False, ("descripcion", "Cena en el Trastévere con los amigos")),
+    ("Amigos", True, ("quien", "Amigos")),
+    ("14", True, None),
+    ("15", True, ("categoria", "Comida")),
+    ("13", True, None),
+]
+
+
+def run_conversation(manager: StateManager, user_id: int, steps: int) -> FakeContext:
+    context = FakeContext()
+    context.user_data["expense_obj"] = Expense(user_id)
+    for i, (text, callback, change) in enumerate(STEPS[:steps]):
+        update = make_update(i, user_id, text, callback)
+        if change:
+            setattr(context.user_data["expense_obj"], change[0], change[1])
+        manager.push(update, context, i, run_conversation)
+    return context
+
+
+def measure(manager: StateManager, conversations: int, steps: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    contexts = [run_conversation(manager, user_id, steps) for user_id in range(conversations)]
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del contexts
+    return total / conversations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    legacy = measure(LegacyStateManager(), args.conversations, args.steps)
+    current = measure(StateManager(), args.conversations, args.steps)
+    print(f"Conversaciones: {args.conversations}, pasos: {args.steps}")
+    print(f"{'antes (deepcopy)':>22}: {legacy:10.0f} bytes/conversación")
+    print(f"{'después (diffs)':>22}: {current:10.0f} bytes/conversación")
+    print(f"{'reducción':>22}: {legacy / current:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark de la latencia desde que Telegram tiene un update hasta que llega al handler, en modo polling
+(getUpdates) y en modo webhook, contra el Bot API de mentira (src/testing/fake_bot_api.py).
+
+Se arranca una Application de verdad con un handler que solo apunta la hora de llegada. En polling el
+update se deja en la cola de getUpdates; en webhook el WebhookSender lo manda por POST. Con --rtt se
+simula la latencia de red con Telegram: en polling cada getUpdates paga la ida y la vuelta (y los
+updates que llegan entre dos peticiones esperan a la siguiente), en webhook solo la ida del POST.
+
+Uso:
+    python -m benchmarks.bench_update_latency --updates 200 --rtt 0.08
+"""
+import argparse
+import asyncio
+import random
+import socket
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from src.testing.fake_bot_api import FakeBotAPI, WebhookSender, make_message_update
+
+SECRET = "bench-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def measure(mode: str, updates: int, rtt: float, gap: float) -> list[float]:
+    api = FakeBotAPI(rtt=rtt)
+    await api.start()
+    arrived: dict[int, asyncio.Future] = {}
+
+    async def handler(update, context):
+        arrived[update.update_id].set_result(time.perf_counter())
+
+    application = ApplicationBuilder().token("1:bench").base_url(api.base_url).build()
+    application.add_handler(MessageHandler(filters.TEXT, handler))
+    latencies = []
+
+    async with application:
+        await application.start()
+        sender = None
+        if mode == "webhook":
+            port = free_port()
+            url = f"http://127.0.0.1:{port}/telegram"
+            await application.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                                                    webhook_url=url, secret_token=SECRET)
+            sender = WebhookSender(url, SECRET, rtt=rtt)
+            await sender.__aenter__()
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+
+        loop = asyncio.get_running_loop()
+        for update_id in range(1, updates + 1):
+            arrived[update_id] = loop.create_future()
+            update = make_message_update(update_id, 42, f"gasto {update_id}")
+            t0 = time.perf_counter()
+            if sender is not None:
+                loop.create_task(sender.send(update))
+            else:
+                api.push_update(update)
+            latencies.append(await asyncio.wait_for(arrived[update_id], 10) - t0)
+            await asyncio.sleep(random.uniform(0, gap)) # los usuarios no escriben a ritmo fijo
+
+        if sender is not None:
+            await sender.__aexit__(None, None, None)
+        await application.updater.stop()
+        await application.stop()
+
+    await api.stop()
+    return latencies
+
+
+def summary(latencies: list[float]) -> dict:
+    ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        "mean_ms": round(statistics.fmean(ms), 2),
+        "p50_ms": round(ms[len(ms) // 2], 2),
+        "p95_ms": round(ms[int(len(ms) * 0.95) - 1], 2),
+        "max_ms": round(ms[-1], 2),
+    }
+
+
+async def run(updates: int, rtt: float, gap: float) -> dict:
+    return {mode: summary(await measure(mode, updates, rtt, gap)) for mode in ("polling", "webhook")}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rtt", type=float, default=0.08, help="ida y vuelta simulada con Telegram (s)")
+    parser.add_argument("--gap", type=float, default=0.05, help="pausa máxima entre updates (s)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.updates, args.rtt, args.gap))
+    print(f"Updates: {args.updates}, rtt simulado: {args.rtt * 1000:.0f} ms")
+    for mode, result in results.items():
+        print(f"{mode:>8}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
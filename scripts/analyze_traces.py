@@ -0,0 +1,161 @@
+"""
+Analiza offline las trazas de las conversaciones (logs/traces.jsonl, ver src/utils/tracing.py).
+
+Agrupa los spans por traza (una por conversación empezada con /start), ordena las conversaciones por el
+tiempo que ha pasado el bot trabajando en ellas (la suma de sus pasos, sin contar lo que tarda el usuario
+en contestar) y de las más lentas imprime el camino crítico: los pasos de la conversación y, dentro de
+cada uno, la cadena de llamadas a Telegram y al almacenamiento que marca cuándo termina.
+
+Uso:
+    python scripts/analyze_traces.py                       # logs/traces.jsonl y sus rotados
+    python scripts/analyze_traces.py traza.jsonl --top 10
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.settings import TRACE_PATH
+
+# Margen (s) al comparar los extremos de spans, las marcas se redondean a microsegundos
+EPSILON = 1e-5
+
+
+class SpanRecord(NamedTuple):
+    trace: str
+    span: str
+    parent: Optional[str]
+    name: str
+    kind: str
+    start: float
+    end: float
+    state: Optional[str] = None
+    user: Optional[int] = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Conversation(NamedTuple):
+    trace: str
+    user: Optional[int]
+    steps: list[SpanRecord]
+    children: dict[str, list[SpanRecord]]
+
+    @property
+    def busy(self) -> float:
+        """Segundos que el bot ha estado trabajando en la conversación"""
+        return sum(step.duration for step in self.steps)
+
+    @property
+    def wall(self) -> float:
+        """Segundos desde el primer paso hasta el último, con las esperas al usuario"""
+        return self.steps[-1].end - self.steps[0].start
+
+
+def default_files(path: Path = TRACE_PATH) -> list[Path]:
+    """El fichero de trazas y sus rotados, del más antiguo al más nuevo"""
+    rotated = [p for p in path.parent.glob(f"{path.name}.*") if p.suffix[1:].isdigit()]
+    rotated.sort(key=lambda p: int(p.suffix[1:]), reverse=True)
+    return [p for p in rotated + [path] if p.exists()]
+
+
+def read_spans(files: Iterable[Path]) -> list[SpanRecord]:
+    spans = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    data = json.loads(line)
+                    spans.append(SpanRecord(**{k: data.get(k) for k in SpanRecord._fields}))
+                except (ValueError, TypeError):
+                    print(f"Línea {number} de {file} ignorada: no es un span", file=sys.stderr)
+    return spans
+
+
+def group_conversations(spans: Iterable[SpanRecord]) -> list[Conversation]:
+    by_trace: dict[str, list[SpanRecord]] = defaultdict(list)
+    for span in spans:
+        if span.trace:
+            by_trace[span.trace].append(span)
+
+    conversations = []
+    for trace, trace_spans in by_trace.items():
+        steps = sorted((s for s in trace_spans if s.parent is None), key=lambda s: s.start)
+        if not steps:
+            continue
+        children: dict[str, list[SpanRecord]] = defaultdict(list)
+        for span in trace_spans:
+            if span.parent is not None:
+                children[span.parent].append(span)
+        conversations.append(Conversation(trace, steps[0].user, steps, children))
+    return conversations
+
+
+def critical_path(span: SpanRecord, children: dict[str, list[SpanRecord]],
+                  depth: int = 0) -> list[tuple[int, SpanRecord]]:
+    """
+    El span y, recursivamente, la cadena de hijos que marca cuándo termina: desde el final se coge el hijo
+    que acabó el último, se sigue desde su inicio con el anterior que no se solape, y así hasta el principio.
+    """
+    chain = []
+    cursor = span.end
+    for child in sorted(children.get(span.span, []), key=lambda s: s.end, reverse=True):
+        if child.end <= cursor + EPSILON:
+            chain.append(child)
+            cursor = child.start
+    path = [(depth, span)]
+    for child in reversed(chain):
+        path += critical_path(child, children, depth + 1)
+    return path
+
+
+def breakdown(conversation: Conversation) -> dict[str, float]:
+    """Segundos del camino crítico en Telegram, en almacenamiento y en el propio bot"""
+    totals = {"telegram": 0.0, "storage": 0.0}
+    for step in conversation.steps:
+        for depth, span in critical_path(step, conversation.children):
+            if depth == 1 and span.kind in totals:
+                totals[span.kind] += span.duration
+    totals["bot"] = max(conversation.busy - totals["telegram"] - totals["storage"], 0.0)
+    return totals
+
+
+def format_conversation(conversation: Conversation) -> str:
+    lines = [f"Traza {conversation.trace} (usuario {conversation.user}): {len(conversation.steps)} pasos, "
+             f"{conversation.busy * 1000:.1f} ms en el bot, {conversation.wall:.1f} s de conversación"]
+    for step in conversation.steps:
+        for depth, span in critical_path(step, conversation.children):
+            label = f"{span.name} [{span.state}]" if depth == 0 else f"{span.kind} {span.name}"
+            lines.append(f"  {'  ' * depth}{label:<{48 - 2 * depth}} {span.duration * 1000:9.1f} ms")
+    totals = breakdown(conversation)
+    busy = conversation.busy or 1
+    lines.append(f"  Reparto: telegram {totals['telegram'] / busy:.0%} · almacenamiento "
+                 f"{totals['storage'] / busy:.0%} · bot {totals['bot'] / busy:.0%}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", type=Path, help="ficheros JSONL (por defecto las trazas del bot)")
+    parser.add_argument("--top", type=int, default=5, help="conversaciones más lentas que se muestran")
+    args = parser.parse_args(argv)
+
+    files = args.files or default_files()
+    if not files:
+        print(f"No hay trazas en {TRACE_PATH}")
+        return
+    conversations = group_conversations(read_spans(files))
+    conversations.sort(key=lambda c: c.busy, reverse=True)
+    print(f"{len(conversations)} conversaciones, las {min(args.top, len(conversations))} más lentas:\n")
+    for conversation in conversations[:args.top]:
+        print(format_conversation(conversation))
+        print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,129 @@
+"""
+Informe del tiempo de arranque del bot: lo que cuesta importar bot.py, módulo a módulo.
+
+Lanza `python -X importtime -c "import src.bot"` en un proceso nuevo (--runs veces y se queda con la más
+rápida: la primera suele pagar la compilación a .pyc) y convierte la salida en una tabla con el tiempo
+propio y el acumulado (con todo lo que importa) de cada módulo. Con --ours solo salen los del bot.
+
+Con --budget-ms se comprueba el presupuesto de arranque: si importar bot.py tarda más (o sus módulos
+propios pasan de OWN_MODULES_BUDGET_MS), sale con código 1. Es para lanzarlo a mano o en un job de
+rendimiento en una máquina conocida: los tests (tests/test_startup.py) no miran tiempos, solo qué se
+importa y qué se hace al importar.
+
+Uso:
+    python scripts/import_time.py                        # los 25 módulos que más tardan
+    python scripts/import_time.py --sort self --top 40
+    python scripts/import_time.py --ours --budget-ms 800
+    python scripts/import_time.py --budget-ms            # con los presupuestos por defecto
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Presupuesto de arranque (ms): importar bot.py entero y solo la parte de nuestros módulos (tiempo propio)
+STARTUP_BUDGET_MS = 1000
+OWN_MODULES_BUDGET_MS = 150
+
+OUR_PACKAGES = ("src", "handlers")
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int # nivel de anidamiento: 0 es un import de primer nivel
+
+    @property
+    def ours(self) -> bool:
+        return self.module.split(".")[0] in OUR_PACKAGES
+
+
+def parse_importtime(text: str) -> list[ImportRecord]:
+    """
+    Líneas de -X importtime ("import time:  propio |  acumulado | <sangría>módulo"), en el orden en
+    el que terminan de importarse. Se ignoran la cabecera y lo que no sea del informe (p. ej. errores).
+    """
+    records = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        records.append(ImportRecord(stripped, int(fields[0]), int(fields[1]), (len(name) - len(stripped) - 1) // 2))
+    return records
+
+
+def run_importtime(module: str = "src.bot") -> list[ImportRecord]:
+    """Importa module en un intérprete nuevo con -X importtime (con src/ en el path, como al lanzar el bot)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT / "src"), str(ROOT)]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"No se ha podido importar {module}:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def total_ms(records: list[ImportRecord], module: str = "src.bot") -> float:
+    """Lo que ha tardado el import de module, con todo lo que importa"""
+    for record in records:
+        if record.module == module:
+            return record.cumulative_us / 1000
+    raise ValueError(f"{module} no está en el informe")
+
+
+def own_ms(records: list[ImportRecord]) -> float:
+    """Tiempo propio de nuestros módulos (sin las dependencias que importan)"""
+    return sum(record.self_us for record in records if record.ours) / 1000
+
+
+def measure(module: str = "src.bot", runs: int = 3) -> list[ImportRecord]:
+    """El informe de la ejecución más rápida de runs"""
+    return min((run_importtime(module) for _ in range(runs)), key=lambda records: total_ms(records, module))
+
+
+def format_table(records: list[ImportRecord], sort: str = "cumulative", top: int = 25) -> str:
+    key = (lambda r: r.self_us) if sort == "self" else (lambda r: r.cumulative_us)
+    lines = [f"{'módulo':<56} {'propio (ms)':>12} {'acumulado (ms)':>15}"]
+    for record in sorted(records, key=key, reverse=True)[:top]:
+        name = f"{'  ' * record.depth}{record.module}"
+        lines.append(f"{name:<56} {record.self_us / 1000:12.1f} {record.cumulative_us / 1000:15.1f}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.bot", help="módulo que se importa")
+    parser.add_argument("--runs", type=int, default=3, help="ejecuciones, se queda con la más rápida")
+    parser.add_argument("--sort", choices=("cumulative", "self"), default="cumulative")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--ours", action="store_true", help="solo los módulos del bot")
+    parser.add_argument("--budget-ms", type=float, nargs="?", const=STARTUP_BUDGET_MS,
+                        help=f"sale con código 1 si el import tarda más (sin valor, {STARTUP_BUDGET_MS} ms)")
+    args = parser.parse_args(argv)
+
+    records = measure(args.module, args.runs)
+    shown = [record for record in records if record.ours] if args.ours else records
+    print(format_table(shown, args.sort, args.top))
+    total = total_ms(records, args.module)
+    print(f"\nimport {args.module}: {total:.1f} ms ({own_ms(records):.1f} ms en módulos del bot, "
+          f"{len(records)} módulos)")
+    if args.budget_ms is not None:
+        if total > args.budget_ms:
+            print(f"Por encima del presupuesto de {args.budget_ms:.0f} ms")
+            return 1
+        if own_ms(records) > OWN_MODULES_BUDGET_MS:
+            print(f"Los módulos del bot pasan de su presupuesto de {OWN_MODULES_BUDGET_MS} ms")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,40 +1,169 @@
+import argparse
+import asyncio
 import sys
 
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 import logging.config
 import logging
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from src.settings import BASE_DIR, TOKEN
+from src.settings import (BASE_DIR, TOKEN, LOG_QUEUE, LOOP_DEBUG, METRICS_PORT, BOT_MODE, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+                          WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS)
+from src.utils.persistence import SqlitePersistence
+from src.utils.update_processor import PerUserUpdateProcessor
+from src.utils.async_io import enable_loop_debug, install_io_executor, run_io, shutdown_io_executor
+from src.utils.loop_monitor import loop_monitor
+from src.utils.telegram_request import build_requests
+from src.utils.rate_limiter import PriorityRateLimiter
+from src.utils.tracing import tracer
+from src.utils.error_notifier import error_notifier
+from src.utils.log_queue import setup_queue_logging, stop_queue_logging
 from src.handlers.router import register_all_handlers
+from src.models.expense_repository import expense_repository
+from src.utils.category_utils import category_store
+from src.utils.user_utils import user_registry
+from src.utils.write_queue import expense_write_queue
 
-from telegram.ext import ApplicationBuilder
+from telegram.ext import Application, ApplicationBuilder
 
+if TYPE_CHECKING:
+    from src.utils.metrics_server import MetricsServer
 
-# Definimos el logging para tener claro los logs y eso del bot:
-log_cfg_path = BASE_DIR / "config" / "logging.conf"
-logging.config.fileConfig(log_cfg_path, disable_existing_loggers=False)
 
 # A partir de aquí puedo definir distintos loggers (objetos que permiten registrar
 # mensajes y eventos durante la ejecución de una app, el logger se encarga de gestionarlos,
 # los mensajes se envían a un handler que puede ser un archivo, la consola, etc.)
 logger = logging.getLogger("expense_bot")
 
-def main() -> None:
+# Endpoint de métricas (opcional, se arranca en post_init si METRICS_PORT no es 0)
+metrics_server: Optional["MetricsServer"] = None
+
+def configure_logging() -> None:
+    """
+    Definimos el logging para tener claro los logs y eso del bot. Se hace en main y no al importar el
+    módulo: fileConfig abre el fichero de logs y importar bot.py (tests, scripts) no debe tocar el disco.
+    """
+    log_cfg_path = BASE_DIR / "config" / "logging.conf"
+    logging.config.fileConfig(log_cfg_path, disable_existing_loggers=False)
+
+async def post_init(application: Application) -> None:
+    """
+    Se ejecuta una vez construida la aplicación y antes de empezar a recibir mensajes.
+    Aquí se cargan las cosas caras de una sola vez (por ejemplo el índice de viajes del csv).
+    """
+    global metrics_server
+    loop = asyncio.get_running_loop()
+    install_io_executor(loop)
+    if LOOP_DEBUG:
+        enable_loop_debug(loop)
+
+    await run_io(expense_repository.warm_up)
+    await run_io(category_store.get, 'all')
+    category_store.start_watching()
+    await run_io(user_registry.load)
+    await expense_write_queue.start()
+    await tracer.start()
+    await error_notifier.start(application.bot)
+    loop_monitor.start()
+    if METRICS_PORT:
+        # Solo se importa si se usa
+        from src.utils.metrics_server import MetricsServer
+        metrics_server = MetricsServer(user_data=lambda: application.user_data)
+        await metrics_server.start()
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Se ejecuta al apagar el bot: se guardan los gastos que quedaran en la cola de escritura.
+    """
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await loop_monitor.stop()
+    await category_store.stop_watching()
+    await error_notifier.stop()
+    await expense_write_queue.stop()
+    await tracer.stop()
+    shutdown_io_executor()
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    """
+    Argumentos de la línea de comandos, por defecto los valores de settings (variables de entorno)
+    """
+    parser = argparse.ArgumentParser(description="Bot de gastos de Telegram")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=BOT_MODE,
+                        help="cómo se reciben los updates")
+    parser.add_argument("--listen", default=WEBHOOK_LISTEN, help="dirección del servidor del webhook")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT, help="puerto del servidor del webhook")
+    parser.add_argument("--webhook-url", default=WEBHOOK_URL,
+                        help="URL pública que se registra en Telegram (sin el path), obligatoria en modo webhook")
+    parser.add_argument("--secret-token", default=WEBHOOK_SECRET_TOKEN,
+                        help="token que Telegram manda en cada POST, los que no lo traen se rechazan")
+    parser.add_argument("--max-connections", type=int, default=WEBHOOK_MAX_CONNECTIONS,
+                        help="conexiones simultáneas que puede abrir Telegram contra el webhook")
+    args = parser.parse_args(argv if argv is not None else [])
+    if args.mode == "webhook" and not args.webhook_url:
+        # Sin URL PTB registraría https://<listen>:<port>/..., donde Telegram no va a llegar nunca
+        parser.error("en modo webhook hace falta --webhook-url (o WEBHOOK_URL): la URL pública que se registra en Telegram")
+    return args
+
+def run(application: Application, args: argparse.Namespace) -> None:
+    """
+    Arranca la aplicación en el modo pedido. En modo webhook no se descartan los updates pendientes:
+    los que Telegram haya acumulado durante un reinicio se procesan al volver.
+    """
+    if args.mode == "webhook":
+        if not args.webhook_url:
+            raise ValueError("En modo webhook hace falta la URL pública (--webhook-url o WEBHOOK_URL)")
+        webhook_url = f"{args.webhook_url.rstrip('/')}/{WEBHOOK_PATH}"
+        logger.info("Modo webhook: escuchando en %s:%s/%s", args.listen, args.port, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=args.listen,
+            port=args.port,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=args.secret_token,
+            max_connections=args.max_connections,
+        )
+    else:
+        application.run_polling(drop_pending_updates=True)
+
+def main(argv: Optional[list[str]] = None) -> None:
     """
     Función principal de la ejecución del bot
     """
+    args = parse_args(argv)
+    configure_logging()
+    if LOG_QUEUE:
+        # Los logs se escriben desde un hilo aparte, el bucle de eventos no espera al disco
+        setup_queue_logging()
 
     logger.info("Iniciando el Bot...")
-    application = ApplicationBuilder().token(TOKEN).build()
+    # Pools separados para los envíos y para getUpdates (perfil NETWORK_PROFILE de settings)
+    request, get_updates_request = build_requests()
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .rate_limiter(PriorityRateLimiter())
+        .persistence(SqlitePersistence())
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Aquí añadimos los distintos handlers ...
 
 
     logger.info("Bot iniciado, esperando los mensajes...")
 
+    # Las conversaciones se construyen aquí (leen las categorías), no al importar los handlers
     register_all_handlers(application)
-    application.run_polling(drop_pending_updates=True)
+    try:
+        run(application, args)
+    finally:
+        stop_queue_logging()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main(sys.argv[1:])
\ No newline at end of file
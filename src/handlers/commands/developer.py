@@ -0,0 +1,45 @@
+import logging
+
+from telegram import Update
+from telegram.ext import CommandHandler, ContextTypes, filters
+
+from src.settings import DEVELOPER_CHAT_ID
+from src.utils.instrumentation import stats_report
+from src.utils.loop_monitor import loop_monitor
+
+
+logger = logging.getLogger("expense_bot.handlers.commands")
+
+
+def developer_filter() -> filters.BaseFilter:
+    """
+    Solo deja pasar los mensajes del chat de DEVELOPER_CHAT_ID. Si no está configurado no deja pasar nada.
+    """
+    if not DEVELOPER_CHAT_ID:
+        return filters.Chat(chat_id=[])
+    return filters.Chat(chat_id=int(DEVELOPER_CHAT_ID))
+
+
+DEVELOPER_ONLY = developer_filter()
+
+
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /perf (solo para el desarrollador): lag del bucle de eventos y últimos parones del bot, con los
+    handlers que estaban en marcha en cada uno.
+    """
+    logger.info("El desarrollador ha pedido /perf")
+    await update.message.reply_text(loop_monitor.report())
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Comando /stats (solo para el desarrollador): percentiles de latencia de cada handler de las
+    conversaciones, separando el tiempo en la API de Telegram y en almacenamiento, y el total por estado.
+    """
+    logger.info("El desarrollador ha pedido /stats")
+    await update.message.reply_text(stats_report())
+
+
+perf_handler = CommandHandler("perf", perf_command, filters=DEVELOPER_ONLY)
+stats_handler = CommandHandler("stats", stats_command, filters=DEVELOPER_ONLY)
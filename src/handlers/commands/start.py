@@ -32,7 +32,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"❌ Hola {user.first_name}! Parece que no estás entre los usuarios registrados. Por favor usa /nuevo_usuario para darte de alta :)"
         )
 
-        logger.warning(f"Usuario no registrado {user.id} - {user.first_name} intentó usar /start.")
+        logger.warning("Usuario no registrado %s - %s intentó usar /start.", user.id, user.first_name)
 
 
 
@@ -3,11 +3,11 @@ import random
 #from datetime import datetime
 from enum import IntEnum, auto
 
-from src.settings import DATA_FILE_PATH
-from src.utils.category_utils import load_categories, load_category_markup, chunk_list
+from src.utils.category_utils import category_store, load_category_markup, chunk_list
 from src.utils.user_utils import check_user 
-from src.utils.csv_utils import get_last_trip, save_expense
 from src.models.expense import Expense
+from src.utils.write_queue import expense_write_queue
+from src.utils.tracing import tracer
 from src.models.state_manager import StateManager
 
 from src.utils.constantes import *
@@ -102,12 +102,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Nos traemos la info del usuario que se está comunicando
     user = update.effective_user
 
-    logger.info(f"El usuario {user.id} está intentando acceder al bot")
+    logger.info("El usuario %s está intentando acceder al bot", user.id)
     # Lo primero que comprobamos es si es un usuario registrado:
     if check_user(user.id):
         
-        logger.info(f"El usuario {user.id} está registrado")
+        logger.info("El usuario %s está registrado", user.id)
         
+        # Cada conversación tiene su traza (spans de cada paso en logs/traces.jsonl)
+        tracer.start_trace(context)
         context.user_data["expense_obj"] = Expense(user.id)
         
         # Generamos un botón para seleccionar una acción
@@ -129,7 +131,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await state_manager.update_send_message(update=update, context=context,
             text=f"❌ Hola {user.first_name}! Parece que no estás entre los usuarios registrados. Por favor usa /nuevo_usuario para darte de alta :)"
         )
-        logger.warning(f"Usuario no registrado {user.id} - {user.first_name} intentó usar /start.")
+        logger.warning("Usuario no registrado %s - %s intentó usar /start.", user.id, user.first_name)
         
         return ConversationHandler.END
 
@@ -154,7 +156,7 @@ async def enter_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     
     user = update.effective_user
     
-    logger.info(f"El usuario {user.id} quiere añadir un {expense_type}")
+    logger.info("El usuario %s quiere añadir un %s", user.id, expense_type)
 
     # No cambia ya que si venimos de hacer back en el estado categoria también viene de un CallbackQuery
     if expense_type == LABELS_ConvState[int(ConvState.SPENDING_ENTRY)]:
@@ -199,7 +201,7 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         context.user_data['expense_obj'].importe = input_data
     except Exception as e:
-        logger.error(f"El usuario {user.id} añade un {context.user_data['expense_obj'].tipo} incorrecto: {input_data}. Error: {e}")
+        logger.error("El usuario %s añade un %s incorrecto: %s. Error: %s", user.id, context.user_data['expense_obj'].tipo, input_data, e)
         
         await state_manager.update_send_message(update=update, context=context,
             text=f"Vaya, el importe de {input_data} es incorrecto, asegurate de que no es negativo o que es un valor numérico!"
@@ -210,7 +212,7 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     user = update.effective_user
     
-    logger.info(f"El usuario {user.id} quiere añadir un {context.user_data['expense_obj'].tipo}: {input_data}")
+    logger.info("El usuario %s quiere añadir un %s: %s", user.id, context.user_data['expense_obj'].tipo, input_data)
     
     
     # Función para generar el KeyboardMarkup
@@ -243,7 +245,7 @@ async def enter_description(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     context.user_data['expense_obj'].categoria = cat
     
-    logger.info(f"El usuario {user.id} añade el gasto a la categoría {context.user_data['expense_obj'].categoria}")
+    logger.info("El usuario %s añade el gasto a la categoría %s", user.id, context.user_data['expense_obj'].categoria)
     # Si la categoría es "Viajes" entonces se preguntará por el nombre/identificador del viaje, 
     # si no se pasará a preguntar por la descripción directamente
     if cat != 'Viajes':
@@ -258,7 +260,8 @@ async def enter_description(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Obtenemos el último viaje y preguntamos por si es ese el viaje sobre el que es el gasto,
         # en caso de que sea lo anotamos y pasamos al siguiente caso.
         # Si la respuesta es no, apuntamos el nuevo viaje.
-        last_trip = get_last_trip(DATA_FILE_PATH)
+        # Contando los gastos que aún están en la cola de escritura
+        last_trip = await expense_write_queue.get_last_trip(user.id)
 
         if last_trip:
             # Si hay un último viaje (en los últimos días) preguntamos si es de este viaje, si no pues apuntamos uno nuevo
@@ -334,7 +337,7 @@ async def enter_who(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     context.user_data['expense_obj'].descripcion = state_manager.get_input_data(update, context)
     
-    logger.info(f"El usuario {user.id} añade la descripción al {context.user_data['expense_obj'].tipo}")
+    logger.info("El usuario %s añade la descripción al %s", user.id, context.user_data['expense_obj'].tipo)
     
     if context.user_data['expense_obj'].tipo == 'gasto':
         markup = load_category_markup('quien')
@@ -376,10 +379,14 @@ async def enter_save(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     ind_save = state_manager.get_input_data(update, context)
     
     if ind_save == str(ConvState.YES):
-        await state_manager.update_send_message(update, context,
-                    f"🧠Genial! Guardamos el registro\nPara añadir otro registro usa el comando /nuevo_gasto.",
-                )
-        save_expense(context.user_data['expense_obj'], DATA_FILE_PATH)
+        # Se contesta cuando el gasto ya está guardado, no al meterlo en la cola
+        if await expense_write_queue.save(context.user_data['expense_obj']):
+            text = f"🧠Genial! Registro guardado\nPara añadir otro registro usa el comando /nuevo_gasto."
+        else:
+            logger.warning("El gasto del usuario %s sigue en la cola de escritura", user.id)
+            text = (f"⏳Estamos teniendo problemas para guardar el registro, se seguirá intentando.\n"
+                    f"Para añadir otro registro usa el comando /nuevo_gasto.")
+        await state_manager.update_send_message(update, context, text)
         state_manager.clear_manager(context)
         return ConversationHandler.END
     
@@ -499,7 +506,7 @@ async def modify_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         context.user_data['expense_obj'].importe = input_data
     except Exception as e:
-        logger.error(f"El usuario {user.id} añade un {context.user_data['expense_obj'].tipo} incorrecto: {input_data}. Error: {e}")
+        logger.error("El usuario %s añade un %s incorrecto: %s. Error: %s", user.id, context.user_data['expense_obj'].tipo, input_data, e)
         
         await state_manager.update_send_message(update=update, context=context,
             text=f"Vaya, el importe de {input_data} es incorrecto, asegurate de que no es negativo o que es un valor numérico!"
@@ -563,70 +570,92 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
     
 
-conv_modify = ConversationHandler(
-    entry_points=[
-        CallbackQueryHandler(enter_modify, pattern="^"+"$|^".join([str(c) for c in MODIFICATIONS.keys()])+"$")
-    ],
-    states={
-        ConvState.MODIFY: [CallbackQueryHandler(enter_modify, pattern="^"+"$|^".join([str(c) for c in MODIFICATIONS.keys()])+"$")],
-        ConvState.MODIFY_DATE:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_date)],
-        ConvState.MODIFY_EXPENSE:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_expense)],
-        ConvState.MODIFY_TRIP:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_trip)],
-        ConvState.MODIFY_DESCR:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_description)],
-        ConvState.MODIFY_CATEGORY:[
-            CallbackQueryHandler(modify_description, pattern="^"+"$|^".join([c for c in load_categories('gasto')])+"$"),
-            CallbackQueryHandler(modify_description, pattern="^"+"$|^".join([c for c in load_categories('ingreso')])+"$"),
-                            ],
-        ConvState.MODIFY_TYPE: [CallbackQueryHandler(modify_type, pattern=f"^{str(ConvState.INCOME_ENTRY)}$|^{str(ConvState.SPENDING_ENTRY)}$")],
-        ConvState.MODIFY_WHO: [CallbackQueryHandler(modify_who, pattern="^"+"$|^".join([c for c in load_categories('quien')])+"$")],  
-        ConvState.SAVE_MODIFY: [CallbackQueryHandler(enter_save, pattern=f"^{str(ConvState.YES)}$|^{str(ConvState.NO)}$")]    
-    },
-    map_to_parent={
-            # Return to top level menu
-            ConversationHandler.END: ConvState.SAVE,
-            # End conversation altogether
-            ConvState.NESTED_STOP: ConversationHandler.END,
-        },
-    fallbacks=[
-        CommandHandler("cancel", cancel),
-        CommandHandler("back", state_manager.back)],
+# El historial solo guarda el nombre del handler, aquí se registran para poder volver atrás con /back
+state_manager.register_handlers(
+    start, enter_import, select_category, enter_description, enter_description_from_trip,
+    enter_who, enter_confirm, enter_save, enter_modify, modify_date, modify_expense,
+    modify_trip, modify_description, modify_type, modify_who,
 )
 
 
-conv_new_enter_expense = ConversationHandler(
-    entry_points=[
-        CommandHandler("start", start),
-        CommandHandler("nuevo_gasto", start)],
-    states={
-        ConvState.ENTER_EXPENSE: [
-            CallbackQueryHandler(enter_import, pattern=f"^{str(ConvState.INCOME_ENTRY)}$|^{str(ConvState.SPENDING_ENTRY)}$"),
-                                ],
-        ConvState.SELECT_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_category)],
-        ConvState.ENTER_DESCRIPTION: [
-            CallbackQueryHandler(enter_description, pattern="^"+"$|^".join([c for c in load_categories('gasto')])+"$"),
-            CallbackQueryHandler(enter_description, pattern="^"+"$|^".join([c for c in load_categories('ingreso')])+"$"),
-                            ],
-        ConvState.ENTER_TRIP: [
-            MessageHandler(filters.TEXT & ~filters.COMMAND, enter_description_from_trip),
-            CallbackQueryHandler(enter_description_from_trip, pattern=f"^{str(ConvState.YES)}$|^{str(ConvState.NO)}$")
-                               ],
-        ConvState.ENTER_WHO:[
-            MessageHandler(filters.TEXT & ~filters.COMMAND, enter_who)
+def build_conversation() -> ConversationHandler:
+    """
+    Construye la conversación de añadir un gasto (con la de modificar anidada). No se construye al
+    importar el módulo sino al registrar los handlers (register_all_handlers, en main). Los botones de
+    categorías se comprueban contra category_store con cada callback (CategoryMatcher), no con una
+    regex fija: las categorías añadidas después se enrutan sin reiniciar.
+    """
+    conv_modify = ConversationHandler(
+        entry_points=[
+            CallbackQueryHandler(enter_modify, pattern="^"+"$|^".join([str(c) for c in MODIFICATIONS.keys()])+"$")
         ],
-        ConvState.CONFIRM:[
-            CallbackQueryHandler(enter_confirm, pattern="^"+"$|^".join([c for c in load_categories('quien')])+"$")
+        states={
+            ConvState.MODIFY: [CallbackQueryHandler(enter_modify, pattern="^"+"$|^".join([str(c) for c in MODIFICATIONS.keys()])+"$")],
+            ConvState.MODIFY_DATE:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_date)],
+            ConvState.MODIFY_EXPENSE:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_expense)],
+            ConvState.MODIFY_TRIP:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_trip)],
+            ConvState.MODIFY_DESCR:[MessageHandler(filters.TEXT & ~filters.COMMAND, modify_description)],
+            ConvState.MODIFY_CATEGORY:[
+                CallbackQueryHandler(modify_description, pattern=category_store.matcher('gasto', 'ingreso')),
+                                ],
+            ConvState.MODIFY_TYPE: [CallbackQueryHandler(modify_type, pattern=f"^{str(ConvState.INCOME_ENTRY)}$|^{str(ConvState.SPENDING_ENTRY)}$")],
+            ConvState.MODIFY_WHO: [CallbackQueryHandler(modify_who, pattern=category_store.matcher('quien'))],  
+            ConvState.SAVE_MODIFY: [CallbackQueryHandler(enter_save, pattern=f"^{str(ConvState.YES)}$|^{str(ConvState.NO)}$")]    
+        },
+        map_to_parent={
+                # Return to top level menu
+                ConversationHandler.END: ConvState.SAVE,
+                # End conversation altogether
+                ConvState.NESTED_STOP: ConversationHandler.END,
+            },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            CommandHandler("back", state_manager.back)],
+        name="modify_expense",
+        persistent=True,
+    )
+
+
+    return ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start),
+            CommandHandler("nuevo_gasto", start)],
+        states={
+            ConvState.ENTER_EXPENSE: [
+                CallbackQueryHandler(enter_import, pattern=f"^{str(ConvState.INCOME_ENTRY)}$|^{str(ConvState.SPENDING_ENTRY)}$"),
+                                    ],
+            ConvState.SELECT_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, select_category)],
+            ConvState.ENTER_DESCRIPTION: [
+                CallbackQueryHandler(enter_description, pattern=category_store.matcher('gasto', 'ingreso')),
+                                ],
+            ConvState.ENTER_TRIP: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, enter_description_from_trip),
+                CallbackQueryHandler(enter_description_from_trip, pattern=f"^{str(ConvState.YES)}$|^{str(ConvState.NO)}$")
+                                   ],
+            ConvState.ENTER_WHO:[
+                MessageHandler(filters.TEXT & ~filters.COMMAND, enter_who)
+            ],
+            ConvState.CONFIRM:[
+                CallbackQueryHandler(enter_confirm, pattern=category_store.matcher('quien'))
             
-        ],
-        ConvState.SAVE:[
-            CallbackQueryHandler(enter_save, pattern=f"^{str(ConvState.YES)}$|^{str(ConvState.NO)}$")
-        ],
-        ConvState.MODIFY: [conv_modify]
-    },
-    fallbacks=[
-        CommandHandler("cancel", cancel),
-        CommandHandler("back", state_manager.back)],
-    per_message=False 
-    
-)
+            ],
+            ConvState.SAVE:[
+                CallbackQueryHandler(enter_save, pattern=f"^{str(ConvState.YES)}$|^{str(ConvState.NO)}$")
+            ],
+            ConvState.MODIFY: [conv_modify]
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            CommandHandler("back", state_manager.back)],
+        per_message=False,
+        name="new_enter_expense",
+        persistent=True,
+    )
 
 
+def __getattr__(name: str):
+    # conv_new_enter_expense se construye la primera vez que se pide y se queda en el módulo
+    if name == "conv_new_enter_expense":
+        globals()[name] = build_conversation()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -54,7 +54,7 @@ async def enter_pwd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_pwd = update.message.text
 
-    if add_user(user.id, user_pwd):
+    if await add_user(user.id, user_pwd):
 
         logger.info("Usuario registrado con éxito: %s, %s", user.id, user.first_name)
         await update.message.reply_text(
@@ -93,6 +93,8 @@ conv_nuevo_usuario_handler = ConversationHandler(
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True,
-        per_message=False
+        per_message=False,
+        name="nuevo_usuario",
+        persistent=True,
 
     )
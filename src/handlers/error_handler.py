@@ -3,17 +3,12 @@
 # This program is dedicated to the public domain under the CC0 license.
 
 """This is a very simple example on how one could implement a custom error handler."""
-import html
-import json
 import logging
-import traceback
 
-from telegram import Update
-from telegram.constants import ParseMode
-from telegram.ext import Application, CommandHandler, ContextTypes
+from telegram.ext import ContextTypes
 
-
-from src.settings import DEVELOPER_CHAT_ID
+from src.utils.error_notifier import error_notifier
+from src.utils.metrics import ERRORS_BY_TYPE
 
 logger = logging.getLogger("expense_bot.handlers.error_handler")
 
@@ -22,32 +17,15 @@ logger = logging.getLogger("expense_bot.handlers.error_handler")
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Log the error and send a telegram message to notify the developer."""
+    """
+    Log the error and queue it for the developer digest (see ErrorNotifier): errors are grouped by
+    traceback and sent off the hot path, so an outage doesn't flood the developer chat.
+    """
     # Log the error before we do anything else, so we can see it even if something breaks.
     logger.error("Exception while handling an update:", exc_info=context.error)
+    ERRORS_BY_TYPE.inc(type(context.error).__name__)
+    error_notifier.report(context.error, update, context)
 
-    # traceback.format_exception returns the usual python message about an exception, but as a
-    # list of strings rather than a single string, so we have to join them together.
-    tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
-    tb_string = "".join(tb_list)
-
-    # Build the message with some markup and additional information about what happened.
-    # You might need to add some logic to deal with messages longer than the 4096 character limit.
-    update_str = update.to_dict() if isinstance(update, Update) else str(update)
-    message = (
-        "An exception was raised while handling an update\n"
-        f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}"
-        "</pre>\n\n"
-        f"<pre>context.chat_data = {html.escape(str(context.chat_data))}</pre>\n\n"
-        f"<pre>context.user_data = {html.escape(str(context.user_data))}</pre>\n\n"
-        f"<pre>{html.escape(tb_string)}</pre>"
-    )
-
-    # Finally, send the message
-    await context.bot.send_message(
-        chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
-    )
-    
 # async def bad_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 #     """Raise an error to trigger the error handler."""
 #     await context.bot.wrong_method_name()  # type: ignore[attr-defined]
@@ -8,8 +8,10 @@ from telegram.ext import ApplicationBuilder
 # importas conversaciones
 from handlers.conversations.new_user import conv_nuevo_usuario_handler
 # from handlers.conversations.enter_expense import enter_expense
-from handlers.conversations.new_enter_expense import conv_new_enter_expense
+from handlers.conversations import new_enter_expense
 from handlers.error_handler import error_handler
+from handlers.commands.developer import perf_handler, stats_handler
+from src.utils.instrumentation import instrument_conversation
 from telegram.ext import CommandHandler
 
 def register_all_handlers(application):
@@ -17,9 +19,14 @@ def register_all_handlers(application):
     # application.add_handler(start_handler)
 
 
-    # Flujos de conversación
-    application.add_handler(conv_new_enter_expense)
-    application.add_handler(conv_nuevo_usuario_handler)
+    # Comandos del desarrollador
+    application.add_handler(perf_handler)
+    application.add_handler(stats_handler)
+
+    # Flujos de conversación (instrumentados para saber qué handler está en marcha en cada momento).
+    # La de gastos se construye ahora, la primera vez que se pide, y no al importar este módulo
+    application.add_handler(instrument_conversation(new_enter_expense.conv_new_enter_expense))
+    application.add_handler(instrument_conversation(conv_nuevo_usuario_handler))
     
 
     # ...and the error handler
@@ -8,7 +8,7 @@ from typing import Optional, List
 # esto mejora la legibilidad y la mantenibilidad del código, así como facilitar el uso de herramientas
 # de análisis estadístico. 
 
-from utils.helper_functions import format_date
+from src.utils.helper_functions import format_date
 
 @dataclass
 class Expense:
@@ -157,4 +157,5 @@ class Expense:
     # Por tanto, la lógica de de I/O o de añadir más métodos como list_expense(), find_by_date(), ...
     # de eso se encargará la función externa en csv_utils.py o una clase más amplia llamada ExpenseRepository
     # que se podría encargar de estas lógicas (posible mejora a futuro).
+    # -> Ya está hecho en models/expense_repository.py (ExpenseRepository, con backend csv o SQLite).
 
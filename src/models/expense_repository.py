@@ -0,0 +1,220 @@
+import csv
+import sqlite3
+import threading
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from src.settings import DATA_FILE_PATH, DB_FILE_PATH, EXPENSE_BACKEND
+from src.models.expense import Expense
+from src.utils import csv_utils
+
+
+class ExpenseRepository(ABC):
+    """
+    Interfaz de acceso a los gastos guardados. Los handlers solo hablan con esta clase, así el modelo
+    (Expense) no sabe nada del I/O y cambiar de CSV a SQLite (o a lo que venga) no toca ni el modelo
+    ni las conversaciones.
+    """
+
+    @abstractmethod
+    def save(self, expense: Expense) -> None:
+        """Guarda un gasto"""
+
+    @abstractmethod
+    def get_last_trip(self, user: Optional[int] = None, n: int = 1) -> Optional[str]:
+        """
+        Devuelve el último viaje apuntado en los últimos n meses (de 30 días).
+
+        Args:
+            user (int, optional): Si se pasa, solo se miran los gastos de ese usuario.
+            n (int, optional): Número de meses hacia atrás. Defaults to 1.
+
+        Returns:
+            str: El nombre del último viaje o None si no hay ninguno en la ventana.
+        """
+
+    def save_many(self, expenses: list[Expense], sync: bool = False) -> None:
+        """
+        Guarda un lote de gastos de una vez. Si sync es True no se vuelve hasta que están en disco.
+        """
+        for expense in expenses:
+            self.save(expense)
+        if sync:
+            self.sync()
+
+    def sync(self) -> None:
+        """Fuerza a disco lo escrito hasta ahora"""
+
+    def warm_up(self) -> None:
+        """Prepara lo que haga falta antes de recibir mensajes (se llama desde el post_init del bot)"""
+
+
+class CsvExpenseRepository(ExpenseRepository):
+    """
+    Repositorio sobre el csv de siempre (data/gastos.csv), delega en csv_utils.
+    """
+
+    def __init__(self, path: Path = DATA_FILE_PATH):
+        self.path = path
+
+    def save(self, expense: Expense) -> None:
+        csv_utils.save_expense(expense, self.path)
+
+    def save_many(self, expenses: list[Expense], sync: bool = False) -> None:
+        csv_utils.save_expenses(expenses, self.path, fsync=sync)
+
+    def sync(self) -> None:
+        csv_utils.sync_file(self.path)
+
+    def get_last_trip(self, user: Optional[int] = None, n: int = 1) -> Optional[str]:
+        return csv_utils.get_last_trip(self.path, n, user)
+
+    def warm_up(self) -> None:
+        csv_utils.trip_index.build(self.path)
+
+
+class SqliteExpenseRepository(ExpenseRepository):
+    """
+    Repositorio sobre SQLite en modo WAL.
+
+    La fecha se guarda en ISO (YYYY-MM-DD) para poder indexarla y ordenarla, y hay índices sobre
+    (user, fecha) y (viaje, fecha), de forma que guardar y buscar el último viaje es O(log n) aunque
+    la tabla crezca. Las consultas son siempre el mismo texto SQL con parámetros, así sqlite3 reutiliza
+    la sentencia preparada de su caché en lugar de compilarla en cada llamada.
+
+    La conexión se abre la primera vez que se usa, no al importar el módulo.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS gastos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            importe REAL,
+            tipo TEXT,
+            concepto TEXT,
+            descripcion TEXT,
+            quien TEXT,
+            viaje TEXT NOT NULL DEFAULT '',
+            anualizable TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_gastos_user_fecha ON gastos (user, fecha);
+        CREATE INDEX IF NOT EXISTS idx_gastos_viaje_fecha ON gastos (viaje, fecha);
+    """
+
+    _INSERT = (
+        "INSERT INTO gastos (user, fecha, importe, tipo, concepto, descripcion, quien, viaje, anualizable) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    _LAST_TRIP_USER = (
+        "SELECT viaje FROM gastos WHERE user = ? AND fecha > ? AND viaje != '' "
+        "ORDER BY fecha DESC, id DESC LIMIT 1"
+    )
+    _LAST_TRIP_ALL = (
+        "SELECT viaje FROM gastos WHERE viaje != '' AND fecha > ? "
+        "ORDER BY fecha DESC, id DESC LIMIT 1"
+    )
+
+    def __init__(self, path: Path = DB_FILE_PATH, legacy_csv_path: Optional[Path] = None):
+        self.path = path
+        self.legacy_csv_path = legacy_csv_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock() # sqlite3 no permite usar la misma conexión a la vez desde varios hilos
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        new_db = not self.path.exists()
+
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # en WAL es seguro ante caídas del proceso
+        conn.executescript(self._SCHEMA)
+
+        # Si la base de datos es nueva y hay un csv de antes, lo migramos una única vez
+        if new_db and self.legacy_csv_path is not None and self.legacy_csv_path.exists():
+            self._import_csv(conn, self.legacy_csv_path)
+        return conn
+
+    @staticmethod
+    def _to_iso(fecha: str) -> str:
+        """Pasa una fecha dd/mm/YYYY a YYYY-MM-DD, si no se puede la deja tal cual"""
+        try:
+            return datetime.strptime(fecha, "%d/%m/%Y").strftime("%Y-%m-%d")
+        except (TypeError, ValueError):
+            return fecha
+
+    def _to_params(self, row: list[str]) -> tuple:
+        user, fecha, importe, tipo, concepto, descripcion, quien, viaje, anualizable = row
+        try:
+            importe = float(importe)
+        except (TypeError, ValueError):
+            importe = None
+        return (user, self._to_iso(fecha), importe, tipo, concepto, descripcion, quien, viaje or "", anualizable)
+
+    def _import_csv(self, conn: sqlite3.Connection, path: Path) -> None:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f, delimiter=";")
+            next(reader, None) # cabecera
+            rows = [self._to_params(row) for row in reader if len(row) == 9]
+        with conn:
+            conn.executemany(self._INSERT, rows)
+
+    def save(self, expense: Expense) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(self._INSERT, self._to_params(expense.to_csv_row()))
+
+    def save_many(self, expenses: list[Expense], sync: bool = False) -> None:
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(self._INSERT, [self._to_params(e.to_csv_row()) for e in expenses])
+            if sync:
+                self._checkpoint()
+
+    def sync(self) -> None:
+        with self._lock:
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        # Con synchronous=NORMAL los commits en WAL no hacen fsync, el checkpoint sí lo hace (WAL y base de datos)
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def get_last_trip(self, user: Optional[int] = None, n: int = 1) -> Optional[str]:
+        # Como en el csv: cuenta si tiene menos de n*30 días, uno de justo n*30 días ya se queda fuera
+        since = (datetime.today() - timedelta(days=n*30)).strftime("%Y-%m-%d")
+        with self._lock:
+            if user is None:
+                row = self.conn.execute(self._LAST_TRIP_ALL, (since,)).fetchone()
+            else:
+                row = self.conn.execute(self._LAST_TRIP_USER, (str(user), since)).fetchone()
+        return row[0] if row else None
+
+    def warm_up(self) -> None:
+        self.conn # abre la conexión y crea el esquema si hace falta
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def build_expense_repository(backend: str = EXPENSE_BACKEND) -> ExpenseRepository:
+    """
+    Construye el repositorio configurado en settings (EXPENSE_BACKEND).
+    """
+    if backend == "csv":
+        return CsvExpenseRepository(DATA_FILE_PATH)
+    elif backend == "sqlite":
+        return SqliteExpenseRepository(DB_FILE_PATH, legacy_csv_path=DATA_FILE_PATH)
+    raise ValueError(f"Backend de gastos desconocido: {backend}")
+
+
+expense_repository = build_expense_repository()
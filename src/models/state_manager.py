@@ -1,13 +1,83 @@
+import asyncio
+from contextvars import ContextVar
 from copy import deepcopy
+from typing import Any, Callable, NamedTuple, Optional
+
 from telegram import Update, CallbackQuery, Message
 from telegram.ext import ContextTypes, ConversationHandler
 
+from src.settings import STATE_HISTORY_DEPTH
+from src.models.expense import Expense
+from src.utils.tracing import TRACE_KEY, tracer
+
+# Así se guardan en los snapshots los valores que no se pueden compartir tal cual
+EXPENSE_MARK = "__expense__"
+REMOVED_MARK = "__removed__"
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+class HistoryEntry(NamedTuple):
+    """
+    Un paso del historial, pensado para que ocupe poco y se pueda serializar (se guarda con la persistencia
+    del bot y sobrevive a un reinicio):
+        - state: el estado de la conversación,
+        - handler: el nombre del handler, la función se busca en el registro del StateManager,
+        - input_data: el texto o callback_data que llegó en ese paso,
+        - diff: solo las claves de user_data que han cambiado respecto al paso anterior (copy-on-write), y del
+          gasto solo los campos que han cambiado. Lo que no cambia se comparte con los snapshots previos.
+    """
+    state: int
+    handler: Optional[str]
+    input_data: Optional[str]
+    diff: dict[str, Any]
+
+
+def freeze(value: Any) -> Any:
+    """Convierte un valor de user_data en algo que se puede guardar en el snapshot sin que cambie después"""
+    if isinstance(value, _IMMUTABLE):
+        return value
+    if isinstance(value, Expense):
+        return {EXPENSE_MARK: value.serialize()}
+    return deepcopy(value)
+
+
+def thaw(value: Any) -> Any:
+    """Lo contrario de freeze: devuelve un valor nuevo para meter en user_data"""
+    if isinstance(value, dict) and EXPENSE_MARK in value:
+        return Expense.deserialize(value[EXPENSE_MARK])
+    if isinstance(value, _IMMUTABLE):
+        return value
+    return deepcopy(value)
+
+
+class _PendingSend:
+    """Lo último que se ha pedido mandar para un update mientras se agrupan sus envíos"""
+    __slots__ = ("update", "text", "reply_markup")
+
+    def __init__(self, update: Update, text: str, reply_markup: Any = None):
+        self.update = update
+        self.text = text
+        self.reply_markup = reply_markup
+
+
+# Envío pendiente de la tarea en curso (StateManager.back), se hereda en lo que llame el handler
+_pending_send: ContextVar[Optional[_PendingSend]] = ContextVar("expense_bot_pending_send", default=None)
+
+
 class StateManager:
     """
     Administrador de estados y snapshot de datos en python-telegram-bot v20+.
     Maneja push/pop de estados, snapshots de user_data, y responde correctamente a Message o CallbackQuery.
     También almacena datos de entrada originales (callback_query.data o message.text) para facilitar reentrada.
 
+    Los snapshots no copian user_data entero en cada paso: cada entrada del historial guarda solo las claves
+    que han cambiado (el Expense a través de serialize/deserialize) y el historial tiene como mucho max_depth
+    pasos.
+
+    Hay una sola instancia para todos los usuarios (y con concurrent_updates los handlers de usuarios
+    distintos se ejecutan a la vez), así que aquí no se guarda nada del usuario: todo su estado, también el
+    comando con el que vuelve atrás, va en su context.user_data.
+
 
     Returns:
         _type_: _description_
@@ -15,11 +85,41 @@ class StateManager:
     HISTORY_KEY = "_state_history"
     LAST_INPUT_KEY = "_last_input_data"
     LAST_INPUT_UPDATE = "_last_input_update"
-    BACK_COMMAND = ""
-    FIRST_BACK = True
+    BACK_COMMAND_KEY = "_back_command"
+    _INTERNAL_KEYS = (HISTORY_KEY, LAST_INPUT_KEY, LAST_INPUT_UPDATE, BACK_COMMAND_KEY, TRACE_KEY)
     
-    def __init__(self):
-        pass
+    def __init__(self, max_depth: int = STATE_HISTORY_DEPTH):
+        self.max_depth = max_depth
+        self._handlers: dict[str, Callable] = {}
+
+    def register_handlers(self, *handlers: Callable) -> None:
+        """
+        Registra los handlers por nombre, para poder recuperarlos al volver atrás aunque el historial venga
+        de la persistencia (en el historial solo se guarda el nombre).
+        """
+        for handler in handlers:
+            self._handlers[handler.__name__] = handler
+
+    @staticmethod
+    def _apply_diff(snapshot: dict[str, Any], diff: dict[str, Any]) -> dict[str, Any]:
+        """Aplica un diff sobre un snapshot congelado (sin modificar los valores compartidos)"""
+        for k, v in diff.items():
+            if v == REMOVED_MARK:
+                snapshot.pop(k, None)
+            elif isinstance(v, dict) and EXPENSE_MARK in v and isinstance(snapshot.get(k), dict) and EXPENSE_MARK in snapshot[k]:
+                # Del gasto solo se guardan los campos que cambian
+                snapshot[k] = {EXPENSE_MARK: {**snapshot[k][EXPENSE_MARK], **v[EXPENSE_MARK]}}
+            else:
+                snapshot[k] = v
+        return snapshot
+
+    @staticmethod
+    def _diff_value(previous: Any, frozen: Any) -> Any:
+        if (isinstance(previous, dict) and EXPENSE_MARK in previous
+                and isinstance(frozen, dict) and EXPENSE_MARK in frozen):
+            old, new = previous[EXPENSE_MARK], frozen[EXPENSE_MARK]
+            return {EXPENSE_MARK: {f: v for f, v in new.items() if old.get(f) != v}}
+        return frozen
 
     def _extract_input_data(self, update: Update) -> str | None:
         """
@@ -39,7 +139,8 @@ class StateManager:
         La función getattr() se usa para obtener el valor de un atributo de un objeto, utilizando
         el nombre del atributo como una cadena de texto
         """
-        if getattr(update.message, "text", None) == self.BACK_COMMAND:
+        back_command = context.user_data.get(self.BACK_COMMAND_KEY)
+        if back_command and getattr(update.message, "text", None) == back_command:
             return context.user_data.get(self.LAST_INPUT_KEY)
         return (
             # getattr(update, "reentry_data", None)
@@ -47,34 +148,50 @@ class StateManager:
             or getattr(update.message, "text", None)
         )
     
-    def _extract_input_update(self, update: Update) -> str | None:
+    def get_input_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> str | None:
         """
-        Extrae input data del update (callback_query o message).
-        
-        En un futuro se podría implementar para más
+        Los Update ya no se guardan en el historial (ocupan mucho y cambian), al volver atrás se usa el actual.
         """
-        if update.callback_query:
-            return update.callback_query
-        elif update.message:
-            return update.message
-        return None
-    
-    def get_input_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> str | None:
-        
-        if getattr(update.message, "text", None) == self.BACK_COMMAND:
-            return context.user_data.get(self.LAST_INPUT_UPDATE)
         return update
-        
+
+    def _current_snapshot(self, history: list[HistoryEntry]) -> dict[str, Any]:
+        """Reconstruye el snapshot completo (congelado) del último paso del historial"""
+        snapshot = {}
+        for entry in history:
+            self._apply_diff(snapshot, entry.diff)
+        return snapshot
+
     def push(self, update: Update, context: ContextTypes.DEFAULT_TYPE, state: int, handler_func):
         """
-        Guarda en la pila el conjunto (state, handler_func, snapshot de user_data, input_data).
+        Guarda en la pila el conjunto (state, nombre de handler_func, input_data, diff de user_data).
         Debe llamarse justo antes de cambiar de estado, tras leer input y guardar datos.
         """
+        handler_name = getattr(handler_func, "__name__", None)
+        if handler_name is not None:
+            self._handlers.setdefault(handler_name, handler_func)
+
         input_data = self._extract_input_data(update)
-        input_update = self._extract_input_update(update)
-        snapshot = {k: deepcopy(v) for k, v in context.user_data.items() if k != self.HISTORY_KEY} # Hace un snapshot de context.user_data para recuperarlos
         history = context.user_data.setdefault(self.HISTORY_KEY, [])
-        history.append((state, handler_func, snapshot, input_data, input_update)) # En "_state_history" guarda el estado junto con el snapshot y otras cosas
+        previous = self._current_snapshot(history)
+
+        # Solo se guardan las claves que han cambiado desde el paso anterior
+        diff = {}
+        for k, v in context.user_data.items():
+            if k in self._INTERNAL_KEYS:
+                continue
+            frozen = freeze(v)
+            if k not in previous or previous[k] != frozen:
+                diff[k] = self._diff_value(previous.get(k), frozen)
+        for k in previous:
+            if k not in context.user_data:
+                diff[k] = REMOVED_MARK
+
+        history.append(HistoryEntry(state, handler_name, input_data, diff))
+
+        # Si se pasa del máximo, el paso más antiguo se funde con el siguiente para no perder su diff
+        while len(history) > self.max_depth > 0:
+            oldest = history.pop(0)
+            history[0] = history[0]._replace(diff=self._apply_diff(dict(oldest.diff), history[0].diff))
 
     def pop(self, context: ContextTypes.DEFAULT_TYPE):
         """
@@ -88,61 +205,93 @@ class StateManager:
         _ = history.pop()
         if not history:
             return None, None, None
-        state, handler, snapshot, input_data, input_update = history.pop() # Vuelvo dos estados para atrás
+        snapshot = self._current_snapshot(history)
+        state, handler_name, input_data, _ = history.pop() # Vuelvo dos estados para atrás
+        handler = self._handlers.get(handler_name)
+        trace_id = context.user_data.get(TRACE_KEY)
         context.user_data.clear()
-        context.user_data.update(snapshot)
+        context.user_data.update({k: thaw(v) for k, v in snapshot.items()})
+        if trace_id is not None:
+            context.user_data[TRACE_KEY] = trace_id # volver atrás sigue siendo la misma conversación
+        context.user_data[self.HISTORY_KEY] = history # el handler al que se vuelve hará su push de nuevo
         context.user_data[self.LAST_INPUT_KEY] = input_data  # útil para handlers que dependen del input
-        
-        context.user_data[self.LAST_INPUT_UPDATE] = input_update  # útil para handlers que dependen del input
         return state, handler, input_data
 
     async def back(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         """
         Manejador para /back: recupera el estado anterior, notifica al usuario y llama al handler.
         Además, inyecta el input_data restaurado en el objeto update como reentry_data.
+
+        El aviso de "Volviendo..." y el mensaje del handler al que se vuelve van al mismo sitio, así que se
+        agrupan: solo sale el último (una llamada a Telegram en vez de dos).
         """
-        if self.FIRST_BACK:
-            self.BACK_COMMAND = self._extract_input_data(update)
-            self.FIRST_BACK = False
-        
+        # El comando con el que se ha vuelto (/back) se guarda en el user_data de cada usuario
+        back_command = context.user_data.get(self.BACK_COMMAND_KEY) or self._extract_input_data(update)
+
         state, handler, input_data = self.pop(context)
+        context.user_data[self.BACK_COMMAND_KEY] = back_command
         if not handler:
             await self._send(update, "No hay estado anterior.\n👋Hasta luego.\n\nPara empezar la conversación usa /start o /nuevo_gasto")
             return ConversationHandler.END
 
-        await self._send(update, "Volviendo al estado anterior...")
-
-        # Inyectar input_data como atributo temporal al update
-        # setattr(update, "reentry_data", input_data)
-
-        return await handler(update, context)
+        pending = _PendingSend(update, "Volviendo al estado anterior...")
+        token = _pending_send.set(pending)
+        try:
+            # Inyectar input_data como atributo temporal al update
+            # setattr(update, "reentry_data", input_data)
+            result = await handler(update, context)
+        finally:
+            _pending_send.reset(token)
+        await self._deliver(update, pending.text, pending.reply_markup)
+        return result
 
     async def update_send_message(self, update, context, text, reply_markup = None):
         """
         Función para mandar el mensaje desde el state manager, en función del update que sea
+        (cada llamada es un span de la traza de la conversación).
+
+        Si se están agrupando los envíos de este update (back) solo se apunta, y sale el último al terminar.
         """
-        
-        if update.callback_query:
-            await update.callback_query.answer()
-            return await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
-        elif update.message:
-            return await update.message.reply_text(text, reply_markup=reply_markup)
-        else:
-            print('nada')
-    
+        pending = _pending_send.get()
+        if pending is not None and pending.update is update:
+            pending.text, pending.reply_markup = text, reply_markup
+            return None
+        return await self._deliver(update, text, reply_markup)
+
     async def _send(self, update: Update, text: str):
         """
         Envía o edita mensaje según el tipo de update.
         """
+        await self.update_send_message(update, None, text)
+
+    async def _deliver(self, update, text, reply_markup = None):
         if update.callback_query:
-            await update.callback_query.answer()
-            await update.callback_query.edit_message_text(text)
+            with tracer.span("update_send_message", "telegram", method="edit_message_text"):
+                return await self._answer_and_edit(update.callback_query, text, reply_markup)
         elif update.message:
-            await update.message.reply_text(text)
+            with tracer.span("update_send_message", "telegram", method="reply_text"):
+                return await update.message.reply_text(text, reply_markup=reply_markup)
         else:
-            pass
+            print('nada')
+
+    @staticmethod
+    async def _answer_and_edit(query: CallbackQuery, text: str, reply_markup = None):
+        """
+        Responde al botón y edita su mensaje a la vez (las dos peticiones salen juntas, un solo viaje de
+        ida y vuelta). Si el mensaje ya tiene ese texto y ese teclado no se edita: Telegram contestaría
+        "Message is not modified" y es una petición perdida.
+        """
+        message = query.message
+        if (message is not None and getattr(message, "text", None) == text
+                and getattr(message, "reply_markup", None) == reply_markup):
+            await query.answer()
+            return message
+        results = await asyncio.gather(query.answer(), query.edit_message_text(text, reply_markup=reply_markup),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results[1]
     
     def clear_manager(self, context):
-        context.user_data.clear()
-        self.BACK_COMMAND = ""
-        self.FIRST_BACK = True
\ No newline at end of file
+        context.user_data.clear()
\ No newline at end of file
@@ -11,9 +11,100 @@ load_dotenv(dotenv_path=env_path)
 TOKEN = os.getenv('API_TOKEN')
 DATA_PATH = BASE_DIR / "data"
 DATA_FILE_PATH = BASE_DIR / "data" / "gastos.csv"
+DB_FILE_PATH = BASE_DIR / "data" / "gastos.db"
+# 'csv' (data/gastos.csv, el que leen los notebooks y el cron) o 'sqlite' (data/gastos.db). Al pasar a
+# 'sqlite' el csv se importa una sola vez, al crear la base de datos; lo que se apunte después ya no va al csv
+EXPENSE_BACKEND = os.getenv("EXPENSE_BACKEND", "csv")
+
+# Cola de escritura de gastos (se guardan por lotes en segundo plano)
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 50))           # gastos por lote como máximo
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 0.5)) # segundos que espera un lote a llenarse si hay atasco
+WRITE_DURABILITY = os.getenv("WRITE_DURABILITY", "batch")            # 'batch' (fsync en cada lote) o 'interval'
+WRITE_SYNC_INTERVAL = float(os.getenv("WRITE_SYNC_INTERVAL", 5))     # segundos entre fsync en modo 'interval'
+WRITE_CONFIRM_TIMEOUT = float(os.getenv("WRITE_CONFIRM_TIMEOUT", 5))  # segundos que se espera al guardado antes de contestar
 REGISTER_PWD = os.getenv('REGISTER_PWD')
 DEVELOPER_CHAT_ID = os.getenv("DEVELOPER_CHAT_ID")
 
+# Avisos de errores al desarrollador: se agrupan por traceback y se manda un resumen por ventana
+ERROR_DIGEST_WINDOW = float(os.getenv("ERROR_DIGEST_WINDOW", 60))           # segundos que se acumulan
+ERROR_NOTIFY_MAX_PER_HOUR = int(os.getenv("ERROR_NOTIFY_MAX_PER_HOUR", 20)) # mensajes como máximo, después se esperan
+
+STATE_HISTORY_DEPTH = int(os.getenv("STATE_HISTORY_DEPTH", 20)) # pasos que se guardan para /back
+
+# Modo de recibir los updates: 'polling' (getUpdates) o 'webhook' (Telegram hace POST a nuestro servidor)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")                # dirección en la que escucha el servidor
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")                                   # URL pública (https) sin el path, p. ej. detrás de un proxy
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")                 # Telegram lo manda en cada POST
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))  # conexiones simultáneas que abre Telegram
+
+# Perfiles de red del cliente de la API de Telegram (utils/telegram_request.py). Los envíos y getUpdates
+# van por pools de conexiones separados, así un long polling no ocupa la conexión de un envío.
+#   pool_size / updates_pool_size: conexiones como máximo para envíos / para getUpdates
+#   keepalive_connections, keepalive_expiry: conexiones que se mantienen abiertas y cuántos segundos
+#   *_timeout: segundos de connect, read, write y de espera a una conexión libre del pool (pool)
+#   http2: HTTP/2 (necesita python-telegram-bot[http2]; si no está se usa HTTP/1.1)
+#   tcp_nodelay: desactiva Nagle en los sockets (por defecto sí, ver telegram_request.py)
+NETWORK_PROFILES = {
+    "default": dict(pool_size=256, updates_pool_size=1, keepalive_connections=32, keepalive_expiry=5.0,
+                    connect_timeout=5.0, read_timeout=5.0, write_timeout=5.0, pool_timeout=1.0, http2=False),
+    # Muchos envíos a la vez (informes, picos de usuarios): todas las conexiones se quedan abiertas
+    "burst": dict(pool_size=256, updates_pool_size=1, keepalive_connections=256, keepalive_expiry=60.0,
+                  connect_timeout=5.0, read_timeout=10.0, write_timeout=10.0, pool_timeout=5.0, http2=False),
+    # Pocas conexiones multiplexadas
+    "http2": dict(pool_size=8, updates_pool_size=1, keepalive_connections=8, keepalive_expiry=60.0,
+                  connect_timeout=5.0, read_timeout=10.0, write_timeout=10.0, pool_timeout=5.0, http2=True),
+    # Máquina pequeña o red lenta: pocas conexiones y timeouts largos
+    "constrained": dict(pool_size=8, updates_pool_size=1, keepalive_connections=8, keepalive_expiry=30.0,
+                        connect_timeout=10.0, read_timeout=15.0, write_timeout=15.0, pool_timeout=10.0, http2=False),
+}
+NETWORK_PROFILE = os.getenv("NETWORK_PROFILE", "default")
+
+# Límite de envíos a Telegram (token buckets, ver utils/rate_limiter.py): global, por chat y por grupo
+RATE_LIMIT_GLOBAL = float(os.getenv("RATE_LIMIT_GLOBAL", 25))                    # mensajes por segundo en total
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_BURST", 5))           # ráfaga (ritmo + ráfaga <= 30/s de Telegram)
+RATE_LIMIT_PER_CHAT = float(os.getenv("RATE_LIMIT_PER_CHAT", 1))                 # mensajes por segundo a un chat privado
+RATE_LIMIT_CHAT_BURST = int(os.getenv("RATE_LIMIT_CHAT_BURST", 3))               # ráfaga que se permite a un chat
+RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv("RATE_LIMIT_GROUP_PER_MINUTE", 20)) # mensajes por minuto a un grupo
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 3))             # reintentos tras un RetryAfter
+
+# Updates en paralelo (los de un mismo usuario siempre de uno en uno)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32))   # handlers ejecutándose a la vez
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", 1024)) # updates en curso o esperando turno
+
+# I/O bloqueante fuera del bucle de eventos
+IO_THREAD_POOL_SIZE = int(os.getenv("IO_THREAD_POOL_SIZE", 8))               # hilos para disco/SQLite
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "0").lower() in ("1", "true", "yes")      # avisa de handlers que bloquean
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", 0.1))   # segundos bloqueando para avisar
+
+# Monitor del lag del bucle de eventos (/perf)
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", 250))   # cada cuánto se mide
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", 100)) # a partir de aquí se apunta el parón
+LOOP_BLOCKING_STEP_MS = float(os.getenv("LOOP_BLOCKING_STEP_MS", 20)) # tramo síncrono de un handler que se apunta
+
+# Endpoint de métricas en formato Prometheus (GET /metrics), 0 = desactivado
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Logging en cola: los handlers solo encolan el registro y un hilo aparte lo escribe en consola y fichero
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1").lower() in ("1", "true", "yes")
+LOG_SAMPLE_THRESHOLD = int(os.getenv("LOG_SAMPLE_THRESHOLD", 50)) # INFO/s de los handlers a partir del que se muestrea, 0 = nunca
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))        # fracción de esos INFO que se guarda al muestrear
+
+# Trazas de las conversaciones: un span por paso, llamada a Telegram y acceso al disco, en JSONL
+# (se analizan con scripts/analyze_traces.py)
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1").lower() in ("1", "true", "yes")
+TRACE_PATH = Path(os.getenv("TRACE_PATH", BASE_DIR / "logs" / "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024)) # tamaño al que rota el fichero
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", 5))           # ficheros rotados que se guardan
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", 1))     # segundos entre escrituras
+
+# Persistencia de user_data y de las conversaciones (sobreviven a un reinicio)
+PERSISTENCE_PATH = BASE_DIR / "data" / "bot_state.db"
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", 10)) # segundos entre escrituras
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,350 @@
+"""
+Bot API de mentira para los tests y los benchmarks: un servidor HTTP local (tornado) que habla lo justo del
+protocolo de Telegram para que una Application de python-telegram-bot arranque contra él
+(ApplicationBuilder().base_url(api.base_url)), más un emisor que hace de Telegram en modo webhook.
+
+    - getMe, deleteWebhook, setWebhook y getWebhookInfo responden lo mínimo.
+    - getUpdates hace long polling sobre una cola: push_update mete updates sintéticos.
+    - El resto de métodos (sendMessage, editMessageText, answerCallbackQuery...) se apuntan en calls y
+      devuelven un mensaje o True.
+
+rtt simula la latencia de red con Telegram: cada petición tarda rtt/2 en llegar y la respuesta otro
+rtt/2 en volver (y el WebhookSender espera rtt/2 antes de cada POST).
+
+max_per_second y max_per_chat_per_second imitan los límites de Telegram: los mensajes que se pasan (en
+el último segundo, en total o a un mismo chat) se contestan con un 429 y retry_after, como haría
+Telegram, y se cuentan en flood_errors.
+
+wait_for_messages(chat_id, n) espera a que el bot haya mandado (o editado) n mensajes a un chat, para los
+generadores de carga que hacen de usuario y esperan la respuesta antes del siguiente paso. Con
+record_calls=False no se guarda cada llamada en calls (en una prueba larga crecería sin parar).
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import httpx
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+logger = logging.getLogger("expense_bot.testing.fake_bot_api")
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Métodos que no cuentan para los límites de mensajes
+UNLIMITED_METHODS = {"getMe", "getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo", "answerCallbackQuery"}
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> dict:
+    """Update de un mensaje de texto en un chat privado"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+               if text.startswith("/") else {}),
+        },
+    }
+
+
+def make_callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> dict:
+    """Update de la pulsación de un botón inline"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
+
+
+@dataclass
+class ApiCall:
+    method: str
+    params: dict[str, Any]
+    at: float = field(default_factory=time.perf_counter)
+
+
+class FloodError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too Many Requests: retry after {retry_after}")
+        self.retry_after = retry_after
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api: "FakeBotAPI") -> None:
+        self.api = api
+
+    async def post(self, token: str, method: str) -> None:
+        params = {}
+        if self.request.headers.get("Content-Type", "").startswith("application/json") and self.request.body:
+            params = json.loads(self.request.body)
+        else:
+            for name, values in self.request.body_arguments.items():
+                value = values[-1].decode("utf-8")
+                try:
+                    params[name] = json.loads(value)
+                except ValueError:
+                    params[name] = value
+        self.set_header("Content-Type", "application/json")
+        try:
+            result = await self.api.handle(method, params)
+        except FloodError as e:
+            self.set_status(429)
+            self.write(json.dumps({"ok": False, "error_code": 429, "description": str(e),
+                                   "parameters": {"retry_after": e.retry_after}}))
+            return
+        self.write(json.dumps({"ok": True, "result": result}))
+
+    get = post
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, rtt: float = 0.0,
+                 max_per_second: Optional[int] = None, max_per_chat_per_second: Optional[int] = None,
+                 record_calls: bool = True):
+        self.host = host
+        self.port = port
+        self.rtt = rtt
+        self.max_per_second = max_per_second
+        self.max_per_chat_per_second = max_per_chat_per_second
+        self.flood_errors = 0
+        self._sent: deque[float] = deque()
+        self._sent_by_chat: dict[Any, deque[float]] = defaultdict(deque)
+        self.record_calls = record_calls
+        self.calls: list[ApiCall] = []
+        self._messages_by_chat: dict[Any, int] = defaultdict(int)
+        self._message_waiters: dict[Any, list[tuple[int, asyncio.Future]]] = defaultdict(list)
+        self.webhook_url: Optional[str] = None
+        self._updates: Optional[asyncio.Queue] = None
+        self._new_call: Optional[asyncio.Condition] = None
+        self._message_ids = itertools.count(1000)
+        self._polling = 0 # getUpdates esperando ahora mismo
+        self._held: Optional[asyncio.Event] = None # con hold_responses, las respuestas esperan a release_responses
+        self.in_flight = 0                           # peticiones que todavía no han contestado
+        self._idle: Optional[asyncio.Event] = None   # puesto cuando in_flight es 0
+        self._server: Optional[tornado.httpserver.HTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        """Para ApplicationBuilder().base_url(...), python-telegram-bot añade el token detrás"""
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._updates = asyncio.Queue()
+        self._new_call = asyncio.Condition()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _MethodHandler, {"api": self})])
+        self._server = tornado.httpserver.HTTPServer(app)
+        sockets = tornado.netutil.bind_sockets(self.port, self.host)
+        self.port = sockets[0].getsockname()[1]
+        self._server.add_sockets(sockets)
+
+    async def stop_polling(self) -> None:
+        """Despierta a los getUpdates que sigan esperando, que vuelven sin updates"""
+        for _ in range(self._polling):
+            self._updates.put_nowait(None)
+        await asyncio.sleep(0.01)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """
+        Para el servidor sin dejar peticiones a medias: se despierta a los getUpdates que sigan esperando,
+        se sueltan las respuestas retenidas y se espera a que todas contesten (como mucho timeout segundos)
+        antes de cerrar las conexiones. Si no, al cerrar el bucle de eventos asyncio cancelaría las tareas de
+        tornado que aún duermen el rtt y cada una dejaría un CancelledError en el log.
+        """
+        if self._server is None:
+            return
+        self._server.stop() # no acepta conexiones nuevas
+        self.release_responses()
+        await self.stop_polling()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Se cierra el Bot API de mentira con %d peticiones sin contestar", self.in_flight)
+        await self._server.close_all_connections()
+        self._server = None
+
+    def push_update(self, update: dict) -> None:
+        """Deja un update para el siguiente getUpdates"""
+        self._updates.put_nowait(update)
+
+    def hold_responses(self) -> None:
+        """
+        Las llamadas se siguen recibiendo (y apuntando en calls) pero nadie recibe respuesta hasta
+        release_responses: sirve para comprobar qué peticiones salen a la vez sin medir tiempos
+        """
+        self._held = asyncio.Event()
+
+    def release_responses(self) -> None:
+        if self._held is not None:
+            self._held.set()
+            self._held = None
+
+    def count(self, method: str) -> int:
+        return sum(1 for call in self.calls if call.method == method)
+
+    async def wait_for_calls(self, method: str, n: int, timeout: float = 5.0) -> list[ApiCall]:
+        """Espera a que se hayan hecho n llamadas a method y las devuelve"""
+        async with self._new_call:
+            await asyncio.wait_for(self._new_call.wait_for(lambda: self.count(method) >= n), timeout)
+        return [call for call in self.calls if call.method == method]
+
+    def messages_to(self, chat_id: Any) -> int:
+        """Mensajes mandados o editados en el chat hasta ahora"""
+        return self._messages_by_chat.get(chat_id, 0)
+
+    async def wait_for_messages(self, chat_id: Any, n: int, timeout: float = 5.0) -> None:
+        """Espera a que el bot haya mandado o editado n mensajes en el chat (contando desde el principio)"""
+        if self.messages_to(chat_id) >= n:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._message_waiters[chat_id].append((n, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self._message_waiters.get(chat_id)
+            if waiters is not None:
+                waiters[:] = [w for w in waiters if w[1] is not future]
+                if not waiters:
+                    del self._message_waiters[chat_id]
+
+    def _message_sent(self, chat_id: Any) -> None:
+        self._messages_by_chat[chat_id] += 1
+        count = self._messages_by_chat[chat_id]
+        for n, future in self._message_waiters.get(chat_id, ()):
+            if n <= count and not future.done():
+                future.set_result(None)
+
+    async def handle(self, method: str, params: dict) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            return await self._handle(method, params)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    async def _handle(self, method: str, params: dict) -> Any:
+        if self.rtt:
+            await asyncio.sleep(self.rtt / 2) # la petición viaja hasta Telegram
+        if method not in UNLIMITED_METHODS:
+            self._check_flood(params.get("chat_id"))
+        result = await self._dispatch(method, params)
+        if self._held is not None and method != "getUpdates":
+            await self._held.wait()
+        if self.rtt:
+            await asyncio.sleep(self.rtt / 2) # y la respuesta vuelve
+        return result
+
+    def _check_flood(self, chat_id: Any) -> None:
+        now = time.monotonic()
+        windows = [(self._sent, self.max_per_second)]
+        if chat_id is not None:
+            windows.append((self._sent_by_chat[chat_id], self.max_per_chat_per_second))
+        for sent, limit in windows:
+            while sent and now - sent[0] >= 1:
+                sent.popleft()
+            if limit is not None and len(sent) >= limit:
+                self.flood_errors += 1
+                raise FloodError(retry_after=1)
+        for sent, _ in windows:
+            sent.append(now)
+
+    async def _dispatch(self, method: str, params: dict) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+
+        if self.record_calls:
+            async with self._new_call:
+                self.calls.append(ApiCall(method, params))
+                self._new_call.notify_all()
+
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            self._message_sent(params.get("chat_id"))
+            return {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        timeout = float(params.get("timeout") or 0)
+        self._polling += 1
+        try:
+            first = await asyncio.wait_for(self._updates.get(), timeout) if timeout else self._updates.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        finally:
+            self._polling -= 1
+        if first is None:
+            return []
+        updates = [first]
+        while not self._updates.empty():
+            updates.append(self._updates.get_nowait())
+        return [update for update in updates if update is not None]
+
+
+class WebhookSender:
+    """
+    Hace de Telegram en modo webhook: manda updates sintéticos por POST al servidor del bot, con la
+    cabecera del secret token si se le pasa.
+    """
+
+    def __init__(self, url: str, secret_token: Optional[str] = None, rtt: float = 0.0):
+        self.url = url
+        self.secret_token = secret_token
+        self.rtt = rtt
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "WebhookSender":
+        self._client = httpx.AsyncClient()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._client.aclose()
+        self._client = None
+
+    async def send(self, update: dict) -> int:
+        """Manda el update y devuelve el código HTTP de la respuesta"""
+        if self.rtt:
+            await asyncio.sleep(self.rtt / 2)
+        headers = {SECRET_HEADER: self.secret_token} if self.secret_token else {}
+        response = await self._client.post(self.url, json=update, headers=headers)
+        return response.status_code
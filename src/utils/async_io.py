@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from src.settings import IO_THREAD_POOL_SIZE, SLOW_CALLBACK_THRESHOLD
+from src.utils.instrumentation import add_storage_time
+from src.utils.tracing import tracer
+
+logger = logging.getLogger("expense_bot.utils.async_io")
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Pool de hilos para el I/O bloqueante (disco, SQLite...). Se crea la primera vez que se usa."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="expense-io")
+    return _executor
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Ejecuta func en el pool de I/O y espera el resultado sin bloquear el bucle de eventos, así un disco
+    lento solo retrasa al usuario que lo está esperando y no los botones de los demás. Como
+    asyncio.to_thread, se lleva el contexto (contextvars) al hilo.
+
+    El tiempo que se espera cuenta como tiempo de almacenamiento del handler en curso (/stats) y queda
+    como un span de almacenamiento en su traza.
+    """
+    loop = asyncio.get_running_loop()
+    span, token = tracer.begin(getattr(func, "__qualname__", repr(func)), "storage")
+    ctx = contextvars.copy_context()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(get_io_executor(), functools.partial(ctx.run, func, *args, **kwargs))
+    finally:
+        add_storage_time(time.perf_counter() - started)
+        tracer.end(span, token)
+
+
+def install_io_executor(loop: asyncio.AbstractEventLoop) -> None:
+    """Usa el pool de I/O también como executor por defecto (asyncio.to_thread, run_in_executor(None, ...))"""
+    loop.set_default_executor(get_io_executor())
+
+
+def shutdown_io_executor(wait: bool = True) -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def enable_loop_debug(loop: asyncio.AbstractEventLoop, threshold: float = SLOW_CALLBACK_THRESHOLD) -> None:
+    """
+    Modo depuración del bucle de eventos: asyncio avisa (logger 'asyncio', nivel WARNING) de cualquier paso
+    de una tarea que tenga el bucle parado más de threshold segundos. En el aviso sale la corrutina y la
+    línea en la que se quedó, que es la siguiente al código que bloqueaba dentro del handler.
+
+    Hace el bucle más lento, es para buscar handlers que bloquean, no para producción.
+    """
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logger.warning("Depuración del bucle activada: se avisará de bloqueos de más de %.3f s", threshold)
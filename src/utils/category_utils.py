@@ -1,19 +1,255 @@
+import asyncio
+import logging
+import os
 import sys
 import json
+import tempfile
+import threading
+import time
 
 from pathlib import Path 
-from typing import List
+from typing import Any, List, Optional
 
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 from src.settings import BASE_DIR, DATA_PATH
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from src.utils.async_io import run_io
+
+logger = logging.getLogger("expense_bot.utils.category_utils")
+
 CATS_PATH = DATA_PATH / "categories.json"
 
+
+def chunk_list(lst: List, n: int) -> List[List]:
+    """Divide una lista en sublistas de longitud n."""
+    return [lst[i:i + n] for i in range(0, len(lst), n)]
+
+
+class CategoryStore:
+    """
+    Guarda en memoria las categorías del JSON (CATS_PATH) y los InlineKeyboardMarkup ya construidos para
+    cada tipo ('gasto', 'ingreso', 'quien'), así los pasos de la conversación no tocan el disco ni
+    vuelven a crear los botones cada vez. También un set por tipo para saber en O(1) si el callback_data
+    de un botón es una categoría (ver matcher).
+
+    La caché se invalida al añadir una categoría con add o cuando cambia el mtime del fichero (por si se
+    edita a mano). Para no hacer un stat en cada mensaje el mtime se mira como mucho cada check_interval
+    segundos. En el bot ni eso: start_watching (post_init) lo mira desde el pool de I/O (refresh) y las
+    consultas (get, markup, contains, también el CategoryMatcher de cada callback) solo leen la memoria,
+    sin tocar el disco en el bucle de eventos.
+
+    Los datos y las cachés que salen de ellos (teclados y sets) se leen y se rellenan siempre con self._lock:
+    si no, una recarga a la vez podría dejar en la caché un teclado o un set de las categorías de antes.
+    El JSON se escribe en un fichero temporal y se cambia con os.replace, nunca queda a medio escribir.
+    """
+
+    def __init__(self, path: Path = CATS_PATH, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._data: Optional[dict] = None
+        self._mtime: Optional[int] = None
+        self._last_check = 0.0
+        self._markups: dict[str, InlineKeyboardMarkup] = {}
+        self._sets: dict[tuple[str, ...], frozenset[str]] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+
+    @property
+    def watching(self) -> bool:
+        return self._watch_task is not None and not self._watch_task.done()
+
+    def _write(self, data: dict) -> None:
+        """Escribe el JSON de forma atómica (temporal + os.replace). Con self._lock cogido"""
+        self.path.parent.mkdir(parents=True, exist_ok=True) # Crea el directorio si no estuviera creado, si no no hace nada
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".categories-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _set_data(self, data: dict, mtime: Optional[int]) -> None:
+        self._data = data
+        self._mtime = mtime
+        self._markups = {}
+        self._sets = {}
+
+    def _read(self) -> None:
+        if not self.path.exists():
+            # Si no existe crea una lista vacía
+            categorias_por_defecto = {
+                "gasto": [],
+                "ingreso": [],
+                "quien":[]
+            }
+            self._write(categorias_por_defecto)
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._set_data(data, self.path.stat().st_mtime_ns)
+
+    def _current_mtime(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _ensure_loaded(self, force_check: bool = False) -> dict:
+        """Los datos al día (leyendo el fichero si hace falta). Con self._lock cogido"""
+        now = time.monotonic()
+        if self._data is None:
+            self._read()
+            self._last_check = now
+        elif force_check or (not self.watching and now - self._last_check >= self.check_interval):
+            self._last_check = now
+            if self._current_mtime() != self._mtime:
+                try:
+                    self._read()
+                except ValueError:
+                    logger.warning("No se ha podido releer %s, se siguen usando las categorías anteriores",
+                                   self.path)
+        return self._data
+
+    def refresh(self) -> None:
+        """
+        Relee el JSON si ha cambiado su mtime. Lo llama la tarea de start_watching desde el pool de I/O: el
+        fichero se lee sin el lock y solo se cambian los datos con él, si nadie los ha cambiado mientras.
+        """
+        with self._lock:
+            if self._data is None:
+                self._ensure_loaded()
+                return
+            known = self._mtime
+        mtime = self._current_mtime()
+        if mtime == known:
+            return
+        if mtime is None:
+            with self._lock:
+                self._set_data(None, None) # lo han borrado: se vuelve a crear vacío en la próxima consulta
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Editado a mano y a medio guardar: se sigue con lo de antes y se prueba en la siguiente vuelta
+            logger.warning("No se ha podido releer %s, se siguen usando las categorías anteriores", self.path)
+            return
+        with self._lock:
+            if self._mtime == known:
+                self._set_data(data, mtime)
+
+    def start_watching(self) -> None:
+        """Mira cada check_interval segundos si el JSON ha cambiado, desde el pool de I/O"""
+        if self.watching:
+            return
+        self._watch_task = asyncio.create_task(self._watch(), name="category_store_watch")
+
+    async def stop_watching(self) -> None:
+        if not self.watching:
+            return
+        self._watch_task.cancel()
+        try:
+            await self._watch_task
+        except asyncio.CancelledError:
+            pass
+        self._watch_task = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await run_io(self.refresh)
+            except Exception:
+                logger.exception("Error al releer las categorías")
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._set_data(None, None)
+
+    def get(self, ind_cat: str = 'gasto') -> list[str] | dict:
+        """Devuelve una copia de las categorías de ind_cat (o de todas con 'all')"""
+        with self._lock:
+            data = self._ensure_loaded()
+            if ind_cat == 'all':
+                return {k: list(v) for k, v in data.items()}
+            return list(data.get(ind_cat, []))
+
+    def markup(self, ind_cat: str = 'gasto') -> InlineKeyboardMarkup:
+        """Devuelve el teclado de las categorías de ind_cat, construyéndolo solo la primera vez"""
+        with self._lock:
+            data = self._ensure_loaded()
+            markup = self._markups.get(ind_cat)
+            if markup is None:
+                buttons = [
+                    InlineKeyboardButton(cat, callback_data=f"{cat}")
+                    for cat in data.get(ind_cat, [])
+                ]
+                markup = InlineKeyboardMarkup(chunk_list(buttons, 3))
+                self._markups[ind_cat] = markup
+            return markup
+
+    def contains(self, name: str, *ind_cats: str) -> bool:
+        """Si name es una categoría de alguno de ind_cats (por defecto 'gasto'), con lo que haya ahora en el JSON"""
+        ind_cats = ind_cats or ('gasto',)
+        with self._lock:
+            data = self._ensure_loaded()
+            categories = self._sets.get(ind_cats)
+            if categories is None:
+                categories = frozenset().union(*(data.get(ind_cat, []) for ind_cat in ind_cats))
+                self._sets[ind_cats] = categories
+        return name in categories
+
+    def matcher(self, *ind_cats: str) -> "CategoryMatcher":
+        """Patrón para CallbackQueryHandler que acepta las categorías de cualquiera de ind_cats"""
+        return CategoryMatcher(self, ind_cats)
+
+    def add(self, name: str, ind_cat: str = 'gasto') -> bool:
+        """Añade la categoría al JSON y vacía la caché. Devuelve False si ya existía"""
+        with self._lock:
+            # Se mira el fichero antes de escribir, para no pisar lo que se haya editado a mano
+            data = {k: list(v) for k, v in self._ensure_loaded(force_check=True).items()}
+            if name in data.setdefault(ind_cat, []):
+                return False
+
+            data[ind_cat].append(name)
+            self._write(data)
+            self._set_data(data, self._current_mtime())
+            return True
+
+
+class CategoryMatcher:
+    """
+    Se pasa como pattern de un CallbackQueryHandler en lugar de la regex "^cat1$|^cat2$|..." con las
+    categorías del arranque: se pregunta al CategoryStore con cada callback, así una categoría nueva
+    (add_category o el JSON editado a mano) tiene su botón enrutado sin reiniciar el bot, y los nombres
+    con caracteres especiales de regex ('Casa (alquiler)', 'I+D') funcionan.
+    """
+
+    def __init__(self, store: CategoryStore, ind_cats: tuple[str, ...]):
+        self.store = store
+        self.ind_cats = ind_cats
+
+    def __call__(self, callback_data: Any) -> bool:
+        if not isinstance(callback_data, str):
+            return False
+        return self.store.contains(callback_data, *self.ind_cats)
+
+    def __repr__(self) -> str:
+        return f"CategoryMatcher({', '.join(self.ind_cats)})"
+
+
+category_store = CategoryStore()
+
+
 def load_categories(ind_cat: str = 'gasto') -> list[str]:
     """
-    Función para cargar las categorías de los gastos o ingresos. Lee el JSON de categorías de la ruta CATS_PATH.
+    Función para cargar las categorías de los gastos o ingresos. Lee el JSON de categorías de la ruta CATS_PATH
+    (a través de la caché de category_store).
 
     Args:
         tipo (:obj:`str`): Indicador para ver si se cargan las categorías de gasto (ind_cat = 'gasto')
@@ -23,23 +259,7 @@ def load_categories(ind_cat: str = 'gasto') -> list[str]:
     Returns:
         :obj:`list[str]`: Devuelve una lista con las categorías
     """
-    CATS_PATH.parent.mkdir(parents=True, exist_ok=True) # Crea el directorio si no estuviera creado, si no no hace nada
-    if not CATS_PATH.exists():
-        # Si no existe crea una lista vacía
-        categorias_por_defecto = {
-            "gasto": [],
-            "ingreso": [],
-            "quien":[]
-        }
-        with open(CATS_PATH, "w", encoding="utf-8") as f:
-            json.dump(categorias_por_defecto, f, ensure_ascii=False, indent=2)
-    with open(CATS_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    
-        # Seleccionamos el tipo de categorías en función de ind_cat
-        if ind_cat == 'all':
-            return data
-        return data.get(ind_cat, [])
+    return category_store.get(ind_cat)
 
 def add_category(name: str, ind_cat: str = 'gasto') -> bool:
     """
@@ -53,31 +273,10 @@ def add_category(name: str, ind_cat: str = 'gasto') -> bool:
     Returns:
         bool: True si se añadió correctamente, False si ya existía.
     """
-
-    # Cargamos todas las categorías, ya que así es más fácil hacer el append:
-    data = load_categories(ind_cat='all')
-    if name in data[ind_cat]:
-        return False
-
-    # Añadimos la categoría:
-    data[ind_cat].append(name)
-    with open(CATS_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-    return True
-
-def chunk_list(lst: List, n: int) -> List[List]:
-    """Divide una lista en sublistas de longitud n."""
-    return [lst[i:i + n] for i in range(0, len(lst), n)]
+    return category_store.add(name, ind_cat)
 
 def load_category_markup(ind_cat: str = 'gasto') -> InlineKeyboardMarkup:
-    categories = load_categories(ind_cat)
-    buttons = [
-        InlineKeyboardButton(cat, callback_data=f"{cat}")
-        for cat in categories
-    ]
-    keyboard = chunk_list(buttons, 3)
-    return InlineKeyboardMarkup(keyboard)
+    return category_store.markup(ind_cat)
 
 
 
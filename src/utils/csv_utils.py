@@ -1,47 +1,303 @@
 import csv
-import pandas as pd
+import io
+import os
+import threading
 
-from math import isnan
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import IO, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError: # Windows: no hay bloqueos entre procesos, solo los del propio proceso
+    fcntl = None
 
 from src.settings import BASE_DIR, DATA_FILE_PATH
 from src.models.expense import Expense
 
+CSV_HEADER = ["user","fecha","importe","tipo","concepto","descripcion","quien","viaje","anualizable"]
+# Filas seguidas fuera de la ventana tras las que iter_recent_rows deja de leer hacia atrás
+RECENT_STALE_ROWS = 200
+
+
+@contextmanager
+def file_lock(f: IO, exclusive: bool = False) -> Iterator[None]:
+    """
+    Bloqueo consultivo (advisory, flock) sobre un fichero abierto, para compartir el csv con otros procesos
+    (notebooks de análisis, exportaciones del cron...). Los que escriben piden el bloqueo exclusivo y los
+    que leen el compartido: varios lectores a la vez sí, pero nunca leyendo mientras alguien escribe una fila
+    a medias. Solo protege frente a procesos que también lo pidan.
+    """
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def parse_fecha(fecha: str) -> Optional[datetime]:
+    """
+    Convierte la fecha del csv (dd/mm/YYYY, con el día primero) a datetime. Devuelve None si no se puede.
+    """
+    for formato in ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(fecha, formato)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class TripIndex:
+    """
+    Índice en memoria de los viajes del csv de gastos. Para cada usuario guarda el viaje más reciente
+    (con su fecha) y la última fecha en la que apuntó algo, así "cuál es el último viaje" es O(1) en lugar
+    de leer el csv entero en cada mensaje.
+
+    Se construye una vez al arrancar (post_init del bot) y save_expense lo va actualizando con cada fila
+    nueva. Se guarda el tamaño y el mtime del fichero tras cada lectura/escritura propia: si cambian sin
+    que hayamos sido nosotros (alguien ha editado el csv a mano, por ejemplo) se reconstruye entero.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path: Optional[Path] = None
+        self._stat: Optional[tuple[int, int]] = None       # None también si el fichero no existía o estaba vacío
+        self._dirty = False
+        self._trips: dict[str, tuple[str, datetime]] = {}   # user -> (viaje, fecha) más reciente
+        self._last_trip: Optional[tuple[str, datetime]] = None
+        self._last_seen: dict[str, datetime] = {}           # user -> última fecha apuntada
+
+    @staticmethod
+    def _file_stat(path: Path) -> Optional[tuple[int, int]]:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        if st.st_size == 0:
+            return None # un fichero vacío es igual que uno que no existe
+        return st.st_size, st.st_mtime_ns
+
+    def _add_row(self, row: list[str]) -> None:
+        if len(row) != len(CSV_HEADER):
+            return
+        user, fecha, viaje = row[0], parse_fecha(row[1]), row[7]
+        if fecha is None:
+            return
+        if user not in self._last_seen or fecha >= self._last_seen[user]:
+            self._last_seen[user] = fecha
+        if viaje:
+            if user not in self._trips or fecha >= self._trips[user][1]:
+                self._trips[user] = (viaje, fecha)
+            if self._last_trip is None or fecha >= self._last_trip[1]:
+                self._last_trip = (viaje, fecha)
+
+    def build(self, path: Path = DATA_FILE_PATH) -> None:
+        """
+        Reconstruye el índice leyendo el csv entero. Se lee en un índice nuevo solo con el bloqueo del
+        fichero y después se cambia con self._lock: el orden es siempre primero el del fichero y después
+        self._lock (save_expenses llama a add con el bloqueo exclusivo cogido), si no se podían quedar
+        esperando el uno al otro.
+        """
+        fresh = TripIndex()
+        if path.exists():
+            with open(path, "r", encoding="utf-8", newline="") as f, file_lock(f):
+                reader = csv.reader(f, delimiter=";")
+                next(reader, None) # cabecera
+                for row in reader:
+                    fresh._add_row(row)
+                fresh._stat = self._file_stat(path)
+        with self._lock:
+            self._trips, self._last_seen, self._last_trip = fresh._trips, fresh._last_seen, fresh._last_trip
+            self._path, self._dirty = path, False
+            self._stat = fresh._stat
+
+    def is_built(self, path: Path) -> bool:
+        """True si el índice se ha construido alguna vez para path (aunque ahora haya que refrescarlo)"""
+        return self._path == path
+
+    def is_fresh(self, path: Path) -> bool:
+        """True si el índice está construido para path y el fichero no ha cambiado por detrás"""
+        return self._path == path and not self._dirty and self._stat == self._file_stat(path)
+
+    def add(self, row: list[str], path: Path) -> None:
+        """Añade una fila recién escrita por nosotros y actualiza el tamaño/mtime de referencia"""
+        with self._lock:
+            self._add_row(row)
+            self._stat = self._file_stat(path)
+
+    def invalidate(self) -> None:
+        """Marca el índice para reconstruirlo en la próxima consulta"""
+        with self._lock:
+            self._dirty = True
+
+    def _ensure(self, path: Path) -> None:
+        if not self.is_fresh(path):
+            self.build(path)
+
+    def last_trip(self, path: Path = DATA_FILE_PATH, user: Optional[int] = None, n: int = 1) -> Optional[str]:
+        """Último viaje (del usuario si se pasa) dentro de los últimos n meses"""
+        self._ensure(path)
+        entry = self._last_trip if user is None else self._trips.get(str(user))
+        if entry is None or (datetime.today() - entry[1]).days >= n*30:
+            return None
+        return entry[0]
+
+    def last_seen(self, user: int, path: Path = DATA_FILE_PATH) -> Optional[datetime]:
+        """Fecha del último gasto apuntado por el usuario"""
+        self._ensure(path)
+        return self._last_seen.get(str(user))
+
+
+trip_index = TripIndex()
+
+
+def iter_lines_reversed(path: Path, block_size: int = 8192) -> Iterator[str]:
+    """
+    Lee un fichero de texto de la última línea a la primera, a bloques desde el final (seek desde EOF),
+    sin cargarlo entero en memoria. Se trabaja en bytes y se decodifica línea a línea: en utf-8 el byte
+    del salto de línea nunca forma parte de un carácter multibyte, así que cortar por b"\\n" es seguro.
+
+    Args:
+        path (Path): Fichero a leer.
+        block_size (int, optional): Bytes que se leen en cada salto hacia atrás. Defaults to 8192.
+
+    Yields:
+        str: Cada línea (sin el salto de línea), empezando por la última.
+    """
+    with open(path, "rb") as f, file_lock(f):
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size) + remainder
+            lines = block.split(b"\n")
+            # La primera línea del bloque puede estar cortada, se guarda para el siguiente bloque
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode("utf-8")
+        if remainder:
+            yield remainder.decode("utf-8")
+
+
+def iter_rows_reversed(path: Path = DATA_FILE_PATH, block_size: int = 8192) -> Iterator[list[str]]:
+    """
+    Devuelve las filas del csv de gastos de la última a la primera (sin la cabecera), parseándolas solo
+    según se van pidiendo. Si una descripción lleva saltos de línea el csv la escribe entre comillas
+    en varias líneas: mientras una línea no dé una fila completa se junta con la anterior.
+    """
+    if not path.exists():
+        return
+    pending = None
+    for line in iter_lines_reversed(path, block_size):
+        text = line if pending is None else line + "\n" + pending
+        row = next(csv.reader([text], delimiter=";"), [])
+        if len(row) == len(CSV_HEADER):
+            if row == CSV_HEADER:
+                return
+            pending = None
+            yield row
+        else:
+            pending = text
+
+
+def iter_recent_rows(path: Path = DATA_FILE_PATH, n: int = 1, block_size: int = 8192,
+                     stale_rows: int = RECENT_STALE_ROWS) -> Iterator[list[str]]:
+    """
+    Filas de los últimos n meses (de 30 días), en el orden inverso al que se escribieron. El csv se va
+    escribiendo casi en orden de fecha, pero con MODIFY_DATE se pueden apuntar gastos de fechas pasadas: una
+    fila fuera de la ventana se salta y solo se para tras stale_rows seguidas, así el coste sigue dependiendo
+    del tamaño de la ventana y no del fichero.
+    """
+    limit = datetime.today() - timedelta(days=n*30)
+    stale = 0
+    for row in iter_rows_reversed(path, block_size):
+        fecha = parse_fecha(row[1])
+        if fecha is None:
+            continue
+        if fecha <= limit:
+            stale += 1
+            if stale >= stale_rows:
+                return
+            continue
+        stale = 0
+        yield row
+
 
 def save_expense(expense: Expense, path: Path = DATA_FILE_PATH) -> None:
     """
     Función que guarda el gasto dado por el objeto expense al csv
     """
-    # Comprobamos que el path existe:
-    first = not path.exists()
+    save_expenses([expense], path)
+
+def save_expenses(expenses: list[Expense], path: Path = DATA_FILE_PATH, fsync: bool = False) -> None:
+    """
+    Guarda varios gastos de golpe: se abre el fichero una vez, se escriben todas las filas en una sola
+    escritura y, si fsync es True, se fuerza a disco antes de cerrar.
+
+    Todo se hace con el bloqueo exclusivo del fichero: la cabecera se escribe solo si el fichero está
+    vacío mirándolo ya con el bloqueo (si no, dos procesos que lo crean a la vez la escribirían dos veces)
+    y las filas se vuelcan antes de soltarlo, así nadie ve ni intercala filas a medias.
+    """
     path.parent.mkdir(parents=True, exist_ok=True) # si no existe lo creamos
-    with open(path, 'a', encoding='utf-8', newline='') as f:
-        writer = csv.writer(f, delimiter=';', lineterminator='\n')
-        print(first)
-        if first:
-            writer.writerow(["user","fecha","importe","tipo","concepto","descripcion","quien","viaje","anualizable"])
+    rows = [expense.to_csv_row() for expense in expenses]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';', lineterminator='\n')
+    writer.writerows(rows)
+
+    with open(path, 'a', encoding='utf-8', newline='') as f, file_lock(f, exclusive=True):
+        # Miramos antes de escribir si el índice sigue al día, si no lo estaba no vale con añadir las filas
+        index_fresh = trip_index.is_fresh(path)
+
+        if os.fstat(f.fileno()).st_size == 0:
+            f.write(';'.join(CSV_HEADER) + '\n')
+        f.write(buffer.getvalue())
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
 
-        writer.writerow(expense.to_csv_row())
+        if index_fresh:
+            for row in rows:
+                trip_index.add(row, path)
+        else:
+            trip_index.invalidate()
 
-def get_last_trip(path: Path = DATA_FILE_PATH, n: int = 1) -> str:
+def sync_file(path: Path = DATA_FILE_PATH) -> None:
+    """Fuerza a disco lo que se haya escrito en el csv"""
+    if path.exists():
+        with open(path, 'a', encoding='utf-8') as f:
+            os.fsync(f.fileno())
+
+def get_last_trip(path: Path = DATA_FILE_PATH, n: int = 1, user: Optional[int] = None) -> str:
     """Se trae el último viaje dentro del último mes (por defecto)
 
     Args:
         path (Path, optional): Path al csv de gastos. Defaults to DATA_FILE_PATH.
         n (int, optional): Número de meses que se trae. Defaults to 1.
+        user (int, optional): Si se pasa, el último viaje de ese usuario. Defaults to None.
 
     Returns:
         str: El nombre del último viaje
     """
-    first = not path.exists()
-    if first:
-        return None
-    df = pd.read_csv(path, sep=';')
-    if df.empty:
-        return None
-    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce', dayfirst=True)
-    df = df[(datetime.today() - df['fecha']).dt.days < n*30]
-    if df.empty or pd.isna(df['viaje'].iloc[-1]):
-        return None
-    return df['viaje'].iloc[-1]
+    # Si el índice se construyó al arrancar se usa (O(1)), si no se leen solo las filas de la ventana
+    if trip_index.is_built(path):
+        return trip_index.last_trip(path, user, n)
+
+    for row in iter_recent_rows(path, n):
+        if (user is None or row[0] == str(user)) and row[7]:
+            return row[7]
+    return None
+
+def get_last_expense(user: int, path: Path = DATA_FILE_PATH, n: int = 1) -> Optional[dict]:
+    """Último gasto apuntado por el usuario en los últimos n meses, como diccionario columna -> valor"""
+    for row in iter_recent_rows(path, n):
+        if row[0] == str(user):
+            return dict(zip(CSV_HEADER, row))
+    return None
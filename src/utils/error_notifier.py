@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Optional
+
+from telegram import InputFile, Update
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import RetryAfter
+
+from src.settings import DEVELOPER_CHAT_ID, ERROR_DIGEST_WINDOW, ERROR_NOTIFY_MAX_PER_HOUR
+from src.utils.rate_limiter import Lane
+
+logger = logging.getLogger("expense_bot.utils.error_notifier")
+
+
+def fingerprint(error: BaseException) -> str:
+    """
+    Huella de un error: el tipo y los frames del traceback (fichero, función y línea), sin el mensaje,
+    que suele llevar datos del usuario. El mismo fallo en el mismo sitio da siempre la misma huella.
+    """
+    frames = traceback.extract_tb(error.__traceback__)
+    signature = [type(error).__module__, type(error).__qualname__]
+    signature += [f"{os.path.basename(f.filename)}:{f.name}:{f.lineno}" for f in frames]
+    return hashlib.sha1("|".join(signature).encode()).hexdigest()[:10]
+
+
+def _location(error: BaseException) -> str:
+    """El frame más interno del bot (src/), o el último si el error no pasa por nuestro código"""
+    frames = traceback.extract_tb(error.__traceback__)
+    ours = [f for f in frames if f"{os.sep}src{os.sep}" in f.filename] or frames
+    if not ours:
+        return "?"
+    frame = ours[-1]
+    return f"{frame.name} ({os.path.basename(frame.filename)}:{frame.lineno})"
+
+
+class ErrorGroup:
+    """Los errores con la misma huella dentro de una ventana. Del primero se guardan los detalles."""
+
+    def __init__(self, key: str, error: BaseException, update: object, context: Any):
+        self.key = key
+        self.type = type(error).__name__
+        self.message = str(error)
+        self.location = _location(error)
+        self.count = 0
+        self.first_seen = self.last_seen = datetime.now()
+        # Solo se serializa el primero de cada huella: durante una caída el resto solo suma al contador
+        self.traceback = "".join(traceback.format_exception(None, error, error.__traceback__))
+        update_data = update.to_dict() if isinstance(update, Update) else str(update)
+        self.update = json.dumps(update_data, indent=2, ensure_ascii=False, default=str)
+        self.chat_data = str(getattr(context, "chat_data", None))
+        self.user_data = str(getattr(context, "user_data", None))
+
+    def add(self, count: int = 1) -> None:
+        self.count += count
+        self.last_seen = datetime.now()
+
+    def merge(self, other: "ErrorGroup") -> None:
+        self.count += other.count
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+
+    def summary(self) -> str:
+        return (f"• <b>{self.count}×</b> <code>{html.escape(self.type)}</code>: {html.escape(self.message[:200])}"
+                f"\n   en {html.escape(self.location)} [{self.key}]")
+
+    def details(self) -> str:
+        return (f"=== {self.count}× {self.type} [{self.key}] "
+                f"{self.first_seen:%H:%M:%S} - {self.last_seen:%H:%M:%S}\n"
+                f"{self.traceback}\nupdate = {self.update}\n"
+                f"context.chat_data = {self.chat_data}\ncontext.user_data = {self.user_data}\n")
+
+
+class ErrorNotifier:
+    """
+    Avisos de errores al chat del desarrollador sin inundarlo. El error_handler solo llama a report, que
+    agrupa el error por su huella (fingerprint) y vuelve enseguida; una tarea en segundo plano manda cada
+    window segundos un único resumen con cuántas veces ha pasado cada error y dónde.
+
+    Si el resumen con los tracebacks no cabe en un mensaje (4096 caracteres) se manda como documento, con
+    el resumen de pie. Tiene su propio límite (max_per_hour mensajes en la última hora) y respeta los
+    RetryAfter de Telegram: mientras no puede mandar, los errores se siguen acumulando para el siguiente
+    resumen. Si un envío falla (por lo que sea) se apunta en el log y no pasa por el error_handler (no se
+    realimenta); la tarea sigue y los errores se mandan en el siguiente resumen.
+    """
+
+    def __init__(self, chat_id: Optional[str] = DEVELOPER_CHAT_ID, window: float = ERROR_DIGEST_WINDOW,
+                 max_per_hour: int = ERROR_NOTIFY_MAX_PER_HOUR, max_groups: int = 50):
+        self.chat_id = chat_id
+        self.window = window
+        self.max_per_hour = max_per_hour
+        self.max_groups = max_groups
+        self.bot = None
+        self.dropped = 0 # errores de huellas que no caben en max_groups, solo se cuentan
+        self._pending: dict[str, ErrorGroup] = {}
+        self._sent: deque[float] = deque()
+        self._blocked_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return sum(group.count for group in self._pending.values()) + self.dropped
+
+    def report(self, error: BaseException, update: object = None, context: Any = None) -> None:
+        key = fingerprint(error)
+        group = self._pending.get(key)
+        if group is None:
+            if len(self._pending) >= self.max_groups:
+                self.dropped += 1
+                return
+            group = self._pending[key] = ErrorGroup(key, error, update, context)
+        group.add()
+
+    async def start(self, bot) -> None:
+        if not self.chat_id or self.running:
+            return
+        self.bot = bot
+        self._task = asyncio.create_task(self._run(), name="error_notifier")
+
+    async def stop(self) -> None:
+        """Manda lo pendiente (si el límite lo deja) y para la tarea"""
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                # Un fallo inesperado no puede parar la tarea: sin ella no llegaría ningún aviso más
+                logger.exception("Error inesperado al mandar el resumen de errores")
+
+    def _can_send(self) -> bool:
+        now = time.monotonic()
+        while self._sent and now - self._sent[0] > 3600:
+            self._sent.popleft()
+        return now >= self._blocked_until and len(self._sent) < self.max_per_hour
+
+    async def flush(self) -> bool:
+        """Manda un resumen con lo acumulado. Devuelve False si no se ha podido (se queda pendiente)."""
+        if not self._pending and not self.dropped:
+            return True
+        if self.bot is None or not self._can_send():
+            return False
+
+        groups, dropped = self._pending, self.dropped
+        self._pending, self.dropped = {}, 0
+        self._sent.append(time.monotonic())
+        try:
+            await self._send(list(groups.values()), dropped)
+            return True
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            self._blocked_until = time.monotonic() + retry_after
+            logger.warning("Telegram pide esperar %s s para avisar de los errores", retry_after)
+        except Exception:
+            logger.exception("No se ha podido mandar el resumen de errores al desarrollador")
+        # No ha llegado: no cuenta para el límite y vuelve a la cola para el siguiente resumen
+        self._sent.pop()
+        for key, group in groups.items():
+            if key in self._pending:
+                group.merge(self._pending[key])
+            self._pending[key] = group
+        self.dropped += dropped
+        return False
+
+    async def _send(self, groups: list[ErrorGroup], dropped: int) -> None:
+        groups.sort(key=lambda g: g.count, reverse=True)
+        total = sum(g.count for g in groups) + dropped
+        header = (f"⚠️ <b>{total} errores</b> ({len(groups)} distintos) entre "
+                  f"{min(g.first_seen for g in groups):%H:%M:%S} y {max(g.last_seen for g in groups):%H:%M:%S}")
+        if dropped:
+            header += f"\n+{dropped} de otros errores sin detalles"
+        summary = "\n".join([header] + [g.summary() for g in groups])
+
+        # Con el rate limiter del bot el resumen va por el carril de segundo plano, detrás de los usuarios
+        extra = {"rate_limit_args": Lane.BACKGROUND} if getattr(self.bot, "rate_limiter", None) else {}
+        last = groups[0]
+        message = f"{summary}\n\n<pre>{html.escape(last.traceback)}</pre>"
+        if len(message) <= MessageLimit.MAX_TEXT_LENGTH:
+            await self.bot.send_message(chat_id=self.chat_id, text=message, parse_mode=ParseMode.HTML, **extra)
+            return
+
+        # No cabe: los detalles de todos van en un documento y el resumen de pie (hasta donde quepa)
+        document = "\n".join(g.details() for g in groups).encode("utf-8")
+        caption = summary
+        if len(caption) > MessageLimit.CAPTION_LENGTH:
+            caption = summary[:MessageLimit.CAPTION_LENGTH - 30].rsplit("\n", 1)[0] + "\n… (más en el documento)"
+        await self.bot.send_document(
+            chat_id=self.chat_id,
+            document=InputFile(document, filename=f"errores-{datetime.now():%Y%m%d-%H%M%S}.txt"),
+            caption=caption, parse_mode=ParseMode.HTML, **extra,
+        )
+
+
+error_notifier = ErrorNotifier()
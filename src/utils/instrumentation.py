@@ -0,0 +1,176 @@
+import functools
+import time
+import types
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Optional
+
+from telegram.ext import BaseHandler, ConversationHandler
+
+from src.settings import LOOP_BLOCKING_STEP_MS
+from src.utils.metrics import Histogram, format_quantiles
+from src.utils.tracing import tracer
+
+# Tramos síncronos largos de los handlers (entre dos await, con el bucle bloqueado): (nombre, perf_counter
+# al empezar, perf_counter al terminar). El monitor del bucle los cruza con sus parones
+_blocking_steps: deque[tuple[str, float, float]] = deque(maxlen=200)
+
+
+class CallTimes:
+    """Tiempo (s) que lleva la llamada en curso esperando a Telegram y al almacenamiento"""
+    __slots__ = ("telegram", "storage")
+
+    def __init__(self):
+        self.telegram = 0.0
+        self.storage = 0.0
+
+
+class HandlerStats:
+    """Histogramas (ms) de un handler en un estado: tiempo total, en la API de Telegram y en almacenamiento"""
+    __slots__ = ("wall", "telegram", "storage")
+
+    def __init__(self):
+        self.wall = Histogram()
+        self.telegram = Histogram()
+        self.storage = Histogram()
+
+
+# (handler, estado) -> HandlerStats, lo consulta /stats
+handler_stats: dict[tuple[str, str], HandlerStats] = {}
+
+# La llamada en curso: se hereda en las tareas y los hilos (run_io) que lance el handler
+_current_call: ContextVar[Optional[CallTimes]] = ContextVar("expense_bot_current_call", default=None)
+
+
+def add_telegram_time(seconds: float) -> None:
+    """Suma tiempo de la API de Telegram al handler en curso (si lo hay)"""
+    times = _current_call.get()
+    if times is not None:
+        times.telegram += seconds
+
+
+def add_storage_time(seconds: float) -> None:
+    """Suma tiempo de almacenamiento (disco, SQLite) al handler en curso (si lo hay)"""
+    times = _current_call.get()
+    if times is not None:
+        times.storage += seconds
+
+
+def blocking_handlers(since: float, until: float) -> list[tuple[str, float]]:
+    """
+    (nombre, segundos bloqueando) de los tramos síncronos de handlers que han tenido el bucle parado
+    entre since y until (perf_counter), aunque el handler ya haya terminado
+    """
+    return [(name, end - start) for name, start, end in list(_blocking_steps) if start < until and end > since]
+
+
+@types.coroutine
+def _timed_steps(coro: Coroutine, name: str, min_seconds: float):
+    """
+    Ejecuta coro paso a paso (como un await) y mide cada paso: lo que corre entre dos await es lo que
+    tiene bloqueado el bucle. Los pasos de más de min_seconds se apuntan en _blocking_steps.
+    """
+    value, error = None, None
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                yielded = coro.send(value) if error is None else coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                ended = time.perf_counter()
+                if ended - started >= min_seconds:
+                    _blocking_steps.append((name, started, ended))
+            value, error = None, None
+            try:
+                value = yield yielded
+            except GeneratorExit:
+                raise
+            except BaseException as e: # CancelledError incluido: se le pasa a coro
+                error = e
+    finally:
+        coro.close()
+
+
+def instrument_handler(func: Callable, state: str = "-") -> Callable:
+    """
+    Envuelve un callback de un handler para:
+        - saber qué handlers han tenido el bucle bloqueado (tramos entre dos await de más de
+          LOOP_BLOCKING_STEP_MS), lo usa el monitor del bucle de eventos,
+        - medir cuánto tarda cada llamada, y de ese tiempo cuánto ha sido esperar a Telegram y cuánto al
+          almacenamiento, en los histogramas de handler_stats,
+        - abrir el span de la llamada en la traza de la conversación (tracing).
+
+    Son unos pocos perf_counter (dos por cada await), un ContextVar y tres bisect por llamada: unos pocos
+    microsegundos.
+    """
+    if getattr(func, "__instrumented__", False):
+        return func
+    name = func.__name__
+    stats = handler_stats.setdefault((name, state), HandlerStats())
+    min_blocking = LOOP_BLOCKING_STEP_MS / 1000
+
+    @functools.wraps(func)
+    async def wrapper(update: Any, context: Any, *args, **kwargs):
+        started = time.perf_counter()
+        times = CallTimes()
+        token = _current_call.set(times)
+        span, span_token = tracer.begin_handler(name, state, update, context)
+        try:
+            return await _timed_steps(func(update, context, *args, **kwargs), name, min_blocking)
+        finally:
+            elapsed = time.perf_counter() - started
+            tracer.end(span, span_token)
+            _current_call.reset(token)
+            stats.wall.observe(elapsed * 1000)
+            stats.telegram.observe(times.telegram * 1000)
+            stats.storage.observe(times.storage * 1000)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def _state_label(state: object) -> str:
+    return getattr(state, "name", None) or str(state)
+
+
+def instrument_conversation(conversation: ConversationHandler) -> ConversationHandler:
+    """
+    Instrumenta todos los callbacks de una ConversationHandler (entry_points, estados y fallbacks),
+    también los de las conversaciones anidadas. Se hace al registrar los handlers, sin tocar las
+    funciones de los módulos de conversaciones.
+    """
+    handlers = [(handler, "entry") for handler in conversation.entry_points]
+    handlers += [(handler, "fallback") for handler in conversation.fallbacks]
+    for state, state_handlers in conversation.states.items():
+        handlers += [(handler, _state_label(state)) for handler in state_handlers]
+
+    for handler, state in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_conversation(handler)
+        elif isinstance(handler, BaseHandler):
+            handler.callback = instrument_handler(handler.callback, state)
+    return conversation
+
+
+def stats_report() -> str:
+    """Resumen para /stats: p50/p95/p99 (ms) por handler y estado, y el total por estado"""
+    if not any(stats.wall.count for stats in handler_stats.values()):
+        return "📊 Todavía no hay llamadas a los handlers"
+
+    lines = ["📊 Latencia por handler, p50/p95/p99 en ms", "(total | telegram | almacenamiento)"]
+    by_state: dict[str, Histogram] = {}
+    for (name, state), stats in sorted(handler_stats.items()):
+        if not stats.wall.count:
+            continue
+        by_state.setdefault(state, Histogram()).merge(stats.wall)
+        lines.append(f"{name} [{state}] n={stats.wall.count}")
+        lines.append(f"  {format_quantiles(stats.wall)} | {format_quantiles(stats.telegram)}"
+                     f" | {format_quantiles(stats.storage)}")
+
+    lines.append("")
+    lines.append("Por estado (total)")
+    for state, histogram in sorted(by_state.items()):
+        lines.append(f"{state} n={histogram.count}: {format_quantiles(histogram)}")
+    return "\n".join(lines)
@@ -0,0 +1,86 @@
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from src.settings import LOG_SAMPLE_THRESHOLD, LOG_SAMPLE_RATE
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[tuple[logging.Logger, QueueHandler]] = None # (logger, handler) para deshacerlo
+
+
+class StepLogSampler(logging.Filter):
+    """
+    Muestreo de los INFO de los handlers cuando hay carga: dentro de cada segundo pasan los primeros
+    threshold, y de ahí en adelante solo uno de cada 1/rate. WARNING y superiores pasan siempre, igual que
+    los registros de otros loggers. Con threshold 0 no se muestrea nada.
+
+    Va en el QueueHandler, así los registros descartados no llegan ni a formatearse.
+    """
+
+    def __init__(self, threshold: int = LOG_SAMPLE_THRESHOLD, rate: float = LOG_SAMPLE_RATE,
+                 prefix: str = "expense_bot.handlers"):
+        super().__init__()
+        self.threshold = threshold
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.prefix = prefix
+        self.dropped = 0
+        self._window_start = 0.0
+        self._in_window = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.threshold or record.levelno > logging.INFO or not record.name.startswith(self.prefix):
+            return True
+        now = time.monotonic()
+        if now - self._window_start >= 1:
+            self._window_start = now
+            self._in_window = 0
+        self._in_window += 1
+        excess = self._in_window - self.threshold
+        if excess <= 0 or (self.every and excess % self.every == 0):
+            return True
+        self.dropped += 1
+        return False
+
+
+def setup_queue_logging(logger: logging.Logger = logging.getLogger("expense_bot"),
+                        sampler: Optional[logging.Filter] = None) -> QueueListener:
+    """
+    Pasa los handlers del logger (los de config/logging.conf: consola y fichero con rotación) a un
+    QueueListener con su propio hilo, y en su lugar deja un QueueHandler. Así un log desde un handler del
+    bot es meter el registro en una cola: la rotación de medianoche o un disco lento paran al hilo de
+    escritura, no al bucle de eventos. Cada handler conserva su nivel (respect_handler_level).
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(sampler if sampler is not None else StepLogSampler())
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    _queue_handler = (logger, queue_handler)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_queue_logging() -> None:
+    """
+    Escribe lo que quede en la cola, para el hilo y devuelve los handlers al logger (al apagar el bot)
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logger, queue_handler = _queue_handler
+    logger.removeHandler(queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        logger.addHandler(handler)
+    _listener = None
+    _queue_handler = None
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from src.settings import LOOP_LAG_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS
+from src.utils.instrumentation import blocking_handlers
+from src.utils.metrics import Histogram, format_ms
+
+logger = logging.getLogger("expense_bot.utils.loop_monitor")
+
+
+class Stall(NamedTuple):
+    """Un parón del bucle: cuándo, cuántos ms y qué handlers lo tenían bloqueado (nombre, ms bloqueando)"""
+    at: datetime
+    lag_ms: float
+    handlers: tuple[tuple[str, float], ...]
+
+
+class LoopLagMonitor:
+    """
+    Mide el retraso (lag) del bucle de eventos: cada interval_ms se duerme una tarea y se mira cuánto más
+    ha tardado en despertar de lo que debía. Si algo bloquea el bucle (un handler haciendo I/O síncrono,
+    un cálculo largo...) ese retraso es lo que ha estado parado el bot para todos los usuarios.
+
+    Cada medida va a un histograma y las que pasan de threshold_ms se apuntan (las últimas max_stalls)
+    con los handlers que estaban ejecutándose (no esperando en un await) mientras el bucle estaba parado,
+    y se avisa en el log. Eso lo saben los handlers instrumentados, que miden cada tramo entre dos await
+    (instrumentation.blocking_handlers); si no aparece ninguno el bloqueo ha sido de código de fuera de los
+    handlers. Se arranca en el post_init del bot y los datos se consultan con /perf.
+    """
+
+    def __init__(self, interval_ms: float = LOOP_LAG_INTERVAL_MS, threshold_ms: float = LOOP_LAG_THRESHOLD_MS,
+                 max_stalls: int = 50):
+        self.interval_ms = interval_ms
+        self.threshold_ms = threshold_ms
+        self.histogram = Histogram()
+        self.stalls: deque[Stall] = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self.started_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.started_at = datetime.now()
+        self._task = asyncio.create_task(self._run(), name="loop_lag_monitor")
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = self.interval_ms / 1000
+        while True:
+            expected = loop.time() + interval
+            since = time.perf_counter() + interval # lo mismo en el reloj de los handlers instrumentados
+            await asyncio.sleep(interval)
+            self.record(max(0.0, (loop.time() - expected) * 1000), since)
+
+    def record(self, lag_ms: float, since: Optional[float] = None) -> None:
+        """Apunta una medida; since es cuándo (perf_counter) tendría que haber despertado la tarea"""
+        self.histogram.observe(lag_ms)
+        if lag_ms < self.threshold_ms:
+            return
+        self.stall_count += 1
+        until = time.perf_counter()
+        if since is None:
+            since = until - lag_ms / 1000
+        handlers = tuple((name, blocked * 1000) for name, blocked in blocking_handlers(since, until))
+        self.stalls.append(Stall(datetime.now(), lag_ms, handlers))
+        logger.warning("Bucle de eventos parado %.0f ms, bloqueado por: %s", lag_ms,
+                       ", ".join(f"{name} ({blocked:.0f} ms)" for name, blocked in handlers)
+                       or "código fuera de los handlers")
+
+    def report(self, last: int = 5) -> str:
+        """Resumen para /perf"""
+        h = self.histogram
+        lines = [
+            f"⏱ Lag del bucle (cada {self.interval_ms:.0f} ms, desde {self.started_at:%d/%m %H:%M})"
+            if self.started_at else "⏱ Lag del bucle (monitor parado)",
+            f"muestras: {h.count}  media: {format_ms(h.mean)} ms  máx: {format_ms(h.max)} ms",
+            f"p50: {format_ms(h.quantile(0.5))}  p95: {format_ms(h.quantile(0.95))}  "
+            f"p99: {format_ms(h.quantile(0.99))} ms",
+            f"parones > {self.threshold_ms:.0f} ms: {self.stall_count}",
+        ]
+        for stall in list(self.stalls)[-last:][::-1]:
+            handlers = ", ".join(f"{name} ({blocked:.0f} ms)" for name, blocked in stall.handlers) or "fuera de los handlers"
+            lines.append(f"  {stall.at:%d/%m %H:%M:%S}  {stall.lag_ms:.0f} ms  → {handlers}")
+        return "\n".join(lines)
+
+
+loop_monitor = LoopLagMonitor()
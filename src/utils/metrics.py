@@ -0,0 +1,127 @@
+import time
+from bisect import bisect_left
+from typing import Optional, Sequence
+
+# Límites (en ms) de los cubos por defecto, el último cubo (sin límite) recoge todo lo que se pase
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """
+    Histograma de cubos fijos en memoria: observe es un bisect y una suma, no guarda las muestras, así
+    ocupa lo mismo aunque el bot lleve meses encendido. Los percentiles se estiman interpolando dentro
+    del cubo (como histogram_quantile de Prometheus).
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Percentil q (entre 0 y 1) estimado, None si no hay muestras"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / n, self.max)
+            cumulative += n
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def cumulative_counts(self) -> list[tuple[float, int]]:
+        """(límite, observaciones <= límite) de cada cubo, el último con límite infinito"""
+        result, cumulative = [], 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += n
+            result.append((bound, cumulative))
+        return result
+
+    def merge(self, other: "Histogram") -> "Histogram":
+        """Suma las observaciones de other (con los mismos cubos) a este histograma"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        return self
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Counter:
+    """Contador con etiquetas: inc("BadRequest") suma uno a la serie con esa etiqueta"""
+
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+
+class RateMeter:
+    """
+    Eventos por segundo en la última ventana de window segundos, con un hueco por segundo (no guarda
+    cada evento, mark es O(1)).
+    """
+
+    __slots__ = ("window", "_slots", "_seconds")
+
+    def __init__(self, window: int = 60):
+        self.window = window
+        self._slots = [0] * window
+        self._seconds = [0] * window
+
+    def mark(self, n: int = 1) -> None:
+        second = int(time.monotonic())
+        i = second % self.window
+        if self._seconds[i] != second:
+            self._seconds[i] = second
+            self._slots[i] = 0
+        self._slots[i] += n
+
+    def rate(self) -> float:
+        now = int(time.monotonic())
+        total = sum(n for n, second in zip(self._slots, self._seconds) if now - second < self.window)
+        return total / self.window
+
+
+# Métricas globales del bot (las exporta el endpoint de métricas)
+UPDATES_PROCESSED = Counter()   # updates procesados
+UPDATES_RATE = RateMeter()      # updates por segundo en el último minuto
+ERRORS_BY_TYPE = Counter()      # errores que llegan al error_handler, por tipo (BadRequest, TimedOut...)
+
+
+def format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def format_quantiles(histogram: Histogram) -> str:
+    """p50/p95/p99 en ms"""
+    return "/".join(format_ms(histogram.quantile(q)) for q in (0.5, 0.95, 0.99))
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Callable, Iterable, Optional
+
+from src.settings import METRICS_HOST, METRICS_PORT
+from src.models.state_manager import StateManager
+from src.utils.instrumentation import handler_stats
+from src.utils.metrics import ERRORS_BY_TYPE, UPDATES_PROCESSED, UPDATES_RATE, Histogram
+from src.utils.write_queue import expense_write_queue
+
+logger = logging.getLogger("expense_bot.utils.metrics_server")
+
+PREFIX = "expense_bot"
+
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _metric(name: str, kind: str, help_text: str, samples: Iterable[tuple[str, dict, float]]) -> list[str]:
+    lines = [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} {kind}"]
+    for suffix, labels, value in samples:
+        lines.append(f"{PREFIX}_{name}{suffix}{_labels(**labels)} {value:g}")
+    return lines
+
+
+def _histogram_samples(histogram: Histogram, labels: dict, scale: float) -> list[tuple[str, dict, float]]:
+    samples = []
+    for bound, count in histogram.cumulative_counts():
+        le = "+Inf" if bound == float("inf") else f"{bound * scale:g}"
+        samples.append(("_bucket", {**labels, "le": le}, count))
+    samples.append(("_sum", labels, histogram.sum * scale))
+    samples.append(("_count", labels, histogram.count))
+    return samples
+
+
+def conversation_stats(user_data: dict[int, dict]) -> tuple[int, int, int]:
+    """(conversaciones activas, pasos guardados en _state_history en total, pasos del historial más largo)"""
+    active, total, longest = 0, 0, 0
+    for data in list(user_data.values()):
+        history = data.get(StateManager.HISTORY_KEY)
+        if history:
+            active += 1
+            total += len(history)
+            longest = max(longest, len(history))
+    return active, total, longest
+
+
+def render_metrics(user_data: Optional[dict[int, dict]] = None) -> str:
+    """Todas las métricas del bot en el formato de texto de Prometheus"""
+    lines = []
+    lines += _metric("updates_total", "counter", "Updates procesados",
+                     [("", {}, UPDATES_PROCESSED.total())])
+    lines += _metric("updates_per_second", "gauge", "Updates procesados por segundo en el último minuto",
+                     [("", {}, UPDATES_RATE.rate())])
+
+    samples = []
+    for (handler, state), stats in sorted(handler_stats.items()):
+        if stats.wall.count:
+            samples += _histogram_samples(stats.wall, {"handler": handler, "state": state}, scale=0.001)
+    lines += _metric("handler_duration_seconds", "histogram", "Duración de cada handler", samples)
+
+    lines += _metric("write_queue_depth", "gauge", "Gastos esperando a guardarse",
+                     [("", {}, expense_write_queue.depth)])
+    lines += _metric("errors_total", "counter", "Errores que llegan al error_handler, por tipo",
+                     [("", {"type": labels[0]}, value) for labels, value in sorted(ERRORS_BY_TYPE.values.items())])
+
+    active, total, longest = conversation_stats(user_data or {})
+    lines += _metric("active_conversations", "gauge", "Usuarios con una conversación a medias",
+                     [("", {}, active)])
+    lines += _metric("state_history_entries", "gauge", "Pasos guardados en _state_history (todos los usuarios)",
+                     [("", {}, total)])
+    lines += _metric("state_history_max_entries", "gauge", "Pasos del _state_history más largo",
+                     [("", {}, longest)])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Servidor HTTP mínimo (asyncio.start_server, sin dependencias) que sirve GET /metrics en el formato de
+    Prometheus. Corre en el mismo bucle que el bot: atender un scrape es formatear unos cientos de
+    líneas en memoria, no hay I/O bloqueante. Es opcional: solo se arranca si METRICS_PORT no es 0.
+    """
+
+    def __init__(self, host: str = METRICS_HOST, port: int = METRICS_PORT,
+                 user_data: Callable[[], dict[int, dict]] = dict):
+        self.host = host
+        self.port = port
+        self.user_data = user_data
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Métricas en http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass  # cabeceras, no se usan
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render_metrics(self.user_data()).encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status, body, content_type = "404 Not Found", b"not found\n", "text/plain"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("Error sirviendo las métricas")
+        finally:
+            writer.close()
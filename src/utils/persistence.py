@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from src.settings import PERSISTENCE_PATH, PERSISTENCE_UPDATE_INTERVAL
+from src.models.expense import Expense
+from src.models.state_manager import HistoryEntry
+from src.utils.async_io import run_io
+
+logger = logging.getLogger("expense_bot.utils.persistence")
+
+TYPE_KEY = "__type__"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS callback_data (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+def to_jsonable(obj: Any) -> Any:
+    """
+    Pasa los datos del bot a algo que json sabe escribir. Los Expense y los pasos del historial se marcan
+    con TYPE_KEY para reconstruirlos al leer. Lo que no se sabe serializar se deja fuera (con un aviso en
+    el log) para no perder el resto de datos del usuario.
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, Expense):
+        return {TYPE_KEY: "Expense", "data": obj.serialize()}
+    if isinstance(obj, HistoryEntry):
+        return {TYPE_KEY: "HistoryEntry", "data": [to_jsonable(v) for v in obj]}
+    if isinstance(obj, dict):
+        result = {}
+        for k, v in obj.items():
+            try:
+                result[str(k)] = to_jsonable(v)
+            except TypeError:
+                logger.warning("No se guarda la clave %r: %s no es serializable", k, type(v).__name__)
+        return result
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v) for v in obj]
+    raise TypeError(f"{type(obj).__name__} no es serializable")
+
+
+def _object_hook(obj: dict) -> Any:
+    kind = obj.get(TYPE_KEY)
+    if kind == "Expense":
+        return Expense.deserialize(obj["data"])
+    if kind == "HistoryEntry":
+        return HistoryEntry(*obj["data"])
+    return obj
+
+
+def dumps(obj: Any) -> str:
+    return json.dumps(to_jsonable(obj), ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def loads(data: str) -> Any:
+    return json.loads(data, object_hook=_object_hook)
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Persistencia del bot (user_data y estado de las conversaciones) en un SQLite local, para que un
+    reinicio no tire los gastos a medio apuntar ni el historial de /back.
+
+    python-telegram-bot llama a update_* en cada vuelta de persistencia (cada update_interval segundos)
+    con todos los usuarios que han tenido actividad. Aquí solo se marcan como pendientes los que han
+    cambiado de verdad (se compara con lo último que se escribió) y se escriben todos juntos, en una sola
+    transacción y en un hilo, al final de la vuelta.
+
+    Los datos se guardan como json: Expense y HistoryEntry se marcan con TYPE_KEY y las claves de las
+    conversaciones (tuplas) se guardan como listas.
+    """
+
+    def __init__(self, path: Path = PERSISTENCE_PATH,
+                 store_data: Optional[PersistenceInput] = None,
+                 update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        if store_data is None:
+            store_data = PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False)
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._written: dict[tuple, str] = {}              # (tabla, clave) -> json escrito
+        self._dirty: dict[tuple, Optional[str]] = {}      # (tabla, clave) -> json pendiente (None = borrar)
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # Lectura (solo al arrancar)
+
+    def _load_table(self, table: str) -> dict[int, Any]:
+        with self._lock:
+            rows = self.conn.execute(f"SELECT id, data FROM {table}").fetchall()
+        for id_, data in rows:
+            self._written[(table, id_)] = data
+        return {id_: loads(data) for id_, data in rows}
+
+    async def get_user_data(self) -> dict[int, dict[Any, Any]]:
+        return self._load_table("user_data")
+
+    async def get_chat_data(self) -> dict[int, dict[Any, Any]]:
+        return self._load_table("chat_data")
+
+    async def get_bot_data(self) -> dict[Any, Any]:
+        return self._load_table("bot_data").get(0, {})
+
+    async def get_callback_data(self) -> Optional[tuple[list, dict[str, str]]]:
+        data = self._load_table("callback_data").get(0)
+        if data is None:
+            return None
+        buttons, mapping = data
+        return [(key, time, dict(button_data)) for key, time, button_data in buttons], mapping
+
+    async def get_conversations(self, name: str) -> dict[tuple, object]:
+        with self._lock:
+            rows = self.conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        conversations = {}
+        for key, state in rows:
+            self._written[("conversations", name, key)] = state
+            conversations[tuple(json.loads(key))] = json.loads(state)
+        return conversations
+
+    # Escritura: se marca lo que ha cambiado y se escribe todo junto al final de la vuelta
+
+    def _mark(self, key: tuple, data: Optional[str]) -> None:
+        if self._dirty.get(key, self._written.get(key)) == data:
+            return # no ha cambiado desde la última escritura
+        self._dirty[key] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon(), name="persistence_flush")
+
+    async def _flush_soon(self) -> None:
+        # PTB lanza todas las update_* de una vuelta a la vez, con esperar un ciclo se juntan en una escritura
+        await asyncio.sleep(0)
+        await self._write_dirty()
+
+    async def _write_dirty(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await run_io(self._write, dirty)
+        except Exception:
+            logger.exception("No se han podido guardar %d registros de persistencia", len(dirty))
+            # Lo que haya cambiado mientras tanto manda, el resto se reintenta en la siguiente vuelta
+            self._dirty = {**dirty, **self._dirty}
+            return
+        for key, data in dirty.items():
+            if data is None:
+                self._written.pop(key, None)
+            else:
+                self._written[key] = data
+        logger.debug("Persistencia: escritos %d registros", len(dirty))
+
+    def _write(self, dirty: dict[tuple, Optional[str]]) -> None:
+        with self._lock, self.conn:
+            for key, data in dirty.items():
+                if key[0] == "conversations":
+                    _, name, conv_key = key
+                    if data is None:
+                        self.conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, conv_key))
+                    else:
+                        self.conn.execute("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                          (name, conv_key, data))
+                else:
+                    table, id_ = key
+                    if data is None:
+                        self.conn.execute(f"DELETE FROM {table} WHERE id = ?", (id_,))
+                    else:
+                        self.conn.execute(f"INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)", (id_, data))
+
+    async def update_user_data(self, user_id: int, data: dict[Any, Any]) -> None:
+        self._mark(("user_data", user_id), dumps(data))
+
+    async def update_chat_data(self, chat_id: int, data: dict[Any, Any]) -> None:
+        self._mark(("chat_data", chat_id), dumps(data))
+
+    async def update_bot_data(self, data: dict[Any, Any]) -> None:
+        self._mark(("bot_data", 0), dumps(data))
+
+    async def update_callback_data(self, data: tuple[list, dict[str, str]]) -> None:
+        self._mark(("callback_data", 0), dumps(data))
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        conv_key = json.dumps(list(key))
+        self._mark(("conversations", name, conv_key), None if new_state is None else json.dumps(new_state))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(("user_data", user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark(("chat_data", chat_id), None)
+
+    # Los datos solo los cambia este proceso, no hay nada que refrescar
+
+    async def refresh_user_data(self, user_id: int, user_data: dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict[Any, Any]) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Se llama al apagar el bot: se escribe lo pendiente y se cierra la conexión"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_dirty()
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
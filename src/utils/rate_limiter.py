@@ -0,0 +1,204 @@
+import asyncio
+import itertools
+import logging
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from src.settings import (RATE_LIMIT_GLOBAL, RATE_LIMIT_GLOBAL_BURST, RATE_LIMIT_PER_CHAT, RATE_LIMIT_CHAT_BURST, RATE_LIMIT_GROUP_PER_MINUTE,
+                          RATE_LIMIT_MAX_RETRIES)
+
+logger = logging.getLogger("expense_bot.utils.rate_limiter")
+
+# Peticiones que no son mensajes: no gastan de los buckets (responder a un botón tiene que ser inmediato)
+UNLIMITED_ENDPOINTS = frozenset({"getMe", "answerCallbackQuery", "setWebhook", "deleteWebhook",
+                                 "getWebhookInfo", "close", "logOut"})
+
+
+class Lane(IntEnum):
+    """Carril de prioridad de un envío (rate_limit_args): cuando hay que esperar, sale antes el menor"""
+    INTERACTIVE = 0 # respuestas a lo que acaba de hacer el usuario (por defecto)
+    BACKGROUND = 1  # informes, resúmenes de errores...
+
+
+class TokenBucket:
+    """rate fichas por segundo hasta capacity. blocked_until: Telegram ha pedido esperar (RetryAfter)."""
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Segundos hasta que haya una ficha (0 si la hay ya)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class _Waiter:
+    __slots__ = ("lane", "seq", "chat_id", "future")
+
+    def __init__(self, lane: int, seq: int, chat_id: Any, future: asyncio.Future):
+        self.lane = lane
+        self.seq = seq
+        self.chat_id = chat_id
+        self.future = future
+
+
+class PriorityRateLimiter(BaseRateLimiter[Lane]):
+    """
+    Rate limiter para la Application (ApplicationBuilder().rate_limiter(...)). Cada envío gasta una ficha
+    del bucket global y otra del bucket de su chat (los grupos, chat_id negativo, tienen su propio ritmo
+    por minuto). Si hay fichas sale al momento; si no, espera en una cola que se reparte por carriles: con
+    pocas fichas salen antes las respuestas interactivas que los informes y resúmenes
+    (rate_limit_args=Lane.BACKGROUND), y un chat que ha gastado las suyas no frena a los demás.
+
+    En un segundo cualquiera un bucket deja pasar como mucho su ritmo más su ráfaga: esa suma es la que
+    tiene que quedar por debajo del límite de Telegram.
+
+    Si aun así Telegram contesta RetryAfter, se bloquea el bucket afectado (el del chat o el global) el
+    tiempo que pide y se reintenta, hasta max_retries veces; después el error llega al handler.
+    """
+
+    def __init__(self, global_rate: float = RATE_LIMIT_GLOBAL, global_burst: int = RATE_LIMIT_GLOBAL_BURST,
+                 chat_rate: float = RATE_LIMIT_PER_CHAT, chat_burst: int = RATE_LIMIT_CHAT_BURST, group_per_minute: float = RATE_LIMIT_GROUP_PER_MINUTE,
+                 max_retries: int = RATE_LIMIT_MAX_RETRIES, max_chats: int = 1000):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global: Optional[TokenBucket] = None
+        self._chats: dict[Any, TokenBucket] = {}
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self.global_rate, self.global_burst, loop.time())
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch(), name="rate_limiter")
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Los buckets llenos y sin bloqueo son como nuevos: se pueden olvidar
+                for key in [k for k, b in self._chats.items() if b.idle(now)]:
+                    del self._chats[key]
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _try_take(self, chat_id: Any, now: float) -> float:
+        """Coge las fichas si las hay (devuelve 0) o dice cuánto falta para que las haya"""
+        wait = self._global.delay(now)
+        chat = self._chat_bucket(chat_id, now) if chat_id is not None else None
+        if chat is not None:
+            wait = max(wait, chat.delay(now))
+        if wait == 0:
+            self._global.take()
+            if chat is not None:
+                chat.take()
+        return wait
+
+    async def _acquire(self, chat_id: Any, lane: int) -> None:
+        loop = asyncio.get_running_loop()
+        if not self._waiters and self._try_take(chat_id, loop.time()) == 0:
+            return
+        waiter = _Waiter(lane, next(self._seq), chat_id, loop.create_future())
+        self._waiters.append(waiter)
+        self._wakeup.set()
+        await waiter.future
+
+    async def _dispatch(self) -> None:
+        """Reparte las fichas entre los que esperan, por carril y por orden de llegada"""
+        loop = asyncio.get_running_loop()
+        while True:
+            timeout = None
+            now = loop.time()
+            self._waiters.sort(key=lambda w: (w.lane, w.seq))
+            remaining = []
+            for waiter in self._waiters:
+                if waiter.future.done(): # se ha cancelado la petición
+                    continue
+                wait = self._try_take(waiter.chat_id, now)
+                if wait == 0:
+                    waiter.future.set_result(None)
+                    continue
+                remaining.append(waiter)
+                timeout = wait if timeout is None else min(timeout, wait)
+            self._waiters = remaining
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, dict[str, Any], list[dict[str, Any]]]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Optional[Lane],
+    ) -> Union[bool, dict[str, Any], list[dict[str, Any]]]:
+        limited = endpoint not in UNLIMITED_ENDPOINTS
+        chat_id = data.get("chat_id")
+        lane = rate_limit_args if rate_limit_args is not None else Lane.INTERACTIVE
+        attempt = 0
+        while True:
+            if limited:
+                await self._acquire(chat_id, lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                retry_after = (e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds")
+                               else float(e.retry_after))
+                logger.warning("Telegram pide esperar %.0f s (%s a %s), reintento %d de %d", retry_after,
+                               endpoint, chat_id, attempt, self.max_retries)
+                if not limited:
+                    await asyncio.sleep(retry_after)
+                    continue
+                now = asyncio.get_running_loop().time()
+                bucket = self._chat_bucket(chat_id, now) if chat_id is not None else self._global
+                bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
@@ -0,0 +1,97 @@
+import logging
+import socket
+import time
+from typing import NamedTuple, Optional
+
+import httpx
+from telegram.request import HTTPXRequest
+
+from src.settings import NETWORK_PROFILES, NETWORK_PROFILE
+from src.utils.instrumentation import add_telegram_time
+
+logger = logging.getLogger("expense_bot.utils.telegram_request")
+
+
+class NetworkProfile(NamedTuple):
+    """Parámetros de red del cliente de la API de Telegram (ver NETWORK_PROFILES en settings)"""
+    pool_size: int = 256
+    updates_pool_size: int = 1
+    keepalive_connections: Optional[int] = None # None: tantas como pool_size
+    keepalive_expiry: float = 5.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 5.0
+    write_timeout: float = 5.0
+    pool_timeout: float = 1.0
+    http2: bool = False
+    tcp_nodelay: bool = True
+
+
+def get_network_profile(name: str = NETWORK_PROFILE) -> NetworkProfile:
+    if name not in NETWORK_PROFILES:
+        raise ValueError(f"Perfil de red desconocido: {name} (hay {', '.join(NETWORK_PROFILES)})")
+    return NetworkProfile(**NETWORK_PROFILES[name])
+
+
+def _request_kwargs(pool_size: int, profile: NetworkProfile) -> dict:
+    keepalive = profile.keepalive_connections if profile.keepalive_connections is not None else pool_size
+    return dict(
+        connection_pool_size=pool_size,
+        connect_timeout=profile.connect_timeout,
+        read_timeout=profile.read_timeout,
+        write_timeout=profile.write_timeout,
+        pool_timeout=profile.pool_timeout,
+        http_version="2" if profile.http2 else "1.1",
+        # Sin TCP_NODELAY, en una conexión reutilizada la petición (cabeceras y cuerpo van por separado)
+        # se queda esperando al ACK retardado del servidor: unos 40 ms por envío con keep-alive
+        socket_options=[(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)] if profile.tcp_nodelay else None,
+        # HTTPXRequest solo deja elegir el tamaño del pool: el keep-alive va en los límites de httpx
+        httpx_kwargs={"limits": httpx.Limits(max_connections=pool_size,
+                                             max_keepalive_connections=min(keepalive, pool_size),
+                                             keepalive_expiry=profile.keepalive_expiry)},
+    )
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest que apunta cuánto tarda cada llamada a la API de Telegram en el handler que la hace
+    (tiempo de telegram en /stats).
+
+    Por defecto abre hasta 256 conexiones como el HTTPXRequest que monta ApplicationBuilder (el de
+    HTTPXRequest a secas es 1): con una sola, las llamadas que se hacen a la vez (updates en paralelo,
+    answer y edit juntos en update_send_message) harían cola para usar la conexión.
+    """
+
+    def __init__(self, connection_pool_size: int = 256, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+
+    @classmethod
+    def from_profile(cls, profile: NetworkProfile, pool_size: Optional[int] = None) -> "InstrumentedRequest":
+        """
+        Request con los parámetros del perfil. Si el perfil pide HTTP/2 y no está instalado el extra
+        python-telegram-bot[http2] se avisa y se usa HTTP/1.1.
+        """
+        pool_size = pool_size if pool_size is not None else profile.pool_size
+        try:
+            return cls(**_request_kwargs(pool_size, profile))
+        except RuntimeError:
+            if not profile.http2:
+                raise
+            logger.warning("HTTP/2 no disponible (falta python-telegram-bot[http2]), se usa HTTP/1.1")
+            return cls(**_request_kwargs(pool_size, profile._replace(http2=False)))
+
+    async def do_request(self, *args, **kwargs) -> tuple[int, bytes]:
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            add_telegram_time(time.perf_counter() - started)
+
+
+def build_requests(profile: Optional[NetworkProfile] = None) -> tuple[InstrumentedRequest, InstrumentedRequest]:
+    """
+    Los dos requests de la Application (.request y .get_updates_request): uno para los envíos y otro,
+    con su propio pool, para getUpdates. Así un long polling esperando no deja a los envíos sin conexión.
+    """
+    profile = profile if profile is not None else get_network_profile()
+    return (InstrumentedRequest.from_profile(profile),
+            InstrumentedRequest.from_profile(profile, pool_size=profile.updates_pool_size))
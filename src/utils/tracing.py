@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from src.settings import TRACE_ENABLED, TRACE_PATH, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT, TRACE_FLUSH_INTERVAL
+
+logger = logging.getLogger("expense_bot.utils.tracing")
+
+# Clave de user_data con la traza de la conversación en curso
+TRACE_KEY = "_trace_id"
+
+
+# Los ids de span son un contador con un prefijo aleatorio por proceso (una traza puede seguir tras un
+# reinicio) y la hora de inicio se saca del perf_counter con el desfase medido al escribir: abrir un span
+# no cuesta ni un os.urandom ni un time.time
+_PROCESS_PREFIX = os.urandom(3).hex()
+_span_ids = itertools.count(1)
+_wall_offset = time.time() - time.perf_counter()
+
+
+def _sync_wall_clock() -> None:
+    """Vuelve a medir el desfase entre time.time y perf_counter (por si el reloj del sistema se ajusta)"""
+    global _wall_offset
+    _wall_offset = time.time() - time.perf_counter()
+
+
+def _format_id(span_id: Optional[int]) -> Optional[str]:
+    return f"{_PROCESS_PREFIX}{span_id:x}" if span_id is not None else None
+
+
+class Span:
+    """
+    Un tramo de una traza: un paso de la conversación (handler), una llamada a Telegram o un acceso al
+    almacenamiento. Los spans hijos se guardan en el del handler (root) y se escriben todos juntos cuando
+    este termina, así el trace id que ponga start() a mitad del handler les llega también a ellos.
+    """
+    __slots__ = ("name", "kind", "span_id", "parent_id", "root", "trace_id", "duration", "attrs", "children",
+                 "_started")
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"] = None, trace_id: Optional[str] = None,
+                 attrs: Optional[dict] = None):
+        self.name = name
+        self.kind = kind
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.root = parent.root if parent is not None else self
+        self.trace_id = trace_id
+        self.attrs = attrs or {}
+        self.children: list[Span] = []
+        self.duration: Optional[float] = None
+        self._started = time.perf_counter()
+
+    @property
+    def start(self) -> float:
+        """Hora de inicio (epoch)"""
+        return _wall_offset + self._started
+
+    def to_dict(self) -> dict[str, Any]:
+        start = self.start
+        return {"trace": self.root.trace_id, "span": _format_id(self.span_id), "parent": _format_id(self.parent_id),
+                "name": self.name, "kind": self.kind, "start": round(start, 6), "end": round(start + self.duration, 6),
+                **self.attrs}
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("expense_bot_current_span", default=None)
+
+
+class Tracer:
+    """
+    Trazas por conversación. Cada conversación que empieza en start() recibe un trace id (se guarda en
+    user_data, así sobrevive entre updates y a un reinicio con la persistencia), y a partir de ahí cada paso
+    de la conversación, cada llamada de StateManager.update_send_message y cada acceso al almacenamiento
+    (run_io, y el lote de la cola de escritura que guarda sus gastos) queda como un span con su inicio y su
+    fin.
+
+    Los spans se acumulan en memoria y una tarea en segundo plano los escribe cada flush_interval segundos
+    en un JSONL (una línea por span) desde el pool de I/O, rotando el fichero al llegar a max_bytes. Si la
+    tarea no está arrancada (tests, scripts) los spans se descartan. Fuera de una conversación no se traza.
+    """
+
+    def __init__(self, path: Path = TRACE_PATH, enabled: bool = TRACE_ENABLED, max_bytes: int = TRACE_MAX_BYTES,
+                 backup_count: int = TRACE_BACKUP_COUNT, flush_interval: float = TRACE_FLUSH_INTERVAL,
+                 max_buffer: int = 10000):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer: list[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- Spans ---
+
+    def start_trace(self, context: Any) -> str:
+        """Empieza una traza nueva para la conversación del usuario (la llama start())"""
+        trace_id = uuid.uuid4().hex[:16]
+        context.user_data[TRACE_KEY] = trace_id
+        span = _current_span.get()
+        if span is not None:
+            span.root.trace_id = trace_id
+        return trace_id
+
+    def begin_handler(self, name: str, state: str, update: Any,
+                      context: Any) -> tuple[Optional[Span], Optional[Token]]:
+        """
+        Abre el span de un paso de la conversación (lo usa instrument_handler). Si la tarea de escritura no
+        está en marcha el span se iba a descartar: no se abre.
+        """
+        if not self.enabled or self._task is None:
+            return None, None
+        user_data = getattr(context, "user_data", None)
+        trace_id = user_data.get(TRACE_KEY) if user_data else None
+        user = getattr(update, "effective_user", None)
+        span = Span(name, "handler", trace_id=trace_id,
+                    attrs={"state": state, "user": user.id if user is not None else None})
+        return span, _current_span.set(span)
+
+    def begin(self, name: str, kind: str, **attrs) -> tuple[Optional[Span], Optional[Token]]:
+        """Abre un span hijo del span en curso. Si no hay ninguno (fuera de un handler) no se traza."""
+        parent = _current_span.get()
+        if parent is None:
+            return None, None
+        span = Span(name, kind, parent=parent, attrs=attrs)
+        return span, _current_span.set(span)
+
+    def current(self) -> Optional[Span]:
+        """El span en curso, para colgarle trabajo que se hará después en otra tarea (begin_linked)"""
+        return _current_span.get()
+
+    def begin_linked(self, name: str, kind: str, parent: Optional[Span], **attrs) -> Optional[Span]:
+        """
+        Abre un span hijo de parent sin que pase a ser el span en curso: trabajo de otra tarea que se hace
+        por un handler (el lote de la cola de escritura que guarda su gasto). Se cierra con end(span, None).
+        """
+        if parent is None:
+            return None
+        return Span(name, kind, parent=parent, attrs=attrs)
+
+    def end(self, span: Optional[Span], token: Optional[Token]) -> None:
+        if span is None:
+            return
+        span.duration = time.perf_counter() - span._started
+        if token is not None:
+            _current_span.reset(token)
+        root = span.root
+        if span is not root and root.duration is None:
+            root.children.append(span)
+            return
+        if root.trace_id is None:
+            return
+        self._emit(span)
+        for child in span.children:
+            self._emit(child)
+        span.children = []
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attrs) -> Iterator[Optional[Span]]:
+        span, token = self.begin(name, kind, **attrs)
+        try:
+            yield span
+        finally:
+            self.end(span, token)
+
+    def _emit(self, span: Span) -> None:
+        if self._task is None:
+            return
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append(json.dumps(span.to_dict(), ensure_ascii=False) + "\n")
+
+    # --- Escritura ---
+
+    async def start(self) -> None:
+        if not self.enabled or self.running:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="tracer")
+
+    async def stop(self) -> None:
+        """Escribe lo que quede pendiente y para la tarea"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        _sync_wall_clock()
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        if self.dropped:
+            logger.warning("Se han descartado %d spans, el buffer de trazas estaba lleno", self.dropped)
+            self.dropped = 0
+        try:
+            # asyncio.to_thread usa el pool de I/O (install_io_executor) y no cuenta como almacenamiento
+            # del handler, la tarea de escritura no tiene ninguno en curso
+            await asyncio.to_thread(self._write, "".join(lines))
+        except OSError:
+            logger.exception("No se han podido escribir %d spans en %s", len(lines), self.path)
+
+    def _write(self, data: str) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.max_bytes and self.path.exists() and self.path.stat().st_size + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+
+    def _rotate(self) -> None:
+        """traces.jsonl -> traces.jsonl.1 -> traces.jsonl.2 ... como RotatingFileHandler"""
+        if self.backup_count <= 0:
+            self.path.unlink()
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{i}")
+            if source.exists():
+                source.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+
+
+tracer = Tracer()
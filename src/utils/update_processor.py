@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from src.settings import UPDATE_CONCURRENCY, UPDATE_MAX_PENDING
+from src.utils.metrics import UPDATES_PROCESSED, UPDATES_RATE
+
+logger = logging.getLogger("expense_bot.utils.update_processor")
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa los updates de usuarios distintos en paralelo, pero los de un mismo usuario de uno en uno y en
+    el orden en que llegan. Así un usuario lento (un /start que espera al disco, por ejemplo) no frena a
+    los demás, y las conversaciones de cada usuario no se pisan: su user_data y el estado de su
+    ConversationHandler solo los toca un handler a la vez.
+
+    Hay dos límites:
+        - max_pending_updates: lo que cuenta python-telegram-bot, updates en curso o esperando su turno.
+        - max_concurrent_updates: handlers ejecutándose a la vez. Se cuenta después de coger el turno del
+          usuario, así un usuario que manda muchos mensajes seguidos no ocupa los huecos de los demás.
+    """
+
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY,
+                 max_pending_updates: int = UPDATE_MAX_PENDING):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_running_updates = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._waiting: dict[Hashable, int] = {}  # updates de cada usuario en curso o en cola
+
+    @staticmethod
+    def update_key(update: object) -> Optional[Hashable]:
+        """El usuario del update (o el chat si no hay usuario). None si no es de nadie en concreto."""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    @property
+    def active_users(self) -> int:
+        """Usuarios con algún update en curso o esperando"""
+        return len(self._waiting)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        try:
+            await self._process(update, coroutine)
+        finally:
+            UPDATES_PROCESSED.inc()
+            UPDATES_RATE.mark()
+
+    async def _process(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.update_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock, self._running:
+                await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                # Nadie más espera a este usuario: se libera su lock para no acumular uno por usuario
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._waiting:
+            logger.warning("Se apaga con updates de %d usuarios sin terminar", len(self._waiting))
@@ -1,49 +1,101 @@
+import asyncio
 import json
+import os
+import tempfile
 from pathlib import Path
+from typing import Optional
 
 from src.settings import BASE_DIR, DATA_PATH, REGISTER_PWD
+from src.utils.async_io import run_io
 
+USERS_PATH = DATA_PATH / "users.json"
 
-def load_users() -> list[int]: 
+
+class UserRegistry:
     """
-    Función que carga la lista de usuaios del json de usuarios
+    Registro de usuarios en memoria. Se carga una sola vez del json de usuarios y se guarda en un set,
+    así comprobar si un usuario está registrado es una búsqueda O(1) sin tocar el disco.
+
+    Los registros nuevos pasan por un asyncio.Lock (dos /nuevo_usuario a la vez no se pisan) y el json
+    se reescribe de forma atómica: primero a un fichero temporal en el mismo directorio y luego
+    os.replace, de forma que nunca queda un users.json a medio escribir.
     """
-    users_file = DATA_PATH / "users.json"
 
-    with open(users_file, "r") as f:
-        return json.load(f)
+    def __init__(self, path: Path = USERS_PATH):
+        self.path = path
+        self._users: Optional[frozenset[int]] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def users(self) -> frozenset[int]:
+        if self._users is None:
+            self.load()
+        return self._users
+
+    def load(self) -> None:
+        """Carga (o recarga) los usuarios del json"""
+        try:
+            with open(self.path, "r") as f:
+                self._users = frozenset(json.load(f))
+        except FileNotFoundError:
+            self._users = frozenset()
+
+    def __contains__(self, user_id: int) -> bool:
+        # El set se sustituye entero al registrar (nunca se modifica), así esta lectura es segura
+        # aunque haya un registro a medias.
+        return user_id in self.users
+
+    def _persist(self, users: frozenset[int]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".users-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(sorted(users), f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def register(self, user_id: int) -> bool:
+        """
+        Registra al usuario y guarda el json. Devuelve False si ya estaba registrado.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if user_id in self.users:
+                return False
+            users = self.users | {user_id}
+            await run_io(self._persist, users)
+            self._users = users
+            return True
+
+
+user_registry = UserRegistry()
+
+
+def load_users() -> list[int]:
+    """
+    Función que carga la lista de usuaios del json de usuarios
+    """
+    return list(user_registry.users)
 
 
 def check_user(user_id: int) -> bool:
     """
-    Función que checkea si un usuario está registrado o no,
-    carga los usuarios y lo comprueba, implementación por no repetir todo el rato esta acción.
+    Función que checkea si un usuario está registrado o no. Es una consulta en memoria al user_registry,
+    el json solo se lee la primera vez.
     """
-    users = load_users()
-    if user_id in users:
-        return True 
-    else:
-        return False      
+    return user_id in user_registry
 
-def add_user(user_id: int, in_pwd: str) -> bool:
+async def add_user(user_id: int, in_pwd: str) -> bool:
     """
     Añade un nuevo usuario si la contraseña introducida coincide con la contraseña REGISTER_PWD
     """
 
-    users_file = DATA_PATH / "users.json"
-
     if in_pwd != REGISTER_PWD:
         return False
-    
-    users = load_users()
-
-    if user_id in users:
-        return False
-    
-    users.append(user_id)
-
-    with open(users_file, "w") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
-    
-    return True
 
+    return await user_registry.register(user_id)
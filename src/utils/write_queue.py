@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from src.settings import (WRITE_BATCH_SIZE, WRITE_CONFIRM_TIMEOUT, WRITE_DURABILITY, WRITE_FLUSH_INTERVAL,
+                          WRITE_SYNC_INTERVAL)
+from src.models.expense import Expense
+from src.models.expense_repository import ExpenseRepository, expense_repository
+from src.utils.async_io import run_io
+from src.utils.csv_utils import parse_fecha
+from src.utils.tracing import Span, tracer
+
+logger = logging.getLogger("expense_bot.utils.write_queue")
+
+# Un gasto en la cola: el gasto, el future de put y el span del handler que lo guardó (para su traza)
+_Item = tuple[Expense, asyncio.Future, Optional[Span]]
+
+
+class ExpenseWriteQueue:
+    """
+    Cola de escritura diferida (write-behind) de gastos. Los handlers meten el gasto en la cola y una tarea
+    en segundo plano los guarda por lotes en el repositorio. Cada lote se lleva lo que ya esté en la cola
+    (hasta batch_size gastos) y sale enseguida: con la cola vacía un gasto se escribe sin esperar a nadie.
+    Solo cuando hay atasco (más gastos esperando detrás del primero) el lote espera hasta flush_interval
+    segundos a llenarse. Cada lote es una sola escritura (y un fsync) y se hace en el pool de I/O (run_io),
+    así el bucle de eventos no se queda esperando al disco.
+
+    put devuelve un future que se completa cuando el lote del gasto se ha escrito: save lo espera para
+    no decirle al usuario que está guardado antes de tiempo. Mientras tanto los gastos siguen contando
+    para get_last_trip, que mira primero los que aún no se han escrito. La escritura de cada lote queda como
+    un span de almacenamiento en la traza de los handlers que metieron sus gastos. Si un lote falla se reintenta el
+    primero, por delante de lo que haya llegado después, así los gastos se escriben siempre en orden; al
+    parar la cola el reintento es el último, aunque el disco siga fallando.
+
+    Durabilidad (durability):
+        - 'batch': fsync en cada lote, cuando el future se completa el gasto está en disco.
+        - 'interval': fsync como mucho cada sync_interval segundos, menos latencia a cambio de poder perder
+          esos últimos segundos si se va la luz.
+
+    Se arranca en el post_init del bot y al apagarlo (post_shutdown) se vacía la cola antes de salir. Si no
+    está arrancada (tests, scripts) put guarda directamente.
+    """
+
+    def __init__(self, repository: ExpenseRepository = expense_repository, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = WRITE_FLUSH_INTERVAL, durability: str = WRITE_DURABILITY,
+                 sync_interval: float = WRITE_SYNC_INTERVAL):
+        if durability not in ('batch', 'interval'):
+            raise ValueError(f"Modo de durabilidad desconocido: {durability}")
+        self.repository = repository
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.sync_interval = sync_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry: list[_Item] = [] # lote que falló, va antes que la cola
+        self._unsaved: list[Expense] = []                       # en la cola, en un lote o por reintentar
+        self._stopping = False
+        self._pending_sync = False
+        self._last_sync = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def depth(self) -> int:
+        """Gastos esperando a escribirse"""
+        return len(self._unsaved)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="expense_write_queue")
+
+    async def stop(self) -> None:
+        """Escribe lo que quede en la cola y para la tarea"""
+        if not self.running:
+            return
+        self._stopping = True # un lote que se está reintentando no llega a leer la marca de fin
+        await self._queue.put(None) # marca de fin, lo que haya delante se escribe antes
+        await self._task
+        self._task = None
+
+    async def put(self, expense: Expense) -> asyncio.Future:
+        """Mete el gasto en la cola. El future se completa (con None) cuando está escrito"""
+        saved = asyncio.get_running_loop().create_future()
+        if not self.running:
+            await run_io(self.repository.save_many, [expense], True)
+            saved.set_result(None)
+            return saved
+        self._unsaved.append(expense)
+        await self._queue.put((expense, saved, tracer.current()))
+        return saved
+
+    async def save(self, expense: Expense, timeout: float = WRITE_CONFIRM_TIMEOUT) -> bool:
+        """
+        Mete el gasto en la cola y espera a que se escriba, como mucho timeout segundos. Devuelve False si
+        no ha dado tiempo (el gasto sigue en la cola y se reintentará) o si no se ha podido guardar.
+        """
+        saved = await self.put(expense)
+        try:
+            await asyncio.wait_for(asyncio.shield(saved), timeout)
+        except Exception: # TimeoutError o el error con el que falló el último intento al cerrar
+            return False
+        return True
+
+    async def get_last_trip(self, user: Optional[int] = None, n: int = 1) -> Optional[str]:
+        """
+        Como ExpenseRepository.get_last_trip, pero contando también los gastos que todavía no se han
+        escrito (el último viaje es casi siempre el que se acaba de apuntar)
+        """
+        limit = datetime.today() - timedelta(days=n*30)
+        for expense in reversed(self._unsaved):
+            if not expense.viaje or (user is not None and str(expense.user) != str(user)):
+                continue
+            fecha = parse_fecha(expense.fecha)
+            if fecha is not None and fecha > limit:
+                return expense.viaje
+        return await run_io(self.repository.get_last_trip, user, n)
+
+    async def _next_batch(self) -> tuple[list[_Item], bool]:
+        """
+        El siguiente lote (empezando por el que haya que reintentar) y si ha llegado la marca de fin.
+        Un lote vacío con la marca de fin es que no queda nada.
+        """
+        if self._retry:
+            batch, self._retry = self._retry, []
+            if self._stopping:
+                return batch, True
+        else:
+            timeout = self.sync_interval if self._pending_sync else None
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._sync()
+                return [], False
+            if first is None:
+                return [], True
+            batch = [first]
+
+        # Lo que ya esté esperando entra en el lote sin esperar más
+        backlog = False
+        while len(batch) < self.batch_size and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                return batch, True
+            batch.append(item)
+            backlog = True
+        if not backlog or len(batch) >= self.batch_size:
+            return batch, False
+
+        # Hay atasco: merece la pena esperar un poco a que el lote se llene
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = await self._next_batch()
+            if batch:
+                await self._flush(batch, retry=not stop)
+
+        # Lo que haya quedado por reintentar o detrás de la marca de fin se intenta guardar una última vez
+        leftover, self._retry = self._retry, []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            await self._flush(leftover, retry=False)
+
+        if self._pending_sync:
+            await self._sync()
+
+    def _forget(self, batch: list[_Item]) -> None:
+        done = {id(expense) for expense, _, _ in batch}
+        self._unsaved = [expense for expense in self._unsaved if id(expense) not in done]
+
+    async def _flush(self, batch: list[_Item], retry: bool = True) -> None:
+        sync = self.durability == 'batch' or time.monotonic() - self._last_sync >= self.sync_interval
+        # Un span por handler que espera este lote, en su traza (varios gastos del mismo handler, uno solo)
+        parents = {id(parent): parent for _, _, parent in batch if parent is not None}
+        spans = [tracer.begin_linked("ExpenseWriteQueue.flush", "storage", parent, batch=len(batch), sync=sync)
+                 for parent in parents.values()]
+        try:
+            await run_io(self.repository.save_many, [expense for expense, _, _ in batch], sync)
+        except Exception as e:
+            self._end_spans(spans, error=type(e).__name__)
+            if not retry:
+                logger.exception("No se han podido guardar %d gastos al cerrar la cola", len(batch))
+                self._forget(batch)
+                for _, saved, _ in batch:
+                    if not saved.done():
+                        saved.set_exception(e)
+                return
+            # No se pierde el lote: se reintenta el primero, antes que lo que haya llegado después
+            logger.exception("No se ha podido guardar un lote de %d gastos, se reintentará", len(batch))
+            self._retry = batch
+            await asyncio.sleep(self.flush_interval)
+            return
+        self._end_spans(spans)
+        self._forget(batch)
+        for _, saved, _ in batch:
+            if not saved.done():
+                saved.set_result(None)
+        if sync:
+            self._last_sync = time.monotonic()
+            self._pending_sync = False
+        else:
+            self._pending_sync = True
+        logger.debug("Guardado un lote de %d gastos", len(batch))
+
+    @staticmethod
+    def _end_spans(spans: list[Optional[Span]], **attrs) -> None:
+        for span in spans:
+            if span is not None:
+                span.attrs.update(attrs)
+            tracer.end(span, None)
+
+    async def _sync(self) -> None:
+        try:
+            await run_io(self.repository.sync)
+        except Exception:
+            logger.exception("Error al forzar a disco los gastos")
+            return
+        self._last_sync = time.monotonic()
+        self._pending_sync = False
+
+
+expense_write_queue = ExpenseWriteQueue()
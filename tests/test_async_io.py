@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import src.utils.async_io as async_io
+
+
+@pytest.fixture
+def small_pool(monkeypatch):
+    async_io.shutdown_io_executor()
+    monkeypatch.setattr(async_io, "IO_THREAD_POOL_SIZE", 2)
+    yield
+    async_io.shutdown_io_executor()
+
+
+@pytest.mark.asyncio
+async def test_run_io_runs_in_the_io_pool(small_pool):
+    name = await async_io.run_io(lambda: threading.current_thread().name)
+    assert name.startswith("expense-io")
+    assert await async_io.run_io(max, 3, 7, key=None) == 7
+
+
+@pytest.mark.asyncio
+async def test_pool_size_is_configurable(small_pool):
+    both_running = threading.Barrier(2, timeout=5) # si no hubiera dos hilos a la vez se rompería
+    lock = threading.Lock()
+    running, peak = 0, 0
+
+    def work():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        both_running.wait()
+        with lock:
+            running -= 1
+
+    await asyncio.gather(*(async_io.run_io(work) for _ in range(4)))
+    assert peak == 2 # 4 tareas en 2 hilos: dos tandas
+
+
+@pytest.mark.asyncio
+async def test_slow_disk_does_not_delay_other_users(small_pool):
+    disk = threading.Event()
+
+    async def slow_user():
+        await async_io.run_io(disk.wait, 5) # p. ej. un get_last_trip con el disco lento
+
+    async def button_press():
+        await asyncio.sleep(0)
+        return "ok"
+
+    slow = asyncio.create_task(slow_user())
+    await asyncio.sleep(0)
+    # El otro usuario termina mientras el disco sigue sin contestar
+    assert await button_press() == "ok"
+    assert not slow.done()
+    disk.set()
+    await slow
+
+
+@pytest.mark.asyncio
+async def test_loop_debug_reports_blocking_handler(caplog):
+    loop = asyncio.get_running_loop()
+    debug, threshold = loop.get_debug(), loop.slow_callback_duration
+    async_io.enable_loop_debug(loop, threshold=0.05)
+
+    async def blocking_handler():
+        time.sleep(0.1)
+
+    try:
+        with caplog.at_level(logging.WARNING, logger="asyncio"):
+            await asyncio.create_task(blocking_handler())
+            await asyncio.sleep(0)
+    finally:
+        loop.set_debug(debug)
+        loop.slow_callback_duration = threshold
+
+    assert any("blocking_handler" in r.getMessage() and "took" in r.getMessage() for r in caplog.records)
@@ -47,6 +47,20 @@ def test_main_invokes_builder_and_run(monkeypatch):
         def token(self, token):
             self._token = token
             return self
+        def request(self, request):
+            return self
+        def get_updates_request(self, request):
+            return self
+        def rate_limiter(self, rate_limiter):
+            return self
+        def persistence(self, persistence):
+            return self
+        def concurrent_updates(self, processor):
+            return self
+        def post_init(self, callback):
+            return self
+        def post_shutdown(self, callback):
+            return self
         def build(self):
             return dummy_app
     monkeypatch.setattr(bot, 'ApplicationBuilder', DummyBuilder)
@@ -65,3 +79,49 @@ def test_main_invokes_builder_and_run(monkeypatch):
     assert called.get('app') is dummy_app
     # Ensure run_polling was called with drop_pending_updates=True
     dummy_app.run_polling.assert_called_once_with(drop_pending_updates=True)
+
+
+def test_parse_args_defaults_to_settings():
+    args = bot.parse_args([])
+    assert args.mode == bot.BOT_MODE
+    assert args.max_connections == bot.WEBHOOK_MAX_CONNECTIONS
+
+
+def test_run_webhook_mode():
+    app = MagicMock()
+    args = bot.parse_args(["--mode", "webhook", "--listen", "0.0.0.0", "--port", "8080",
+                           "--webhook-url", "https://bot.example.com/", "--secret-token", "s3cret",
+                           "--max-connections", "10"])
+    bot.run(app, args)
+    app.run_polling.assert_not_called()
+    app.run_webhook.assert_called_once_with(
+        listen="0.0.0.0",
+        port=8080,
+        url_path=bot.WEBHOOK_PATH,
+        webhook_url=f"https://bot.example.com/{bot.WEBHOOK_PATH}",
+        secret_token="s3cret",
+        max_connections=10,
+    )
+
+
+def test_run_polling_mode():
+    app = MagicMock()
+    bot.run(app, bot.parse_args(["--mode", "polling"]))
+    app.run_polling.assert_called_once_with(drop_pending_updates=True)
+    app.run_webhook.assert_not_called()
+
+
+def test_webhook_mode_requires_url(monkeypatch, capsys):
+    monkeypatch.setattr(bot, "WEBHOOK_URL", None)
+    with pytest.raises(SystemExit):
+        bot.parse_args(["--mode", "webhook"])
+    assert "--webhook-url" in capsys.readouterr().err
+
+
+def test_run_webhook_without_url_fails_before_starting():
+    app = MagicMock()
+    args = bot.parse_args(["--mode", "polling"])
+    args.mode, args.webhook_url = "webhook", None
+    with pytest.raises(ValueError, match="webhook-url"):
+        bot.run(app, args)
+    app.run_webhook.assert_not_called()
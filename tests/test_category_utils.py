@@ -0,0 +1,172 @@
+import json
+import os
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.utils.category_utils import CategoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "categories.json"
+    path.write_text(json.dumps({"gasto": ["Comida", "Viajes"], "ingreso": ["Nómina"], "quien": []}), encoding="utf-8")
+    return CategoryStore(path, check_interval=0)
+
+
+def test_creates_default_file(tmp_path):
+    store = CategoryStore(tmp_path / "sub" / "categories.json")
+    assert store.get('all') == {"gasto": [], "ingreso": [], "quien": []}
+
+
+def test_reads_once(store, monkeypatch):
+    assert store.get('gasto') == ["Comida", "Viajes"]
+    monkeypatch.setattr(store, '_read', lambda: pytest.fail("no debería volver a leer"))
+    assert store.get('ingreso') == ["Nómina"]
+
+
+def test_returns_copies(store):
+    store.get('gasto').append("Basura")
+    assert store.get('gasto') == ["Comida", "Viajes"]
+
+
+def test_markup_is_cached(store):
+    markup = store.markup('gasto')
+    assert markup is store.markup('gasto')
+    assert [b.callback_data for b in markup.inline_keyboard[0]] == ["Comida", "Viajes"]
+
+
+def test_add_invalidates(store):
+    markup = store.markup('gasto')
+    assert store.add("Ocio", 'gasto')
+    assert not store.add("Ocio", 'gasto')
+    assert store.get('gasto') == ["Comida", "Viajes", "Ocio"]
+    assert store.markup('gasto') is not markup
+
+
+def test_reloads_on_mtime_change(store):
+    store.get('gasto')
+    store.path.write_text(json.dumps({"gasto": ["Casa"], "ingreso": [], "quien": []}), encoding="utf-8")
+    os.utime(store.path, ns=(0, 0))
+    assert store.get('gasto') == ["Casa"]
+
+
+def test_contains_with_regex_metacharacters(store):
+    store.add("Casa (alquiler)", 'gasto')
+    store.add("I+D", 'gasto')
+    assert store.contains("Casa (alquiler)", 'gasto')
+    assert store.contains("I+D", 'gasto')
+    assert not store.contains("IID", 'gasto')
+    assert not store.contains("Casa", 'gasto')
+
+
+def test_contains_several_kinds(store):
+    assert store.contains("Nómina", 'gasto', 'ingreso')
+    assert not store.contains("Nómina", 'gasto')
+    assert store.contains("Comida")
+
+
+def test_matcher_sees_new_categories(store):
+    matcher = store.matcher('gasto', 'ingreso')
+    assert matcher("Comida")
+    assert not matcher("Ocio")
+    store.add("Ocio", 'gasto')
+    assert matcher("Ocio")
+
+    store.path.write_text(json.dumps({"gasto": ["Casa"], "ingreso": [], "quien": []}), encoding="utf-8")
+    os.utime(store.path, ns=(0, 0))
+    assert matcher("Casa")
+    assert not matcher("Comida")
+
+
+def test_matcher_ignores_non_str_callback_data(store):
+    assert not store.matcher('gasto')(None)
+    assert not store.matcher('gasto')(("Comida",))
+
+
+def test_add_replaces_the_file_atomically(store):
+    store.get('gasto')
+    inode = store.path.stat().st_ino
+    assert store.add("Ocio", 'gasto')
+    assert store.path.stat().st_ino != inode # se ha cambiado el fichero entero, no se ha escrito encima
+    assert json.loads(store.path.read_text(encoding="utf-8"))["gasto"] == ["Comida", "Viajes", "Ocio"]
+    assert [p.name for p in store.path.parent.iterdir()] == ["categories.json"]
+
+
+def test_add_keeps_manual_edits(tmp_path):
+    store = CategoryStore(tmp_path / "categories.json", check_interval=3600)
+    store.get('gasto')
+    store.path.write_text(json.dumps({"gasto": ["Casa"], "ingreso": [], "quien": []}), encoding="utf-8")
+    os.utime(store.path, ns=(0, 0))
+    assert store.add("Ocio", 'gasto')
+    assert store.get('gasto') == ["Casa", "Ocio"]
+
+
+def test_markup_is_not_cached_stale_after_concurrent_reload(store, monkeypatch):
+    import threading
+    from src.utils import category_utils
+
+    def reload():
+        store.path.write_text(json.dumps({"gasto": ["Casa"], "ingreso": [], "quien": []}), encoding="utf-8")
+        os.utime(store.path, ns=(0, 0))
+        store.get('gasto')
+
+    reloader = threading.Thread(target=reload)
+    real_chunk_list = category_utils.chunk_list
+
+    def chunk_list(buttons, n):
+        # Otro hilo recarga el JSON (editado a mano) mientras se construye el teclado de las de antes
+        reloader.start()
+        reloader.join(0.2)
+        return real_chunk_list(buttons, n)
+
+    monkeypatch.setattr(category_utils, "chunk_list", chunk_list)
+    store.markup('gasto')
+    reloader.join(5)
+    monkeypatch.setattr(category_utils, "chunk_list", real_chunk_list)
+    assert [b.callback_data for row in store.markup('gasto').inline_keyboard for b in row] == ["Casa"]
+
+
+@pytest.mark.asyncio
+async def test_watching_store_does_not_touch_disk_on_lookups(store, monkeypatch):
+    import asyncio
+    store.get('gasto')
+    store.check_interval = 3600
+    store.start_watching()
+    try:
+        monkeypatch.setattr(store, '_current_mtime', lambda: pytest.fail("stat en el bucle de eventos"))
+        monkeypatch.setattr(store, '_read', lambda: pytest.fail("lectura en el bucle de eventos"))
+        assert store.matcher('gasto')("Comida")
+        assert store.markup('gasto') is store.markup('gasto')
+        assert store.get('ingreso') == ["Nómina"]
+    finally:
+        await store.stop_watching()
+
+
+@pytest.mark.asyncio
+async def test_watch_reloads_manual_edits(store):
+    import asyncio
+    store.get('gasto')
+    store.check_interval = 0.01
+    store.start_watching()
+    try:
+        store.path.write_text(json.dumps({"gasto": ["Casa"], "ingreso": [], "quien": []}), encoding="utf-8")
+        os.utime(store.path, ns=(0, 0))
+        for _ in range(500):
+            if store.contains("Casa", 'gasto'):
+                break
+            await asyncio.sleep(0.01)
+        assert store.contains("Casa", 'gasto')
+        assert not store.contains("Comida", 'gasto')
+    finally:
+        await store.stop_watching()
+
+
+def test_refresh_keeps_data_on_half_written_file(store):
+    store.get('gasto')
+    store.path.write_text('{"gasto": ["Ca', encoding="utf-8")
+    os.utime(store.path, ns=(0, 0))
+    store.refresh()
+    assert store.contains("Comida", 'gasto')
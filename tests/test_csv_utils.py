@@ -0,0 +1,168 @@
+import os
+import pytest
+from datetime import datetime, timedelta
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.models.expense import Expense
+from src.utils import csv_utils
+from src.utils.csv_utils import (
+    TripIndex,
+    save_expense,
+    get_last_trip,
+    get_last_expense,
+    iter_lines_reversed,
+    iter_rows_reversed,
+    iter_recent_rows,
+)
+
+
+def make_expense(user, viaje='', days_ago=0):
+    expense = Expense(user)
+    expense._fecha = (datetime.today() - timedelta(days=days_ago)).strftime('%d/%m/%Y')
+    expense.importe = "10"
+    expense.tipo = 'gasto'
+    expense.categoria = 'Viajes' if viaje else 'Comida'
+    expense.viaje = viaje
+    return expense
+
+
+@pytest.fixture
+def csv_path(tmp_path, monkeypatch):
+    # Índice limpio en cada test
+    monkeypatch.setattr(csv_utils, 'trip_index', TripIndex())
+    return tmp_path / "gastos.csv"
+
+
+def test_save_writes_header_once(csv_path):
+    save_expense(make_expense(1), csv_path)
+    save_expense(make_expense(1), csv_path)
+    lines = csv_path.read_text(encoding='utf-8').splitlines()
+    assert lines[0] == ";".join(csv_utils.CSV_HEADER)
+    assert len(lines) == 3
+
+
+def test_last_trip_per_user(csv_path):
+    save_expense(make_expense(1, viaje='Roma', days_ago=3), csv_path)
+    save_expense(make_expense(2, viaje='Oslo', days_ago=1), csv_path)
+    save_expense(make_expense(1), csv_path)
+    assert get_last_trip(csv_path, user=1) == 'Roma'
+    assert get_last_trip(csv_path, user=2) == 'Oslo'
+    assert get_last_trip(csv_path) == 'Oslo'
+    assert get_last_trip(csv_path, user=3) is None
+
+
+def test_last_trip_window(csv_path):
+    save_expense(make_expense(1, viaje='Roma', days_ago=40), csv_path)
+    assert get_last_trip(csv_path, user=1) is None
+    assert get_last_trip(csv_path, n=2, user=1) == 'Roma'
+
+
+def test_index_updated_incrementally(csv_path, monkeypatch):
+    csv_utils.trip_index.build(csv_path)
+    save_expense(make_expense(1, viaje='Roma'), csv_path)
+    assert csv_utils.trip_index.is_fresh(csv_path)
+    # Si el índice está al día no se vuelve a leer el fichero
+    monkeypatch.setattr(csv_utils.trip_index, 'build', lambda path: pytest.fail("rebuild"))
+    assert get_last_trip(csv_path, user=1) == 'Roma'
+
+
+def test_index_rebuilt_on_external_change(csv_path):
+    save_expense(make_expense(1, viaje='Roma'), csv_path)
+    csv_utils.trip_index.build(csv_path)
+    assert get_last_trip(csv_path, user=1) == 'Roma'
+    fecha = datetime.today().strftime('%d/%m/%Y')
+    with open(csv_path, 'a', encoding='utf-8') as f:
+        f.write(f"1;{fecha};5.0;gasto;Viajes;;;Berlín;False\n")
+    os.utime(csv_path, ns=(0, 0))
+    assert get_last_trip(csv_path, user=1) == 'Berlín'
+
+
+def test_iter_lines_reversed_small_blocks(tmp_path):
+    path = tmp_path / "lineas.txt"
+    lines = [f"línea {i} ñ€" for i in range(50)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    assert list(iter_lines_reversed(path, block_size=7)) == lines[::-1]
+
+
+def test_iter_rows_reversed_multiline_description(csv_path):
+    expense = make_expense(1)
+    expense.descripcion = "primera línea\nsegunda; línea"
+    save_expense(make_expense(2), csv_path)
+    save_expense(expense, csv_path)
+    rows = list(iter_rows_reversed(csv_path, block_size=16))
+    assert [row[0] for row in rows] == ['1', '2']
+    assert rows[0][5] == "primera línea\nsegunda; línea"
+
+
+def test_iter_recent_rows_stops_at_window(csv_path, monkeypatch):
+    for days_ago in (90, 60, 20, 10, 1):
+        save_expense(make_expense(1, days_ago=days_ago), csv_path)
+    parsed = []
+    original = csv_utils.parse_fecha
+    monkeypatch.setattr(csv_utils, 'parse_fecha', lambda f: parsed.append(f) or original(f))
+    assert len(list(iter_recent_rows(csv_path, n=1, stale_rows=1))) == 3
+    # Solo se llega a mirar la primera fila fuera de la ventana
+    assert len(parsed) == 4
+
+
+def test_recent_rows_skip_backdated_rows(csv_path):
+    # Con MODIFY_DATE un gasto antiguo puede quedar al final del fichero, detrás de otros recientes
+    save_expense(make_expense(1, viaje='Roma', days_ago=2), csv_path)
+    save_expense(make_expense(2, days_ago=1), csv_path)
+    save_expense(make_expense(3, days_ago=100), csv_path)
+    assert not csv_utils.trip_index.is_built(csv_path)
+    assert [row[0] for row in iter_recent_rows(csv_path)] == ['2', '1']
+    assert get_last_trip(csv_path, user=1) == 'Roma'
+    assert get_last_expense(2, csv_path)['user'] == '2'
+    assert get_last_expense(3, csv_path) is None
+
+
+def test_recent_queries_without_index(csv_path):
+    save_expense(make_expense(1, viaje='Roma', days_ago=5), csv_path)
+    save_expense(make_expense(2, days_ago=1), csv_path)
+    assert not csv_utils.trip_index.is_built(csv_path)
+    assert get_last_trip(csv_path, user=1) == 'Roma'
+    assert get_last_trip(csv_path) == 'Roma'
+    assert get_last_expense(2, csv_path)['user'] == '2'
+    assert get_last_expense(3, csv_path) is None
+
+
+def test_concurrent_writers_do_not_tear_rows(tmp_path):
+    from benchmarks.bench_csv_locking import run_stress, is_ok
+    result = run_stress(tmp_path / "gastos.csv", processes=3, rows=40, batch=2, readers=1)
+    assert is_ok(result), result
+
+
+def test_build_does_not_hold_index_lock_while_waiting_for_file(csv_path, monkeypatch):
+    # Un flush de save_expenses ha escrito la fila (con el bloqueo exclusivo) y va a llamar a add mientras
+    # un get_last_trip reconstruye el índice: el build espera por el fichero, add no puede esperar por build
+    import threading
+    save_expense(make_expense(1, viaje='Roma', days_ago=5), csv_path)
+    index = csv_utils.trip_index
+    waiting = threading.Event()
+    real_file_lock = csv_utils.file_lock
+
+    def file_lock(f, exclusive=False):
+        waiting.set()
+        return real_file_lock(f, exclusive)
+
+    monkeypatch.setattr(csv_utils, 'file_lock', file_lock)
+    row = make_expense(2, viaje='París').to_csv_row()
+    with open(csv_path, 'a', encoding='utf-8', newline='') as f, real_file_lock(f, exclusive=True):
+        f.write(';'.join(row) + '\n')
+        f.flush()
+        builder = threading.Thread(target=index.build, args=(csv_path,))
+        builder.start()
+        assert waiting.wait(5)
+        adder = threading.Thread(target=index.add, args=(row, csv_path))
+        adder.start()
+        adder.join(5)
+        deadlocked = adder.is_alive()
+    builder.join(5)
+    adder.join(5)
+    assert not deadlocked
+    assert not builder.is_alive()
+    assert get_last_trip(csv_path, user=2) == 'París'
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.error_notifier import ErrorNotifier, fingerprint
+
+
+class FakeBot:
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.messages = []
+        self.documents = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.fail:
+            raise self.fail
+        self.messages.append(text)
+
+    async def send_document(self, chat_id, document, caption=None, parse_mode=None):
+        self.documents.append((document.input_file_content, caption))
+
+
+def raise_key_error(key):
+    return {}[key]
+
+
+def raise_value_error(value):
+    raise ValueError(value)
+
+
+def catch(func, *args):
+    try:
+        func(*args)
+    except Exception as e:
+        return e
+
+
+def make_notifier(bot, **kwargs):
+    notifier = ErrorNotifier(chat_id="1", **kwargs)
+    notifier.bot = bot
+    return notifier
+
+
+def test_fingerprint_ignores_the_message_but_not_the_place():
+    assert fingerprint(catch(raise_key_error, "a")) == fingerprint(catch(raise_key_error, "b"))
+    assert fingerprint(catch(raise_key_error, "a")) != fingerprint(catch(raise_value_error, "a"))
+
+
+@pytest.mark.asyncio
+async def test_errors_are_aggregated_into_one_digest():
+    bot = FakeBot()
+    notifier = make_notifier(bot)
+    for i in range(5):
+        notifier.report(catch(raise_key_error, f"usuario {i}"), update="update", context=None)
+    notifier.report(catch(raise_value_error, "importe"), update="update", context=None)
+
+    assert notifier.pending == 6
+    assert await notifier.flush()
+    [message] = bot.messages
+    assert "6 errores</b> (2 distintos)" in message
+    assert "<b>5×</b> <code>KeyError</code>" in message
+    assert "<b>1×</b> <code>ValueError</code>" in message
+    assert "raise_key_error" in message
+    assert len(message) <= 4096
+    assert notifier.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_oversized_digest_goes_as_a_document():
+    bot = FakeBot()
+    notifier = make_notifier(bot)
+    notifier.report(catch(raise_value_error, "x" * 5000), update={"datos": "y" * 5000}, context=None)
+
+    assert await notifier.flush()
+    assert not bot.messages
+    [(content, caption)] = bot.documents
+    assert b"y" * 5000 in content and b"Traceback" in content
+    assert len(caption) <= 1024
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_and_retry_after_keep_errors_for_the_next_digest():
+    bot = FakeBot()
+    notifier = make_notifier(bot, max_per_hour=1)
+    notifier.report(catch(raise_key_error, "a"))
+    assert await notifier.flush()
+
+    notifier.report(catch(raise_key_error, "b"))
+    notifier.report(catch(raise_key_error, "c"))
+    assert not await notifier.flush() # límite de la hora alcanzado
+    assert notifier.pending == 2 and len(bot.messages) == 1
+
+    notifier._sent.clear()
+    bot.fail = RetryAfter(30)
+    assert not await notifier.flush()
+    assert notifier.pending == 2
+    assert not await notifier.flush() # sigue esperando lo que pidió Telegram
+    notifier._blocked_until = 0
+    bot.fail = None
+    assert await notifier.flush()
+    assert "<b>2×</b>" in bot.messages[-1]
+
+
+
+class FlakyBot(FakeBot):
+    """Falla con un error que no es de Telegram las primeras failures veces"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise RuntimeError("fallo inesperado")
+        self.messages.append(text)
+
+
+@pytest.mark.asyncio
+async def test_unexpected_send_error_keeps_errors_pending():
+    bot = FlakyBot(failures=1)
+    notifier = make_notifier(bot)
+    notifier.report(catch(raise_key_error, "a"))
+
+    assert not await notifier.flush()
+    assert notifier.pending == 1 and not bot.messages
+    assert await notifier.flush()
+    assert "<b>1×</b>" in bot.messages[0]
+
+
+@pytest.mark.asyncio
+async def test_unexpected_send_error_keeps_the_digest_task_running():
+    bot = FlakyBot(failures=2)
+    notifier = ErrorNotifier(chat_id="1", window=0.01)
+    notifier.report(catch(raise_key_error, "a"))
+    await notifier.start(bot)
+    try:
+        for _ in range(500):
+            if bot.messages:
+                break
+            await asyncio.sleep(0.01)
+        assert notifier.running
+        assert bot.attempts == 3 and len(bot.messages) == 1
+        assert notifier.pending == 0
+    finally:
+        await notifier.stop()
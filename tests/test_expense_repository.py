@@ -0,0 +1,92 @@
+import pytest
+from datetime import datetime, timedelta
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.models.expense import Expense
+from src.models.expense_repository import SqliteExpenseRepository, build_expense_repository, CsvExpenseRepository
+from src.utils import csv_utils
+
+
+def make_expense(user, viaje='', days_ago=0):
+    expense = Expense(user)
+    expense._fecha = (datetime.today() - timedelta(days=days_ago)).strftime('%d/%m/%Y')
+    expense.importe = "12,5"
+    expense.tipo = 'gasto'
+    expense.categoria = 'Viajes' if viaje else 'Comida'
+    expense.descripcion = 'test'
+    expense.quien = 'Yo'
+    expense.viaje = viaje
+    return expense
+
+
+@pytest.fixture
+def repository(tmp_path):
+    repo = SqliteExpenseRepository(tmp_path / "gastos.db")
+    yield repo
+    repo.close()
+
+
+def test_sqlite_uses_wal(repository):
+    assert repository.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_last_trip_per_user(repository):
+    repository.save(make_expense(1, viaje='Roma', days_ago=5))
+    repository.save(make_expense(1, viaje='', days_ago=1))
+    repository.save(make_expense(2, viaje='Lisboa', days_ago=2))
+    assert repository.get_last_trip(1) == 'Roma'
+    assert repository.get_last_trip(2) == 'Lisboa'
+    assert repository.get_last_trip() == 'Lisboa'
+
+
+def test_last_trip_outside_window(repository):
+    repository.save(make_expense(1, viaje='Roma', days_ago=45))
+    assert repository.get_last_trip(1) is None
+    assert repository.get_last_trip(1, n=2) == 'Roma'
+
+
+@pytest.mark.parametrize("indexed", [True, False])
+def test_backends_agree_on_the_window_boundary(tmp_path, monkeypatch, indexed):
+    monkeypatch.setattr(csv_utils, 'trip_index', csv_utils.TripIndex())
+    sqlite = SqliteExpenseRepository(tmp_path / "gastos.db")
+    csv_repo = CsvExpenseRepository(tmp_path / "gastos.csv")
+    for repo in (sqlite, csv_repo):
+        repo.save(make_expense(1, viaje='Roma', days_ago=30))
+        repo.save(make_expense(2, viaje='Oslo', days_ago=29))
+    if indexed:
+        csv_repo.warm_up()
+    for repo in (sqlite, csv_repo):
+        assert repo.get_last_trip(1) is None # justo 30 días: fuera de la ventana en los dos
+        assert repo.get_last_trip(1, n=2) == 'Roma'
+        assert repo.get_last_trip(2) == 'Oslo'
+    sqlite.close()
+
+
+def test_last_trip_uses_index(repository):
+    plan = repository.conn.execute(
+        "EXPLAIN QUERY PLAN " + repository._LAST_TRIP_USER, ("1", "2000-01-01")
+    ).fetchall()
+    assert any("idx_gastos_user_fecha" in row[-1] for row in plan)
+
+
+def test_imports_legacy_csv(tmp_path):
+    csv_path = tmp_path / "gastos.csv"
+    fecha = datetime.today().strftime('%d/%m/%Y')
+    csv_path.write_text(
+        "user;fecha;importe;tipo;concepto;descripcion;quien;viaje;anualizable\n"
+        f"1;{fecha};10.0;gasto;Viajes;avión;Yo;Japón;False\n",
+        encoding="utf-8",
+    )
+    repo = SqliteExpenseRepository(tmp_path / "gastos.db", legacy_csv_path=csv_path)
+    assert repo.get_last_trip(1) == 'Japón'
+    repo.close()
+
+
+def test_build_expense_repository():
+    assert isinstance(build_expense_repository('csv'), CsvExpenseRepository)
+    assert isinstance(build_expense_repository('sqlite'), SqliteExpenseRepository)
+    with pytest.raises(ValueError):
+        build_expense_repository('excel')
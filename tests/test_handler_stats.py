@@ -0,0 +1,81 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.testing.fake_bot_api import FakeBotAPI, make_message_update
+from src.utils import instrumentation, tracing
+from src.utils.async_io import run_io
+from src.utils.instrumentation import handler_stats, instrument_conversation, instrument_handler, stats_report
+from src.utils.telegram_request import InstrumentedRequest
+from src.utils.tracing import TRACE_KEY
+
+
+@pytest.mark.asyncio
+async def test_handler_records_wall_telegram_and_storage_time():
+    async def stats_enter_save(update, context):
+        await run_io(time.sleep, 0.02)
+        instrumentation.add_telegram_time(0.03)
+        return 1
+
+    wrapped = instrument_handler(stats_enter_save, "SAVE")
+    assert await wrapped(None, None) == 1
+
+    stats = handler_stats[("stats_enter_save", "SAVE")]
+    assert stats.wall.count == 1
+    assert stats.wall.max >= 20
+    assert stats.storage.max >= 20
+    assert stats.telegram.max == pytest.approx(30)
+    # Fuera de un handler no se apunta a nadie
+    instrumentation.add_telegram_time(1)
+    assert stats.telegram.count == 1
+
+
+@pytest.mark.asyncio
+async def test_telegram_time_is_measured_through_the_request():
+    api = FakeBotAPI(rtt=0.02)
+    await api.start()
+
+    async def stats_start(update, context):
+        await update.message.reply_text("hola")
+        return 1
+
+    conv = instrument_conversation(ConversationHandler(
+        entry_points=[CommandHandler("start", stats_start)], states={}, fallbacks=[]))
+    application = ApplicationBuilder().token("1:test").base_url(api.base_url).request(InstrumentedRequest()).build()
+    application.add_handler(conv)
+
+    async with application:
+        await application.process_update(
+            Update.de_json(make_message_update(1, 7, "/start"), application.bot))
+    await api.stop()
+
+    stats = handler_stats[("stats_start", "entry")]
+    assert stats.wall.count == 1
+    assert stats.telegram.max >= 20 # al menos el rtt de sendMessage
+    assert stats.telegram.max <= stats.wall.max
+    report = stats_report()
+    assert "stats_start [entry] n=1" in report
+    assert "entry n=" in report
+
+
+@pytest.mark.asyncio
+async def test_no_span_is_built_while_the_tracer_is_not_writing(monkeypatch):
+    # El coste por llamada se mide en benchmarks/bench_hot_paths.py (instrumentation.*); aquí solo que sin la
+    # tarea de escritura del tracer un handler no paga por construir un span que se iba a descartar
+    def no_span(*args, **kwargs):
+        raise AssertionError("no debería abrirse ningún span")
+
+    monkeypatch.setattr(tracing, "Span", no_span)
+    monkeypatch.setattr(tracing.tracer, "enabled", True)
+    assert not tracing.tracer.running
+
+    async def raw(update, context):
+        return 1
+
+    assert await instrument_handler(raw, "bench")(None, SimpleNamespace(user_data={TRACE_KEY: "t"})) == 1
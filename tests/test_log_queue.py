@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.log_queue import StepLogSampler, setup_queue_logging, stop_queue_logging
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET, delay=0.0):
+        super().__init__(level)
+        self.delay = delay
+        self.records = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.records.append((threading.current_thread().name, record.getMessage()))
+
+
+def make_logger(name, *handlers):
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    for handler in handlers:
+        logger.addHandler(handler)
+    return logger
+
+
+def test_records_are_written_from_the_listener_thread():
+    slow = CollectingHandler(delay=0.05)
+    only_errors = CollectingHandler(level=logging.ERROR)
+    logger = make_logger("expense_bot.test_log_queue", slow, only_errors)
+
+    setup_queue_logging(logger, sampler=StepLogSampler(threshold=0))
+    try:
+        started = time.perf_counter()
+        logger.info("El usuario %s está registrado", 7)
+        logger.error("fallo %d", 1)
+        # El disco lento no lo paga quien loguea
+        assert time.perf_counter() - started < 0.05
+    finally:
+        stop_queue_logging()
+
+    assert [message for _, message in slow.records] == ["El usuario 7 está registrado", "fallo 1"]
+    assert all(thread != threading.current_thread().name for thread, _ in slow.records)
+    assert [message for _, message in only_errors.records] == ["fallo 1"]
+    # Al parar, los handlers vuelven al logger
+    assert logger.handlers == [slow, only_errors]
+
+
+def test_sampler_keeps_warnings_and_samples_step_info_under_load():
+    sampler = StepLogSampler(threshold=5, rate=0.25)
+    def record(level, name="expense_bot.handlers.conversations"):
+        return logging.LogRecord(name, level, __file__, 1, "paso", None, None)
+
+    kept = [sampler.filter(record(logging.INFO)) for _ in range(25)]
+    assert sum(kept) == 5 + 5 # los 5 primeros y 1 de cada 4 de los 20 siguientes
+    assert sampler.dropped == 15
+    assert sampler.filter(record(logging.WARNING))
+    assert sampler.filter(record(logging.INFO, "expense_bot.utils.write_queue"))
+
+    sampler._window_start -= 1 # nuevo segundo: vuelven a pasar todos hasta el umbral
+    assert sampler.filter(record(logging.INFO))
+    assert StepLogSampler(threshold=0).filter(record(logging.INFO))
@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from telegram.ext import CommandHandler, ConversationHandler, MessageHandler, filters
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.instrumentation import instrument_conversation, instrument_handler, stats_report
+from src.utils.loop_monitor import LoopLagMonitor
+from src.utils.metrics import Histogram
+from src.handlers.commands import developer
+
+
+def test_histogram_quantiles():
+    h = Histogram(bounds=(10, 20, 30))
+    for value in [5] * 50 + [15] * 40 + [25] * 9 + [100]:
+        h.observe(value)
+    assert h.count == 100
+    assert h.quantile(0.5) == pytest.approx(10)
+    assert 10 < h.quantile(0.9) <= 20
+    assert 20 < h.quantile(0.99) <= 30
+    assert h.quantile(1.0) == 100
+    assert h.cumulative_counts()[-1] == (float("inf"), 100)
+    assert Histogram().quantile(0.5) is None
+
+
+@pytest.mark.asyncio
+async def test_instrumented_handler_wraps_once_and_reports_its_calls():
+    async def monitor_enter_import(update, context):
+        return 1
+
+    wrapped = instrument_handler(monitor_enter_import, "IMPORT")
+    assert wrapped.__name__ == "monitor_enter_import"
+    assert instrument_handler(wrapped) is wrapped
+    assert await wrapped(None, None) == 1
+    assert "monitor_enter_import [IMPORT] n=1" in stats_report()
+
+
+def test_instrument_conversation_wraps_nested_callbacks():
+    async def start(update, context): ...
+    async def nested(update, context): ...
+    async def cancel(update, context): ...
+
+    inner = ConversationHandler(entry_points=[CommandHandler("x", nested)], states={}, fallbacks=[])
+    conv = ConversationHandler(
+        entry_points=[CommandHandler("start", start)],
+        states={1: [MessageHandler(filters.TEXT, start)], 2: [inner]},
+        fallbacks=[CommandHandler("cancel", cancel)],
+    )
+    instrument_conversation(conv)
+    assert conv.entry_points[0].callback.__instrumented__
+    assert conv.states[1][0].callback.__name__ == "start"
+    assert inner.entry_points[0].callback.__instrumented__
+    assert conv.fallbacks[0].callback.__instrumented__
+
+
+@pytest.mark.asyncio
+async def test_monitor_blames_the_handler_that_blocked():
+    monitor = LoopLagMonitor(interval_ms=10, threshold_ms=50)
+
+    @instrument_handler
+    async def enter_description(update, context):
+        await asyncio.sleep(0)
+        time.sleep(0.12) # I/O síncrono que bloquea el bucle, y termina sin volver a esperar a nada
+
+    @instrument_handler
+    async def enter_confirm(update, context):
+        await asyncio.sleep(0.3) # esperando a la red mientras el otro bloquea: no tiene la culpa
+
+    monitor.start()
+    await asyncio.sleep(0.03)
+    waiting = asyncio.create_task(enter_confirm(None, None))
+    await enter_description(None, None)
+    await asyncio.sleep(0.03)
+    await monitor.stop()
+    await waiting
+
+    assert monitor.histogram.count >= 3
+    blamed = [name for stall in monitor.stalls for name, _ in stall.handlers]
+    assert blamed == ["enter_description"]
+    stall, = [stall for stall in monitor.stalls if stall.handlers]
+    assert stall.lag_ms >= 100
+    assert stall.handlers[0][1] >= 100
+    assert "enter_description" in monitor.report()
+
+
+@pytest.mark.asyncio
+async def test_timed_steps_pass_results_and_cancellation_through():
+    @instrument_handler
+    async def enter_import(update, context):
+        await asyncio.sleep(0)
+        return update * 2
+
+    assert await enter_import(21, None) == 42
+
+    started = asyncio.Event()
+
+    @instrument_handler
+    async def monitor_enter_who(update, context):
+        started.set()
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(monitor_enter_who(None, None))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # La llamada cancelada también se cierra y cuenta en /stats
+    assert "monitor_enter_who [-] n=1" in stats_report()
+
+
+@pytest.mark.asyncio
+async def test_perf_command_replies_with_report(monkeypatch):
+    monitor = LoopLagMonitor()
+    monitor.record(3)
+    monkeypatch.setattr(developer, "loop_monitor", monitor)
+    update = MagicMock()
+    update.message.reply_text = AsyncMock()
+    await developer.perf_command(update, MagicMock())
+    text = update.message.reply_text.call_args.args[0]
+    assert "muestras: 1" in text
+
+
+def test_perf_is_developer_only(monkeypatch):
+    monkeypatch.setattr(developer, "DEVELOPER_CHAT_ID", "")
+    assert developer.developer_filter().chat_ids == frozenset()
+    monkeypatch.setattr(developer, "DEVELOPER_CHAT_ID", "1234")
+    assert developer.developer_filter().chat_ids == frozenset({1234})
@@ -0,0 +1,79 @@
+import httpx
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.state_manager import HistoryEntry, StateManager
+from src.utils import metrics
+from src.utils.instrumentation import instrument_handler
+from src.utils.metrics_server import MetricsServer, conversation_stats, render_metrics
+from src.utils.update_processor import PerUserUpdateProcessor
+
+
+def parse(text):
+    """{'nombre{etiquetas}': valor} de las líneas que no son comentarios"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_conversation_stats():
+    entry = HistoryEntry(1, "start", "/start", {})
+    user_data = {1: {StateManager.HISTORY_KEY: [entry, entry]}, 2: {StateManager.HISTORY_KEY: [entry]}, 3: {}}
+    assert conversation_stats(user_data) == (2, 3, 2)
+
+
+@pytest.mark.asyncio
+async def test_scrape_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(metrics, "UPDATES_PROCESSED", metrics.Counter())
+    monkeypatch.setattr("src.utils.update_processor.UPDATES_PROCESSED", metrics.UPDATES_PROCESSED)
+    monkeypatch.setattr("src.utils.metrics_server.UPDATES_PROCESSED", metrics.UPDATES_PROCESSED)
+    metrics.ERRORS_BY_TYPE.inc("TimedOut")
+
+    async def metrics_select_category(update, context):
+        return 2
+
+    await instrument_handler(metrics_select_category, "SELECT_TYPE")(None, None)
+
+    processor = PerUserUpdateProcessor()
+
+    async def noop():
+        pass
+
+    for _ in range(3):
+        await processor.process_update(object(), noop())
+
+    entry = HistoryEntry(1, "start", "/start", {})
+    server = MetricsServer(port=0, user_data=lambda: {7: {StateManager.HISTORY_KEY: [entry] * 4}})
+    await server.start()
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{server.port}/metrics")
+            missing = await client.get(f"http://127.0.0.1:{server.port}/otra")
+    finally:
+        await server.stop()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert missing.status_code == 404
+
+    samples = parse(response.text)
+    assert samples["expense_bot_updates_total"] == 3
+    assert samples["expense_bot_updates_per_second"] > 0
+    labels = 'handler="metrics_select_category",state="SELECT_TYPE"'
+    assert samples[f"expense_bot_handler_duration_seconds_count{{{labels}}}"] == 1
+    assert samples[f'expense_bot_handler_duration_seconds_bucket{{{labels},le="+Inf"}}'] == 1
+    assert samples["expense_bot_write_queue_depth"] == 0
+    assert samples['expense_bot_errors_total{type="TimedOut"}'] >= 1
+    assert samples["expense_bot_active_conversations"] == 1
+    assert samples["expense_bot_state_history_entries"] == 4
+
+
+def test_render_without_user_data_is_valid():
+    text = render_metrics()
+    assert "# TYPE expense_bot_handler_duration_seconds histogram" in text
+    assert parse(text)["expense_bot_active_conversations"] == 0
@@ -56,9 +56,9 @@ async def test_start_registered(monkeypatch):
     monkeypatch.setattr(psm, 'check_user', lambda uid: True)
     # Patch state_manager methods
     update_send = AsyncMock()
-    psm.state_manager.update_send_message = update_send
+    monkeypatch.setattr(psm.state_manager, "update_send_message", update_send)
     push = MagicMock()
-    psm.state_manager.push = push
+    monkeypatch.setattr(psm.state_manager, "push", push)
     # Run start
     state = await psm.start(update, context)
     # Assert context.user_data has expense_obj
@@ -80,7 +80,7 @@ async def test_start_unregistered(monkeypatch):
     monkeypatch.setattr(psm, 'check_user', lambda uid: False)
     # Patch update_send_message
     update_send = AsyncMock()
-    psm.state_manager.update_send_message = update_send
+    monkeypatch.setattr(psm.state_manager, "update_send_message", update_send)
     # Run start
     state = await psm.start(update, context)
     # Assert update_send_message called with registration prompt
@@ -95,10 +95,10 @@ async def test_enter_save_yes(monkeypatch):
     monkeypatch.setattr(psm.state_manager, 'get_input_data', lambda upd, ctx: str(ConvState.YES))
     # Patch update_send_message
     update_send = AsyncMock()
-    psm.state_manager.update_send_message = update_send
-    # Patch save_expense and clear_manager
-    saved = MagicMock()
-    monkeypatch.setattr(psm, 'save_expense', saved)
+    monkeypatch.setattr(psm.state_manager, "update_send_message", update_send)
+    # Patch the write queue and clear_manager
+    write_queue = AsyncMock()
+    monkeypatch.setattr(psm, 'expense_write_queue', write_queue)
     cleared = MagicMock()
     monkeypatch.setattr(psm.state_manager, 'clear_manager', cleared)
     context = DummyContext()
@@ -107,28 +107,72 @@ async def test_enter_save_yes(monkeypatch):
     update = DummyUpdate(user, callback_data=str(ConvState.YES))
     # Call enter_save
     state = await psm.enter_save(update, context)
-    # Assert save_expense called
-    saved.assert_called_once_with(context.user_data['expense_obj'], psm.DATA_FILE_PATH)
+    # Assert the expense went through the write queue, and the user is told once it is saved
+    write_queue.save.assert_awaited_once_with(context.user_data['expense_obj'])
+    assert "Registro guardado" in update_send.await_args.args[2]
     # Assert clear_manager called
     cleared.assert_called_once()
     assert state == ConversationHandler.END
 
+@pytest.mark.asyncio
+async def test_enter_save_yes_not_saved_in_time(monkeypatch):
+    user = DummyUser(790, 'SlowDisk')
+    monkeypatch.setattr(psm.state_manager, 'get_input_data', lambda upd, ctx: str(ConvState.YES))
+    update_send = AsyncMock()
+    monkeypatch.setattr(psm.state_manager, "update_send_message", update_send)
+    write_queue = AsyncMock()
+    write_queue.save.return_value = False
+    monkeypatch.setattr(psm, 'expense_write_queue', write_queue)
+    monkeypatch.setattr(psm.state_manager, 'clear_manager', MagicMock())
+    context = DummyContext()
+    context.user_data['expense_obj'] = Expense(user.id)
+    state = await psm.enter_save(DummyUpdate(user, callback_data=str(ConvState.YES)), context)
+    text = update_send.await_args.args[2]
+    assert "guardado" not in text and "problemas para guardar" in text
+    assert state == ConversationHandler.END
+
 @pytest.mark.asyncio
 async def test_enter_save_no(monkeypatch):
     user = DummyUser(321, 'NoSaver')
     # Simulate get_input_data returns NO
     monkeypatch.setattr(psm.state_manager, 'get_input_data', lambda upd, ctx: str(ConvState.NO))
     update_send = AsyncMock()
-    psm.state_manager.update_send_message = update_send
-    saved = MagicMock()
-    monkeypatch.setattr(psm, 'save_expense', saved)
+    monkeypatch.setattr(psm.state_manager, "update_send_message", update_send)
+    write_queue = AsyncMock()
+    monkeypatch.setattr(psm, 'expense_write_queue', write_queue)
     cleared = MagicMock()
     monkeypatch.setattr(psm.state_manager, 'clear_manager', cleared)
     context = DummyContext()
     context.user_data['expense_obj'] = Expense(user.id)
     update = DummyUpdate(user, callback_data=str(ConvState.NO))
     state = await psm.enter_save(update, context)
-    # save_expense should not be called
-    saved.assert_not_called()
+    # Nothing should be saved
+    write_queue.save.assert_not_awaited()
     cleared.assert_called_once()
     assert state == ConversationHandler.END
+
+
+def test_category_buttons_are_routed_without_rebuilding(tmp_path, monkeypatch):
+    from telegram import Update
+    from src.testing.fake_bot_api import make_callback_update
+    from src.utils.category_utils import CategoryStore
+
+    path = tmp_path / "categories.json"
+    path.write_text('{"gasto": ["Comida"], "ingreso": ["Nómina"], "quien": ["Ana"]}', encoding="utf-8")
+    store = CategoryStore(path, check_interval=0)
+    monkeypatch.setattr(psm, "category_store", store)
+    conversation = psm.build_conversation()
+    description_handler, = conversation.states[ConvState.ENTER_DESCRIPTION]
+    confirm_handler, = conversation.states[ConvState.CONFIRM]
+
+    def routed(handler, data):
+        return bool(handler.check_update(Update.de_json(make_callback_update(1, 123, data), None)))
+
+    assert routed(description_handler, "Comida")
+    assert routed(description_handler, "Nómina")
+    assert not routed(description_handler, "Ana")
+    assert not routed(description_handler, "Casa (alquiler)")
+    store.add("Casa (alquiler)", 'gasto')
+    assert routed(description_handler, "Casa (alquiler)")
+    assert routed(confirm_handler, "Ana")
+    assert not routed(confirm_handler, "Comida")
@@ -0,0 +1,109 @@
+import pytest
+from unittest.mock import MagicMock
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.expense import Expense
+from src.models.state_manager import StateManager, HistoryEntry
+from src.utils.persistence import SqlitePersistence, dumps, loads
+
+
+async def handler_a(update, context):
+    return 1
+
+async def handler_b(update, context):
+    return 2
+
+
+def make_update(text):
+    update = MagicMock()
+    update.callback_query = None
+    update.message = MagicMock()
+    update.message.text = text
+    return update
+
+
+def test_dumps_loads_roundtrip():
+    expense = Expense(1)
+    expense.importe = "12,5"
+    entry = HistoryEntry(3, "handler_a", "12,5", {"expense_obj": {"__expense__": {"_importe": 12.5}}})
+    data = loads(dumps({"expense_obj": expense, "__history__": [entry], "texto": "hola"}))
+
+    assert data["expense_obj"] == expense
+    assert data["__history__"] == [entry]
+    assert isinstance(data["__history__"][0], HistoryEntry)
+    assert data["texto"] == "hola"
+
+
+def test_dumps_skips_unserializable_values():
+    data = loads(dumps({"ok": 1, "update": object()}))
+    assert data == {"ok": 1}
+
+
+@pytest.mark.asyncio
+async def test_history_survives_restart(tmp_path):
+    sm = StateManager()
+    sm.register_handlers(handler_a, handler_b)
+    context = MagicMock()
+    context.user_data = {"expense_obj": Expense(1)}
+    sm.push(make_update("/start"), context, 1, handler_a)
+    context.user_data["expense_obj"].importe = "10"
+    sm.push(make_update("10"), context, 2, handler_b)
+
+    persistence = SqlitePersistence(tmp_path / "state.db", update_interval=1)
+    await persistence.update_user_data(1, context.user_data)
+    await persistence.update_conversation("new_enter_expense", (1, 1), 2)
+    await persistence.flush()
+
+    # "Reinicio": una persistencia y un contexto nuevos sobre el mismo fichero
+    restored = SqlitePersistence(tmp_path / "state.db", update_interval=1)
+    user_data = (await restored.get_user_data())[1]
+    assert await restored.get_conversations("new_enter_expense") == {(1, 1): 2}
+    assert user_data["expense_obj"].importe == 10.0
+
+    context = MagicMock()
+    context.user_data = user_data
+    state, handler, input_data = sm.pop(context)
+    assert (state, handler, input_data) == (1, handler_a, "/start")
+    assert context.user_data["expense_obj"].importe is None
+    await restored.flush()
+
+
+@pytest.mark.asyncio
+async def test_only_changed_users_are_written(tmp_path, monkeypatch):
+    persistence = SqlitePersistence(tmp_path / "state.db", update_interval=1)
+    await persistence.update_user_data(1, {"a": 1})
+    await persistence.update_user_data(2, {"a": 2})
+    await persistence.flush()
+
+    written = []
+    original = persistence._write
+    monkeypatch.setattr(persistence, "_write", lambda dirty: (written.append(dict(dirty)), original(dirty)))
+
+    await persistence.update_user_data(1, {"a": 1})      # sin cambios
+    await persistence.update_user_data(2, {"a": 3})      # cambiado
+    await persistence.update_conversation("conv", (2, 2), None) # nunca se había guardado
+    await persistence.flush()
+
+    assert written == [{("user_data", 2): dumps({"a": 3})}]
+    restored = SqlitePersistence(tmp_path / "state.db", update_interval=1)
+    assert await restored.get_user_data() == {1: {"a": 1}, 2: {"a": 3}}
+    await restored.flush()
+
+
+@pytest.mark.asyncio
+async def test_drop_user_data_and_end_conversation(tmp_path):
+    persistence = SqlitePersistence(tmp_path / "state.db", update_interval=1)
+    await persistence.update_user_data(1, {"a": 1})
+    await persistence.update_conversation("conv", (1, 1), 4)
+    await persistence.flush()
+
+    await persistence.drop_user_data(1)
+    await persistence.update_conversation("conv", (1, 1), None)
+    await persistence.flush()
+
+    restored = SqlitePersistence(tmp_path / "state.db", update_interval=1)
+    assert await restored.get_user_data() == {}
+    assert await restored.get_conversations("conv") == {}
+    await restored.flush()
@@ -0,0 +1,81 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+from telegram.ext import ApplicationBuilder
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.testing.fake_bot_api import FakeBotAPI
+from src.utils.rate_limiter import Lane, PriorityRateLimiter, TokenBucket
+from src.utils.telegram_request import InstrumentedRequest
+
+
+def make_application(api, limiter):
+    return (ApplicationBuilder().token("1:test").base_url(api.base_url)
+            .request(InstrumentedRequest()).rate_limiter(limiter).build())
+
+
+def test_token_bucket_refills_and_blocks():
+    bucket = TokenBucket(rate=2, capacity=2, now=0)
+    assert bucket.delay(0) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.delay(0) == pytest.approx(0.5)
+    assert bucket.delay(0.5) == 0
+    bucket.blocked_until = 3
+    assert bucket.delay(1) == pytest.approx(2)
+
+
+@pytest.mark.asyncio
+async def test_simulation_stays_under_telegram_limits_and_prioritises_replies():
+    # Telegram de mentira con límites más estrictos de lo normal para que la simulación sea corta
+    api = FakeBotAPI(max_per_second=30, max_per_chat_per_second=5)
+    await api.start()
+    limiter = PriorityRateLimiter(global_rate=20, global_burst=5, chat_rate=4, chat_burst=1, max_retries=0)
+    application = make_application(api, limiter)
+    finished = {}
+    order = itertools.count()
+
+    async def send(chat_id, i, lane):
+        await application.bot.send_message(chat_id, f"{lane.name} {i}", rate_limit_args=lane)
+        finished[(lane, chat_id, i)] = next(order)
+
+    async with application:
+        # Un informe a 20 chats y a la vez 3 usuarios recibiendo 4 respuestas cada uno
+        tasks = [send(1000 + i, i, Lane.BACKGROUND) for i in range(20)]
+        tasks += [send(chat_id, i, Lane.INTERACTIVE) for chat_id in (1, 2, 3) for i in range(4)]
+        await asyncio.gather(*tasks)
+    await api.stop()
+
+    # 32 mensajes de golpe pasarían de los 30/s: sin flood errors es que el limitador los ha espaciado
+    assert api.flood_errors == 0
+    assert api.count("sendMessage") == 32
+    # Orden en el que terminan (no tiempos)
+    interactive = [n for (lane, _, _), n in finished.items() if lane == Lane.INTERACTIVE]
+    background = [n for (lane, _, _), n in finished.items() if lane == Lane.BACKGROUND]
+    # Las respuestas a los usuarios no esperan a que termine el informe
+    assert sum(interactive) / len(interactive) < sum(background) / len(background)
+    assert max(interactive) < max(background)
+
+
+@pytest.mark.asyncio
+async def test_retry_after_backs_off_and_retries():
+    api = FakeBotAPI(max_per_chat_per_second=1)
+    await api.start()
+    # Sin throttling propio: solo reacciona a los RetryAfter
+    limiter = PriorityRateLimiter(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000,
+                                  max_retries=2)
+    application = make_application(api, limiter)
+
+    async with application:
+        started = time.perf_counter()
+        await asyncio.gather(*(application.bot.send_message(7, f"msg {i}") for i in range(2)))
+        elapsed = time.perf_counter() - started
+    await api.stop()
+
+    assert api.flood_errors == 1
+    assert api.count("sendMessage") == 2
+    assert elapsed >= 1 # el retry_after que pidió Telegram
@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from scripts.import_time import ROOT, measure, own_ms, parse_importtime, total_ms
+
+# Se importa bot.py en un intérprete nuevo y se apunta lo que abre (audit hooks) y qué módulos quedan cargados
+PROBE = """
+import json, os, sys
+opened = []
+def hook(event, args):
+    if event == "open" and isinstance(args[0], (str, os.PathLike)):
+        opened.append(os.path.abspath(args[0]))
+    elif event == "sqlite3.connect":
+        opened.append(os.path.abspath(args[0]))
+sys.addaudithook(hook)
+import src.bot
+conversation = sys.modules["handlers.conversations.new_enter_expense"]
+from src.utils.category_utils import category_store
+print(json.dumps({
+    "opened": opened,
+    "modules": sorted(sys.modules),
+    "conversation_built": "conv_new_enter_expense" in vars(conversation),
+    "categories_loaded": category_store._data is not None,
+}))
+"""
+
+
+def probe_import(cwd: Path) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT / "src"), str(ROOT)]))
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_parse_importtime():
+    text = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     _json\n"
+        "import time:       300 |        420 |   json\n"
+        "import time:      1000 |       1500 | src.bot\n"
+        "Traceback (most recent call last):\n"
+    )
+    records = parse_importtime(text)
+    assert [(r.module, r.depth) for r in records] == [("_json", 2), ("json", 1), ("src.bot", 0)]
+    assert total_ms(records) == 1.5
+    assert own_ms(records) == 1.0
+
+
+def test_import_bot_does_no_file_io(tmp_path):
+    result = probe_import(tmp_path)
+    touched = [path for path in result["opened"]
+               if (path.startswith(str(ROOT)) or path.startswith(str(tmp_path)))
+               and not path.endswith((".py", ".pyc", ".pth")) and "__pycache__" not in path
+               and path != str(ROOT / "config" / ".env")]
+    assert touched == []
+    assert not (tmp_path / "logs").exists()
+
+
+def test_import_bot_is_lazy(tmp_path):
+    result = probe_import(tmp_path)
+    assert not result["conversation_built"]
+    assert not result["categories_loaded"]
+    assert "src.utils.metrics_server" not in result["modules"]
+    assert "pandas" not in result["modules"]
+
+
+def test_importtime_report_of_bot():
+    # Sin presupuestos de tiempo (dependen de la máquina): los comprueba scripts/import_time.py --budget-ms
+    records = measure("src.bot", runs=1)
+    modules = {record.module for record in records}
+    assert {"src.bot", "src.handlers.router", "handlers.conversations.new_enter_expense"} <= modules
+    assert total_ms(records) >= own_ms(records) > 0
+    assert records[-1].module == "src.bot" and records[-1].depth == 0
@@ -1,11 +1,17 @@
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock, MagicMock
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler
 
 
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.testing.fake_bot_api import FakeBotAPI, make_callback_update
 from src.models.state_manager import StateManager
+from src.utils.telegram_request import InstrumentedRequest
 
 
 @pytest.fixture
@@ -45,7 +51,7 @@ def test_extract_input_data_callback(mock_update_callback):
 
 def test_get_input_data_back_command(mock_update_message, mock_context):
     sm = StateManager()
-    sm.BACK_COMMAND = "test"
+    mock_context.user_data[sm.BACK_COMMAND_KEY] = "test"
     mock_context.user_data[sm.LAST_INPUT_KEY] = "last_input"
     assert sm.get_input_data(mock_update_message, mock_context) == "last_input"
 
@@ -99,3 +105,110 @@ async def test_update_send_message_text():
     update.callback_query = None
     await sm.update_send_message(update, context, "Hola")
     msg.reply_text.assert_awaited_with("Hola", reply_markup=None)
+
+
+def test_push_stores_only_changed_keys(mock_update_message, mock_context):
+    from src.models.expense import Expense
+    sm = StateManager()
+    mock_context.user_data['expense_obj'] = Expense(1)
+    mock_context.user_data['otro'] = 'fijo'
+    sm.push(mock_update_message, mock_context, 1, None)
+    mock_context.user_data['expense_obj'].tipo = 'gasto'
+    sm.push(mock_update_message, mock_context, 2, None)
+    history = mock_context.user_data[sm.HISTORY_KEY]
+    assert set(history[0].diff) == {'expense_obj', 'otro'}
+    assert set(history[1].diff) == {'expense_obj'}
+    # No se guardan objetos Update en el historial
+    assert all(mock_update_message not in entry for entry in history)
+
+
+def test_pop_restores_expense_snapshot(mock_update_message, mock_context):
+    from src.models.expense import Expense
+    sm = StateManager()
+    mock_context.user_data['expense_obj'] = Expense(1)
+    for state, tipo in enumerate(['gasto', 'ingreso', 'gasto']):
+        mock_context.user_data['expense_obj'].tipo = tipo
+        sm.push(mock_update_message, mock_context, state, None)
+    state, _, _ = sm.pop(mock_context)
+    assert state == 1
+    assert mock_context.user_data['expense_obj'].tipo == 'ingreso'
+    # El handler al que se vuelve hace su push y se puede seguir volviendo atrás
+    sm.push(mock_update_message, mock_context, state, None)
+    state, _, _ = sm.pop(mock_context)
+    assert state == 0
+    assert mock_context.user_data['expense_obj'].tipo == 'gasto'
+
+
+def test_history_depth_is_capped(mock_update_message, mock_context):
+    sm = StateManager(max_depth=3)
+    for i in range(10):
+        mock_context.user_data[f'k{i}'] = i
+        sm.push(mock_update_message, mock_context, i, None)
+    history = mock_context.user_data[sm.HISTORY_KEY]
+    assert [entry.state for entry in history] == [7, 8, 9]
+    # El paso más antiguo conserva lo acumulado de los que se han descartado
+    assert sm._current_snapshot(history) == {f'k{i}': i for i in range(10)}
+
+
+def make_query(text="menu", reply_markup=None):
+    query = AsyncMock()
+    query.message = MagicMock(text=text, reply_markup=reply_markup)
+    return query
+
+
+@pytest.mark.asyncio
+async def test_update_send_message_skips_unchanged_edit():
+    sm = StateManager()
+    update = MagicMock(message=None, callback_query=make_query("Hola"))
+    result = await sm.update_send_message(update, MagicMock(), "Hola")
+    update.callback_query.answer.assert_awaited_once()
+    update.callback_query.edit_message_text.assert_not_awaited()
+    assert result is update.callback_query.message
+
+
+@pytest.mark.asyncio
+async def test_back_coalesces_edits_into_the_last_one(mock_context):
+    sm = StateManager()
+    update = MagicMock(message=None, callback_query=make_query())
+    update.callback_query.data = "2"
+
+    async def back_target(update, context):
+        await sm.update_send_message(update, context, "¿Qué quieres añadir?", reply_markup="teclado")
+        return 2
+
+    sm.register_handlers(back_target)
+    mock_context.user_data = {}
+    sm.push(update, mock_context, 1, back_target)
+    sm.push(update, mock_context, 2, back_target)
+
+    assert await sm.back(update, mock_context) == 2
+    update.callback_query.answer.assert_awaited_once()
+    update.callback_query.edit_message_text.assert_awaited_once_with("¿Qué quieres añadir?", reply_markup="teclado")
+
+
+@pytest.mark.asyncio
+async def test_answer_and_edit_take_one_round_trip():
+    api = FakeBotAPI()
+    await api.start()
+    sm = StateManager()
+
+    async def select_type(update, context):
+        await sm.update_send_message(update, context, "¿Categoría?")
+
+    application = ApplicationBuilder().token("1:test").base_url(api.base_url).request(InstrumentedRequest()).build()
+    application.add_handler(CallbackQueryHandler(select_type))
+    async with application:
+        update = Update.de_json(make_callback_update(1, 7, "2"), application.bot)
+        # Sin responder a nada: si fueran en serie el edit no saldría hasta tener la respuesta del answer
+        api.hold_responses()
+        processing = asyncio.create_task(application.process_update(update))
+        try:
+            await api.wait_for_calls("editMessageText", 1)
+            assert api.count("answerCallbackQuery") == 1
+        finally:
+            api.release_responses()
+            await processing
+    await api.stop()
+
+    assert api.count("answerCallbackQuery") == 1
+    assert api.count("editMessageText") == 1
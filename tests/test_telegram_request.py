@@ -0,0 +1,81 @@
+import asyncio
+import logging
+
+import pytest
+from telegram import Bot
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.testing.fake_bot_api import FakeBotAPI
+from src.settings import NETWORK_PROFILES
+from src.utils.telegram_request import (InstrumentedRequest, NetworkProfile, _request_kwargs, build_requests,
+                                        get_network_profile)
+
+
+def test_all_profiles_are_valid():
+    for name in NETWORK_PROFILES:
+        profile = get_network_profile(name)
+        assert profile.pool_size >= 1 and profile.updates_pool_size >= 1
+
+
+def test_unknown_profile_raises():
+    with pytest.raises(ValueError, match="no-existe"):
+        get_network_profile("no-existe")
+
+
+def test_request_kwargs_cap_keepalive_to_pool():
+    kwargs = _request_kwargs(4, NetworkProfile(keepalive_connections=64, keepalive_expiry=30.0))
+    limits = kwargs["httpx_kwargs"]["limits"]
+    assert kwargs["connection_pool_size"] == 4
+    assert limits.max_connections == 4
+    assert limits.max_keepalive_connections == 4
+    assert limits.keepalive_expiry == 30.0
+    assert kwargs["socket_options"]
+
+    assert _request_kwargs(4, NetworkProfile(tcp_nodelay=False))["socket_options"] is None
+
+
+def test_http2_falls_back_to_http1_without_h2(caplog):
+    try:
+        import h2 # noqa: F401
+        pytest.skip("h2 instalado, no hay fallback")
+    except ImportError:
+        pass
+    with caplog.at_level(logging.WARNING, logger="expense_bot.utils.telegram_request"):
+        request = InstrumentedRequest.from_profile(NetworkProfile(pool_size=2, http2=True))
+    assert request.http_version == "1.1"
+    assert "HTTP/2 no disponible" in caplog.text
+
+
+async def _send_during_long_poll(request: HTTPXRequest, updates_request: HTTPXRequest) -> None:
+    api = FakeBotAPI()
+    await api.start()
+    bot = Bot("1:test", base_url=api.base_url, request=request, get_updates_request=updates_request)
+    try:
+        async with bot:
+            poller = asyncio.create_task(bot.get_updates(timeout=5))
+            await asyncio.sleep(0.1) # el getUpdates ya está esperando
+            try:
+                await asyncio.gather(*(bot.send_message(chat_id=i, text="hola") for i in range(5)))
+            finally:
+                await api.stop_polling()
+                await poller
+    finally:
+        await api.stop()
+
+
+@pytest.mark.asyncio
+async def test_separate_pools_do_not_wait_for_long_poll():
+    request, updates_request = build_requests(NetworkProfile(pool_size=4, pool_timeout=0.5))
+    await asyncio.wait_for(_send_during_long_poll(request, updates_request), timeout=3)
+
+
+@pytest.mark.asyncio
+async def test_shared_single_connection_blocks_behind_long_poll():
+    # Lo que pasa con un HTTPXRequest por defecto para todo: su única conexión la tiene getUpdates
+    request = HTTPXRequest(pool_timeout=0.5)
+    with pytest.raises(TimedOut):
+        await _send_during_long_poll(request, request)
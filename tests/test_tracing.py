@@ -0,0 +1,128 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from scripts.analyze_traces import SpanRecord, critical_path, group_conversations, read_spans
+from src.models.expense import Expense
+from src.utils.async_io import run_io
+from src.utils.instrumentation import instrument_handler
+from src.utils.tracing import TRACE_KEY, Tracer, tracer
+from src.utils.write_queue import ExpenseWriteQueue
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.mark.asyncio
+async def test_conversation_steps_share_the_trace(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracer, "path", tmp_path / "traces.jsonl")
+    monkeypatch.setattr(tracer, "enabled", True)
+    context = SimpleNamespace(user_data={})
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=7))
+
+    async def trace_start(update, context):
+        await run_io(time.sleep, 0.01) # antes de tener traza: se le asigna al terminar el paso
+        tracer.start_trace(context)
+        with tracer.span("update_send_message", "telegram", method="reply_text"):
+            pass
+        return 1
+
+    async def trace_enter_save(update, context):
+        await run_io(time.sleep, 0.01)
+        context.user_data.clear() # clear_manager al terminar, la traza ya es del span
+        return -1
+
+    async def outside_conversation(update, context):
+        await run_io(time.sleep, 0)
+        return None
+
+    await tracer.start()
+    try:
+        await instrument_handler(outside_conversation)(update, SimpleNamespace(user_data={}))
+        await instrument_handler(trace_start, "entry")(update, context)
+        trace_id = context.user_data[TRACE_KEY]
+        await instrument_handler(trace_enter_save, "SAVE")(update, context)
+    finally:
+        await tracer.stop()
+
+    spans = read_lines(tmp_path / "traces.jsonl")
+    assert {span["trace"] for span in spans} == {trace_id}
+    assert [(s["name"], s["kind"]) for s in spans] == [
+        ("trace_start", "handler"), ("sleep", "storage"), ("update_send_message", "telegram"),
+        ("trace_enter_save", "handler"), ("sleep", "storage")]
+    start_span = spans[0]
+    assert start_span["parent"] is None and start_span["state"] == "entry" and start_span["user"] == 7
+    assert spans[1]["parent"] == spans[2]["parent"] == start_span["span"]
+    assert spans[1]["end"] - spans[1]["start"] >= 0.009
+    assert spans[2]["method"] == "reply_text"
+    assert start_span["start"] <= spans[1]["start"] and spans[2]["end"] <= start_span["end"]
+
+
+@pytest.mark.asyncio
+async def test_write_queue_flush_is_a_storage_span_of_the_saving_handler(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracer, "path", tmp_path / "traces.jsonl")
+    monkeypatch.setattr(tracer, "enabled", True)
+
+    class Repository:
+        def save_many(self, expenses, sync=False):
+            time.sleep(0.01)
+
+    queue = ExpenseWriteQueue(Repository(), batch_size=10, flush_interval=10)
+    context = SimpleNamespace(user_data={TRACE_KEY: "conversacion"})
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=7))
+
+    async def trace_enter_save(update, context):
+        assert await queue.save(Expense(7), timeout=5)
+        return -1
+
+    await tracer.start()
+    await queue.start()
+    try:
+        await instrument_handler(trace_enter_save, "SAVE")(update, context)
+    finally:
+        await queue.stop()
+        await tracer.stop()
+
+    handler, flush = read_lines(tmp_path / "traces.jsonl")
+    assert handler["name"] == "trace_enter_save"
+    assert (flush["name"], flush["kind"], flush["batch"]) == ("ExpenseWriteQueue.flush", "storage", 1)
+    assert flush["trace"] == "conversacion" and flush["parent"] == handler["span"]
+    assert flush["end"] - flush["start"] >= 0.009
+
+
+@pytest.mark.asyncio
+async def test_writer_rotates_the_file(tmp_path):
+    writer = Tracer(path=tmp_path / "traces.jsonl", enabled=True, max_bytes=300, backup_count=2, flush_interval=60)
+    await writer.start()
+    for _ in range(4):
+        writer._buffer.append("x" * 199 + "\n")
+        await writer.flush()
+    await writer.stop()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"]
+    assert (tmp_path / "traces.jsonl").stat().st_size == 200
+
+
+def span(name, start, end, parent=None, kind="handler", span_id=None):
+    return SpanRecord("t1", span_id or name, parent, name, kind, start, end, "S", 7)
+
+
+def test_critical_path_follows_the_chain_that_ends_last(tmp_path):
+    spans = [
+        span("enter_save", 0.0, 1.0),
+        span("check_user", 0.0, 0.3, "enter_save", "storage"),
+        span("save_many", 0.1, 0.6, "enter_save", "storage"), # se solapa y acaba después: es la crítica
+        span("update_send_message", 0.6, 0.95, "enter_save", "telegram"),
+    ]
+    path = tmp_path / "traces.jsonl"
+    path.write_text("".join(json.dumps(s._asdict()) + "\n" for s in spans) + "basura\n", encoding="utf-8")
+
+    [conversation] = group_conversations(read_spans([path]))
+    critical = [(depth, s.name) for depth, s in critical_path(conversation.steps[0], conversation.children)]
+    assert critical == [(0, "enter_save"), (1, "save_many"), (1, "update_send_message")]
+    assert conversation.busy == pytest.approx(1.0)
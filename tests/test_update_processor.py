@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.testing.fake_bot_api import FakeBotAPI, make_callback_update, make_message_update
+from src.utils.update_processor import PerUserUpdateProcessor
+from src.utils.persistence import SqlitePersistence
+from src.utils.user_utils import user_registry
+import src.handlers.conversations.new_enter_expense as psm
+
+
+def make_update(update_id, user_id):
+    return Update.de_json(make_message_update(update_id, user_id, "hola"), None)
+
+
+@pytest.mark.asyncio
+async def test_same_user_is_serialized_other_users_run_in_parallel():
+    processor = PerUserUpdateProcessor(max_concurrent_updates=10)
+    running, max_running, order = {}, {}, []
+    total_peak = 0
+
+    async def handle(user_id, n):
+        nonlocal total_peak
+        running[user_id] = running.get(user_id, 0) + 1
+        max_running[user_id] = max(max_running.get(user_id, 0), running[user_id])
+        total_peak = max(total_peak, sum(running.values()))
+        await asyncio.sleep(0.01)
+        order.append((user_id, n))
+        running[user_id] -= 1
+
+    tasks = [
+        asyncio.create_task(processor.process_update(make_update(i * 10 + n, user_id), handle(user_id, n)))
+        for i, (user_id, n) in enumerate((u, n) for n in range(3) for u in (1, 2, 3))
+    ]
+    await asyncio.gather(*tasks)
+
+    assert max_running == {1: 1, 2: 1, 3: 1}
+    for user_id in (1, 2, 3):
+        assert [n for u, n in order if u == user_id] == [0, 1, 2]
+    assert total_peak == 3 # los 3 usuarios a la vez, uno de cada
+    assert processor.active_users == 0
+
+
+@pytest.mark.asyncio
+async def test_running_limit_is_respected():
+    processor = PerUserUpdateProcessor(max_concurrent_updates=2)
+    running, peak = 0, 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.005)
+        running -= 1
+
+    await asyncio.gather(*(processor.process_update(make_update(i, i), handle()) for i in range(10)))
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_100_users_do_not_leak_state(tmp_path, monkeypatch):
+    users = list(range(5000, 5100))
+    monkeypatch.setattr(user_registry, "_users", frozenset(users))
+    api = FakeBotAPI(rtt=0.002)
+    await api.start()
+
+    application = (
+        ApplicationBuilder()
+        .token("1:test")
+        .base_url(api.base_url)
+        .persistence(SqlitePersistence(tmp_path / "state.db"))
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent_updates=32))
+        .build()
+    )
+    application.add_handler(psm.conv_new_enter_expense)
+
+    spending = str(int(psm.ConvState.SPENDING_ENTRY))
+    update_ids = iter(range(1, 10_000))
+
+    def steps(user_id):
+        # Los pares se equivocan de importe y vuelven atrás con /back antes de poner el bueno
+        yield make_message_update(next(update_ids), user_id, "/start")
+        yield make_callback_update(next(update_ids), user_id, spending)
+        if user_id % 2 == 0:
+            yield make_message_update(next(update_ids), user_id, "1")
+            yield make_message_update(next(update_ids), user_id, "/back")
+        yield make_message_update(next(update_ids), user_id, f"{user_id}.5")
+
+    async with application:
+        await application.start()
+        # Todos a la vez: primero el paso 1 de cada usuario, luego el 2...
+        per_user = [list(steps(user_id)) for user_id in users]
+        for i in range(max(len(s) for s in per_user)):
+            for user_steps in per_user:
+                if i < len(user_steps):
+                    await application.update_queue.put(Update.de_json(user_steps[i], application.bot))
+
+        for _ in range(500):
+            if application.update_queue.empty() and application.update_processor.current_concurrent_updates == 0:
+                break
+            await asyncio.sleep(0.01)
+        await application.stop()
+
+    await api.stop()
+
+    for user_id in users:
+        user_data = application.user_data[user_id]
+        expense = user_data["expense_obj"]
+        assert expense.user == user_id
+        assert expense.tipo == "gasto"
+        assert expense.importe == user_id + 0.5
+        # Solo los que han hecho /back tienen guardado su comando de vuelta
+        assert (psm.state_manager.BACK_COMMAND_KEY in user_data) == (user_id % 2 == 0)
@@ -0,0 +1,48 @@
+import asyncio
+import json
+import pytest
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.utils import user_utils
+from src.utils.user_utils import UserRegistry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps([1, 2]))
+    registry = UserRegistry(path)
+    monkeypatch.setattr(user_utils, 'user_registry', registry)
+    monkeypatch.setattr(user_utils, 'REGISTER_PWD', 'secreto')
+    return registry
+
+
+def test_check_user_reads_file_once(registry, monkeypatch):
+    assert user_utils.check_user(1)
+    monkeypatch.setattr(registry, 'load', lambda: pytest.fail("no debería releer"))
+    assert not user_utils.check_user(3)
+
+
+def test_missing_file(tmp_path):
+    assert 1 not in UserRegistry(tmp_path / "no_existe.json")
+
+
+@pytest.mark.asyncio
+async def test_add_user_persists_atomically(registry):
+    assert not await user_utils.add_user(3, 'mala')
+    assert await user_utils.add_user(3, 'secreto')
+    assert not await user_utils.add_user(3, 'secreto')
+    assert json.loads(registry.path.read_text()) == [1, 2, 3]
+    # No quedan temporales en el directorio
+    assert [p.name for p in registry.path.parent.iterdir()] == ["users.json"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_registrations(registry):
+    results = await asyncio.gather(*(registry.register(uid) for uid in [10, 11, 10, 12, 11]))
+    assert sorted(results) == [False, False, True, True, True]
+    assert json.loads(registry.path.read_text()) == [1, 2, 10, 11, 12]
+    assert all(uid in registry for uid in (10, 11, 12))
@@ -0,0 +1,71 @@
+import asyncio
+import socket
+
+import httpx
+import pytest
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.testing.fake_bot_api import FakeBotAPI, WebhookSender, make_message_update
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_webhook_receives_synthetic_updates():
+    api = FakeBotAPI()
+    await api.start()
+    received = []
+
+    async def echo(update, context):
+        received.append(update.message.text)
+        await update.message.reply_text(update.message.text)
+
+    application = ApplicationBuilder().token("1:test").base_url(api.base_url).build()
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/telegram"
+
+    async with application:
+        await application.start()
+        await application.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                                                webhook_url=url, secret_token="s3cret", max_connections=5)
+        assert api.webhook_url == url
+        assert api.calls[-1].params["max_connections"] == 5
+
+        async with WebhookSender(url, "s3cret") as sender:
+            assert await sender.send(make_message_update(1, 42, "hola")) == 200
+            await api.wait_for_calls("sendMessage", 1)
+
+        # Sin el secret token Telegram no es quien llama: se rechaza
+        async with WebhookSender(url, "otro") as sender:
+            assert await sender.send(make_message_update(2, 42, "intruso")) == 403
+
+        await asyncio.sleep(0.05)
+        await application.updater.stop()
+        await application.stop()
+
+    await api.stop()
+    assert received == ["hola"]
+    assert api.calls[-1].params["text"] == "hola"
+
+
+@pytest.mark.asyncio
+async def test_fake_api_stop_waits_for_requests_in_flight():
+    api = FakeBotAPI(rtt=0.1)
+    await api.start()
+    async with httpx.AsyncClient() as client:
+        request = asyncio.create_task(client.post(f"{api.base_url}1:test/getUpdates", json={"timeout": 10}))
+        while not api._polling:
+            await asyncio.sleep(0.01)
+        await api.stop()
+        # Ninguna tarea de tornado se queda durmiendo el rtt para que la cancele el cierre del bucle
+        assert api.in_flight == 0
+        response = await request
+    assert response.json() == {"ok": True, "result": []}
@@ -0,0 +1,192 @@
+import asyncio
+import pytest
+from datetime import datetime
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from src.models.expense import Expense
+from src.models.expense_repository import ExpenseRepository
+from src.utils.write_queue import ExpenseWriteQueue
+
+
+class FakeRepository(ExpenseRepository):
+    def __init__(self):
+        self.batches = []
+        self.syncs = 0
+
+    def save(self, expense):
+        raise AssertionError("la cola debería guardar por lotes")
+
+    def save_many(self, expenses, sync=False):
+        self.batches.append((list(expenses), sync))
+
+    def sync(self):
+        self.syncs += 1
+
+    def get_last_trip(self, user=None, n=1):
+        return None
+
+
+@pytest.mark.asyncio
+async def test_flush_on_batch_size():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo, batch_size=3, flush_interval=10)
+    await queue.start()
+    for i in range(3):
+        await queue.put(Expense(i))
+    await asyncio.sleep(0.05)
+    assert len(repo.batches) == 1
+    assert [e.user for e in repo.batches[0][0]] == [0, 1, 2]
+    assert repo.batches[0][1] is True   # modo 'batch': fsync en cada lote
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_flush_on_interval():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo, batch_size=100, flush_interval=0.05)
+    await queue.start()
+    await queue.put(Expense(1))
+    await queue.put(Expense(2))
+    await asyncio.sleep(0.2)
+    assert [len(batch) for batch, _ in repo.batches] == [2]
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_queue():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo, batch_size=100, flush_interval=10)
+    await queue.start()
+    for i in range(5):
+        await queue.put(Expense(i))
+    await queue.stop()
+    assert sum(len(batch) for batch, _ in repo.batches) == 5
+    assert not queue.running
+
+
+@pytest.mark.asyncio
+async def test_interval_durability_syncs_later():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo, batch_size=1, flush_interval=10, durability='interval', sync_interval=0.05)
+    await queue.start()
+    await queue.put(Expense(1))
+    await asyncio.sleep(0.01)
+    assert repo.batches == [([repo.batches[0][0][0]], False)]
+    await asyncio.sleep(0.15)
+    assert repo.syncs == 1
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_put_without_start_saves_directly():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo)
+    await queue.put(Expense(1))
+    assert len(repo.batches) == 1
+
+
+def test_unknown_durability():
+    with pytest.raises(ValueError):
+        ExpenseWriteQueue(FakeRepository(), durability='nunca')
+
+
+class FlakyRepository(FakeRepository):
+    """Falla las primeras fails escrituras"""
+    def __init__(self, fails):
+        super().__init__()
+        self.fails = fails
+
+    def save_many(self, expenses, sync=False):
+        if self.fails:
+            self.fails -= 1
+            raise OSError("disco lleno")
+        super().save_many(expenses, sync)
+
+
+def trip_expense(user, viaje):
+    expense = Expense(user)
+    expense._fecha = datetime.today().strftime('%d/%m/%Y')
+    expense.viaje = viaje
+    return expense
+
+
+@pytest.mark.asyncio
+async def test_put_future_completes_when_written():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo, batch_size=2, flush_interval=10)
+    await queue.start()
+    first = await queue.put(Expense(1))
+    assert not first.done() and repo.batches == []
+    second = await queue.put(Expense(2))
+    await asyncio.gather(first, second)
+    assert [e.user for e in repo.batches[0][0]] == [1, 2]
+    assert queue.depth == 0
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_save_reports_whether_it_was_written():
+    queue = ExpenseWriteQueue(FlakyRepository(fails=100), batch_size=1, flush_interval=0.01)
+    await queue.start()
+    assert not await queue.save(Expense(1), timeout=0.05)
+    assert queue.depth == 1 # sigue pendiente, se reintenta
+    queue.repository.fails = 0
+    assert await queue.save(Expense(2), timeout=5)
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_before_newer_items():
+    repo = FlakyRepository(fails=1)
+    queue = ExpenseWriteQueue(repo, batch_size=2, flush_interval=0.01)
+    await queue.start()
+    futures = [await queue.put(Expense(i)) for i in range(2)]
+    await asyncio.sleep(0) # el primer lote (que va a fallar) ya está cogido
+    futures += [await queue.put(Expense(i)) for i in range(2, 5)]
+    await asyncio.gather(*futures)
+    await queue.stop()
+    assert [e.user for batch, _ in repo.batches for e in batch] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_last_trip_includes_unsaved_expenses():
+    class Repository(FakeRepository):
+        def get_last_trip(self, user=None, n=1):
+            return "Roma"
+
+    queue = ExpenseWriteQueue(Repository(), batch_size=100, flush_interval=10)
+    await queue.start()
+    await queue.put(trip_expense(1, "París"))
+    await queue.put(trip_expense(2, "Lisboa"))
+    assert await queue.get_last_trip(1) == "París"
+    assert await queue.get_last_trip() == "Lisboa"
+    assert await queue.get_last_trip(3) == "Roma"
+    await queue.stop()
+    assert await queue.get_last_trip(1) == "Roma"
+
+
+@pytest.mark.asyncio
+async def test_save_on_an_idle_queue_does_not_wait_for_the_interval():
+    repo = FakeRepository()
+    queue = ExpenseWriteQueue(repo, batch_size=50, flush_interval=60)
+    await queue.start()
+    # Con la cola vacía el lote sale enseguida; antes esperaba los 60 s de flush_interval
+    assert await queue.save(Expense(1), timeout=5)
+    assert [len(batch) for batch, _ in repo.batches] == [1]
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_does_not_hang_on_a_failing_full_batch():
+    queue = ExpenseWriteQueue(FlakyRepository(fails=10**6), batch_size=1, flush_interval=0.01)
+    await queue.start()
+    saved = await queue.put(Expense(1))
+    await asyncio.sleep(0.05) # el lote ya ha fallado al menos una vez y está por reintentar
+    await asyncio.wait_for(queue.stop(), 5)
+    assert not queue.running
+    with pytest.raises(OSError):
+        await saved
+    assert queue.depth == 0